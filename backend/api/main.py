@@ -1,21 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import date, timedelta
+import asyncio
 import os
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models import Base, engine, get_db
+from models import engine, get_db, models
 from schemas import schemas
-from services import crud
+from services import (
+    admin, coediting, coordination, crud, encoding, events, group_commit, idempotency, memory, metrics,
+    open_dental, patient_lookup, prefetch, profiling, push_queue, query_log, read_cache, serialization,
+    traffic_capture,
+)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Schema changes run as an explicit step (python -m models.migrations) before
+# workers start. AUTO_MIGRATE=1 runs it at startup for local development.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
+# Seconds shutdown waits for in-flight writes before closing the engine
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "15"))
 
-app = FastAPI(title="Anesthesia Record API")
+app = FastAPI(title="Anesthesia Record API", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -26,12 +38,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(query_log.QueryLogMiddleware)
+# Opt-in: TRAFFIC_CAPTURE=<file> records scrubbed traffic for benchmarks/replay.py
+if traffic_capture.TRAFFIC_CAPTURE:
+    app.add_middleware(traffic_capture.CaptureMiddleware)
+# Outermost, so the timings include CORS handling and response encoding
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+push_worker = push_queue.PushWorker()
+prefetch_scheduler = prefetch.PrefetchScheduler()
+
 # Initialize default medications
 @app.on_event("startup")
 async def startup_event():
-    db = next(get_db())
-    crud.initialize_default_medications(db)
-    db.close()
+    if AUTO_MIGRATE:
+        from models.migrations import migrate
+        # Workers starting together take turns
+        with coordination.write_lock():
+            migrate()
+    else:
+        # The migration step seeds the reference data; workers only read
+        db = next(get_db())
+        try:
+            crud.get_medications(db)
+        except OperationalError as e:
+            raise RuntimeError("Database schema is missing or outdated; run `python -m models.migrations`") from e
+        finally:
+            db.close()
+    
+    memory.memory_watch.start()
+    if open_dental.is_configured():
+        app.state.leader_task = asyncio.create_task(lead_background_jobs())
+
+async def lead_background_jobs():
+    # Only one worker process sends pushes and runs the prefetch. The others
+    # keep retrying so the role moves on when the leader is recycled.
+    while not coordination.acquire_leadership():
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    push_worker.start()
+    if prefetch.PREFETCH_AT:
+        prefetch_scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    leader_task = getattr(app.state, "leader_task", None)
+    if leader_task:
+        leader_task.cancel()
+    await prefetch_scheduler.stop()
+    await push_worker.stop()
+    await memory.memory_watch.stop()
+    open_dental.close_client()
+    await asyncio.to_thread(group_commit.committer.stop)
+    await asyncio.to_thread(coordination.drain_writes, SHUTDOWN_DRAIN_TIMEOUT)
+    coordination.release_leadership()
+    engine.dispose()
+
+# Monitoring
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # Patient endpoints
 @app.get("/api/patients/{open_dental_id}", response_model=schemas.Patient)
@@ -41,87 +108,236 @@ def get_patient_by_open_dental_id(open_dental_id: str, db: Session = Depends(get
         raise HTTPException(status_code=404, detail="Patient not found")
     return patient
 
+# Writes run through coordination.run_write() or group_commit.run(), in the
+# endpoint's own thread, and return serialized rows
+def _create_patient(db: Session, patient: schemas.PatientCreate):
+    return serialization.serialize(crud.create_patient(db, patient), schemas.Patient)
+
 @app.post("/api/patients/", response_model=schemas.Patient)
-def create_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db)):
-    return crud.create_patient(db, patient)
+def create_patient(patient: schemas.PatientCreate):
+    return coordination.run_write(_create_patient, patient)
 
 # Location endpoints
 @app.get("/api/locations/", response_model=List[schemas.Location])
 def get_locations(db: Session = Depends(get_db)):
-    return crud.get_locations(db)
+    return read_cache.get_locations(db)
+
+def _create_location(db: Session, location: schemas.LocationCreate):
+    return serialization.serialize(crud.create_location(db, location), schemas.Location)
 
 @app.post("/api/locations/", response_model=schemas.Location)
-def create_location(location: schemas.LocationCreate, db: Session = Depends(get_db)):
-    return crud.create_location(db, location)
+def create_location(location: schemas.LocationCreate):
+    db_location = coordination.run_write(_create_location, location)
+    read_cache.invalidate_reference()
+    return db_location
 
 # Provider endpoints
 @app.get("/api/providers/", response_model=List[schemas.Provider])
 def get_providers(role: str = None, db: Session = Depends(get_db)):
-    return crud.get_providers(db, role)
+    return read_cache.get_providers(db, role)
+
+def _create_provider(db: Session, provider: schemas.ProviderCreate):
+    return serialization.serialize(crud.create_provider(db, provider), schemas.Provider)
 
 @app.post("/api/providers/", response_model=schemas.Provider)
-def create_provider(provider: schemas.ProviderCreate, db: Session = Depends(get_db)):
-    return crud.create_provider(db, provider)
+def create_provider(provider: schemas.ProviderCreate):
+    db_provider = coordination.run_write(_create_provider, provider)
+    read_cache.invalidate_reference()
+    return db_provider
 
 # Medication endpoints
 @app.get("/api/medications/", response_model=List[schemas.Medication])
 def get_medications(db: Session = Depends(get_db)):
-    return crud.get_medications(db)
+    return read_cache.get_medications(db)
+
+def _create_medication(db: Session, medication: schemas.MedicationCreate):
+    return serialization.serialize(crud.create_medication(db, medication), schemas.Medication)
 
 @app.post("/api/medications/", response_model=schemas.Medication)
-def create_medication(medication: schemas.MedicationCreate, db: Session = Depends(get_db)):
-    return crud.create_medication(db, medication)
+def create_medication(medication: schemas.MedicationCreate):
+    db_medication = coordination.run_write(_create_medication, medication)
+    read_cache.invalidate_reference()
+    return db_medication
 
 # Medication inventory endpoints
 @app.get("/api/inventory/location/{location_id}", response_model=List[schemas.MedicationInventory])
 def get_inventory_by_location(location_id: int, db: Session = Depends(get_db)):
     return crud.get_inventory_by_location(db, location_id)
 
+def _add_inventory(db: Session, inventory: schemas.MedicationInventoryCreate):
+    return serialization.serialize(crud.add_inventory(db, inventory), schemas.MedicationInventory)
+
 @app.post("/api/inventory/", response_model=schemas.MedicationInventory)
-def add_inventory(inventory: schemas.MedicationInventoryCreate, db: Session = Depends(get_db)):
-    return crud.add_inventory(db, inventory)
+def add_inventory(inventory: schemas.MedicationInventoryCreate):
+    return coordination.run_write(_add_inventory, inventory)
 
 # Anesthesia record endpoints
+def sparse_record_params(
+    fields: Optional[str] = Query(None, description="Comma-separated record columns, e.g. id,anesthesia_start,aldrete_total"),
+    include: Optional[str] = Query(None, description="Comma-separated relationships: patient, vitals, administrations, administrations.medication"),
+):
+    try:
+        return serialization.parse_sparse(fields, include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/records/draft", response_model=schemas.AnesthesiaRecord)
+def get_draft_record(
+    open_dental_id: str,
+    location_id: Optional[int] = None,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    # Shell created by the prefetch job for today's appointment
+    record = read_cache.get_draft_record(db, open_dental_id, location_id, date.today())
+    if not record:
+        raise HTTPException(status_code=404, detail="No draft record for today")
+    return encoding.render_record(record, encoding.negotiate(accept))
+
 @app.get("/api/records/{record_id}", response_model=schemas.AnesthesiaRecord)
-def get_record(record_id: int, db: Session = Depends(get_db)):
-    record = crud.get_anesthesia_record(db, record_id)
+def get_record(
+    record_id: int,
+    sparse=Depends(sparse_record_params),
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    if sparse:
+        record = read_cache.get_record_sparse(db, record_id, sparse)
+    else:
+        record = read_cache.get_record(db, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
-    return record
+    # Already serialized from trusted rows; returning a response skips
+    # response_model re-validation
+    return encoding.render_record(record, encoding.negotiate(accept))
+
+def _create_record(db: Session, record: schemas.AnesthesiaRecordCreate, idempotency_key: Optional[str]):
+    key = idempotency.lookup(db, idempotency_key, "/api/records/", record, models.AnesthesiaRecord)
+    if key is not None and key.resource_id is not None:
+        return idempotency.replayed(serialization.serialize_record(crud.get_anesthesia_record(db, key.resource_id)))
+    return serialization.serialize_record(crud.create_anesthesia_record(db, record, key))
 
 @app.post("/api/records/", response_model=schemas.AnesthesiaRecord)
-def create_record(record: schemas.AnesthesiaRecordCreate, db: Session = Depends(get_db)):
-    return crud.create_anesthesia_record(db, record)
+def create_record(record: schemas.AnesthesiaRecordCreate, idempotency_key: Optional[str] = Header(None)):
+    return coordination.run_write(_create_record, record, idempotency_key)
+
+# group_commit.run() may batch the writes below with others
+def _update_record(db: Session, record_id: int, record: schemas.AnesthesiaRecordUpdate):
+    # A write based on a stale "version" is rejected with the current record
+    # so the client can merge and retry
+    try:
+        db_record = crud.update_anesthesia_record(db, record_id, record)
+    except crud.VersionConflict as e:
+        # A response rather than HTTPException: its handler cannot encode datetimes
+        return ORJSONResponse(status_code=409, content={"detail": {
+            "message": str(e),
+            "record": serialization.serialize_record(e.current),
+        }})
+    if not db_record:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return serialization.serialize_record(db_record)
 
 @app.put("/api/records/{record_id}", response_model=schemas.AnesthesiaRecord)
-def update_record(record_id: int, record: schemas.AnesthesiaRecordUpdate, db: Session = Depends(get_db)):
-    return crud.update_anesthesia_record(db, record_id, record)
+def update_record(record_id: int, record: schemas.AnesthesiaRecordUpdate):
+    try:
+        return group_commit.run(_update_record, record_id, record)
+    finally:
+        read_cache.invalidate_record(record_id)
+
+def _change_record_fields(db: Session, record_id: int, body: schemas.FieldChanges):
+    result = crud.apply_field_changes(db, record_id, body.changes, body.station)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return result
+
+@app.patch("/api/records/{record_id}/fields", response_model=schemas.FieldChangeResult)
+def change_record_fields(record_id: int, body: schemas.FieldChanges):
+    # Field-level deltas with per-field version checks, see services/coediting.py
+    result = group_commit.run(_change_record_fields, record_id, body)
+    read_cache.invalidate_record(record_id)
+    return result
+
+@app.websocket("/api/records/{record_id}/edit")
+async def co_edit_record(websocket: WebSocket, record_id: int):
+    await coediting.run_station(websocket, record_id)
 
 # Medication administration endpoints
+def _add_medication_administration(db: Session, record_id: int, administration: schemas.MedicationAdministrationBase,
+                                   idempotency_key: Optional[str]):
+    # A retried dose must not be recorded, or taken from inventory, twice
+    key = idempotency.lookup(db, idempotency_key, f"/api/records/{record_id}/medications/", administration,
+                             models.MedicationAdministration)
+    if key is not None and key.resource_id is not None:
+        return idempotency.replayed(serialization.serialize(
+            db.get(models.MedicationAdministration, key.resource_id), schemas.MedicationAdministration))
+    admin_create = schemas.MedicationAdministrationCreate(
+        record_id=record_id,
+        **administration.dict()
+    )
+    db_admin = crud.add_medication_administration(db, admin_create, key)
+    return serialization.serialize(db_admin, schemas.MedicationAdministration)
+
 @app.post("/api/records/{record_id}/medications/", response_model=schemas.MedicationAdministration)
 def add_medication_administration(
     record_id: int,
     administration: schemas.MedicationAdministrationBase,
+    idempotency_key: Optional[str] = Header(None)
+):
+    result = group_commit.run(_add_medication_administration, record_id, administration, idempotency_key)
+    read_cache.invalidate_record(record_id)
+    return result
+
+# Vital signs endpoints
+@app.get("/api/records/{record_id}/vitals/", response_model=List[schemas.VitalSign])
+def get_vital_signs(
+    record_id: int,
+    since: Optional[int] = Query(None, description="Cursor: only vitals with a greater id"),
+    accept: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    admin_create = schemas.MedicationAdministrationCreate(
+    # Columnar JSON or MessagePack on request, see services/encoding.py
+    vitals = read_cache.get_vitals(db, record_id, since)
+    if vitals is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    response = encoding.render_vitals(vitals, encoding.negotiate(accept))
+    # Cursor for the next poll, also when nothing new arrived
+    response.headers["X-Vitals-Cursor"] = str(max((v["id"] for v in vitals), default=since or 0))
+    return response
+
+def _add_vital_sign(db: Session, record_id: int, vital_sign: schemas.VitalSignBase, idempotency_key: Optional[str]):
+    key = idempotency.lookup(db, idempotency_key, f"/api/records/{record_id}/vitals/", vital_sign, models.VitalSign)
+    if key is not None and key.resource_id is not None:
+        return idempotency.replayed(serialization.serialize(db.get(models.VitalSign, key.resource_id),
+                                                            schemas.VitalSign))
+    vital_create = schemas.VitalSignCreate(
         record_id=record_id,
-        **administration.dict()
+        **vital_sign.dict()
     )
-    return crud.add_medication_administration(db, admin_create)
+    db_vital = crud.add_vital_sign(db, vital_create, key)
+    return serialization.serialize(db_vital, schemas.VitalSign)
 
-# Vital signs endpoints
 @app.post("/api/records/{record_id}/vitals/", response_model=schemas.VitalSign)
 def add_vital_sign(
     record_id: int,
     vital_sign: schemas.VitalSignBase,
-    db: Session = Depends(get_db)
+    idempotency_key: Optional[str] = Header(None)
 ):
-    vital_create = schemas.VitalSignCreate(
-        record_id=record_id,
-        **vital_sign.dict()
+    result = group_commit.run(_add_vital_sign, record_id, vital_sign, idempotency_key)
+    read_cache.invalidate_record(record_id)
+    return result
+
+# Change events
+@app.get("/api/records/{record_id}/events", response_class=StreamingResponse)
+async def stream_record_events(record_id: int, last_event_id: Optional[str] = Header(None)):
+    # text/event-stream for EventSource; see services/events.py for the event types
+    marks = await events.get_marks(record_id)
+    if marks is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return StreamingResponse(
+        events.stream(record_id, last_event_id, marks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return crud.add_vital_sign(db, vital_create)
 
 # Export endpoints
 @app.get("/api/records/{record_id}/export/markdown")
@@ -131,36 +347,135 @@ def export_markdown(record_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Record not found")
     return {"markdown": crud.generate_anesthesia_note(record)}
 
-@app.get("/api/records/{record_id}/export/json")
-def export_json(record_id: int, db: Session = Depends(get_db)):
-    record = crud.get_anesthesia_record(db, record_id)
+@app.get("/api/records/{record_id}/export/json", response_model=schemas.AnesthesiaRecord)
+def export_json(
+    record_id: int,
+    sparse=Depends(sparse_record_params),
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    if sparse:
+        record = crud.get_anesthesia_record_partial(db, record_id, sparse.columns, sparse.relationships)
+    else:
+        record = crud.get_anesthesia_record(db, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
-    return schemas.AnesthesiaRecord.from_orm(record)
+    if sparse:
+        data = serialization.serialize_record_sparse(record, sparse)
+    else:
+        data = serialization.serialize_record(record)
+    return encoding.render_record(data, encoding.negotiate(accept))
 
-# Open Dental integration stubs
-@app.post("/api/open-dental/push-record/{record_id}")
-def push_to_open_dental(record_id: int, db: Session = Depends(get_db)):
-    # Stub for Open Dental integration
+# Open Dental integration
+def _enqueue_push(db: Session, record_id: int):
     record = crud.get_anesthesia_record(db, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
-    
-    # TODO: Implement actual Open Dental API integration
-    return {"status": "success", "message": "Record pushed to Open Dental (stub)"}
-
-@app.get("/api/open-dental/patient/{patient_id}")
-def get_open_dental_patient(patient_id: str):
-    # Stub for Open Dental patient data retrieval
-    # TODO: Implement actual Open Dental API integration
-    return {
-        "open_dental_id": patient_id,
-        "first_name": "John",
-        "last_name": "Doe",
-        "date_of_birth": "1990-01-01",
-        "medical_record_number": "MRN123456"
-    }
+    return serialization.serialize(push_queue.enqueue_push(db, record), schemas.OpenDentalPush)
+
+@app.post("/api/open-dental/push-record/{record_id}", status_code=202, response_model=schemas.OpenDentalPush)
+def push_to_open_dental(record_id: int):
+    # Delivery happens in the background worker so a slow Open Dental
+    # server never stalls the caller
+    push = coordination.run_write(_enqueue_push, record_id)
+    push_worker.notify()
+    return push
+
+@app.get("/api/open-dental/pushes/{push_id}", response_model=schemas.OpenDentalPush)
+def get_open_dental_push(push_id: int, db: Session = Depends(get_db)):
+    push = push_queue.get_push(db, push_id)
+    if not push:
+        raise HTTPException(status_code=404, detail="Push not found")
+    return push
+
+@app.get("/api/open-dental/patient/{patient_id}", response_model=schemas.Patient)
+def get_open_dental_patient(patient_id: str, db: Session = Depends(get_db)):
+    try:
+        patient = patient_lookup.lookup_patient(db, patient_id)
+    except open_dental.OpenDentalError as e:
+        raise HTTPException(status_code=502, detail=f"Open Dental unavailable: {e}")
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found in Open Dental")
+    return patient
+
+@app.post("/api/open-dental/prefetch", response_model=schemas.PrefetchSummary)
+def run_open_dental_prefetch(day: Optional[date] = None, db: Session = Depends(get_db)):
+    # Manual trigger for the scheduled job; defaults to tomorrow
+    try:
+        return prefetch.prefetch_day(db, day or date.today() + timedelta(days=1))
+    except open_dental.OpenDentalError as e:
+        raise HTTPException(status_code=502, detail=f"Open Dental unavailable: {e}")
+
+@app.get("/api/open-dental/patient-cache/stats")
+def get_patient_cache_stats():
+    return patient_lookup.cache_stats()
+
+# Admin: profiling (requires ADMIN_TOKEN, see services/admin.py)
+@app.post("/api/admin/profiling/requests", dependencies=[Depends(admin.require_admin)])
+def set_request_profiling(enabled: bool, route: Optional[str] = None):
+    # Profile every request, or only paths starting with `route`, in every worker
+    return profiling.set_request_profiling(enabled, route)
+
+@app.post("/api/admin/profiling/sample", status_code=202, dependencies=[Depends(admin.require_admin)])
+def start_sampling(seconds: float = 30, interval_ms: float = 10):
+    try:
+        return profiling.start_sampling(seconds, interval_ms).status()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/admin/profiling/sample", dependencies=[Depends(admin.require_admin)])
+def get_sampling_status():
+    status = profiling.sampling_status()
+    if status is None:
+        raise HTTPException(status_code=404, detail="No sampling window has run")
+    return status
+
+@app.get("/api/admin/profiling/files", dependencies=[Depends(admin.require_admin)])
+def list_profiles():
+    return profiling.list_profiles()
+
+@app.get("/api/admin/profiling/files/{name}", dependencies=[Depends(admin.require_admin)])
+def download_profile(name: str):
+    path = profiling.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+# Admin: memory (requires ADMIN_TOKEN)
+@app.get("/api/admin/memory", dependencies=[Depends(admin.require_admin)])
+def get_memory_status():
+    return memory.memory_watch.check()
+
+@app.post("/api/admin/memory/tracing", dependencies=[Depends(admin.require_admin)])
+def set_memory_tracing(enabled: bool):
+    memory.set_tracing(enabled)
+    return memory.memory_watch.status()
+
+@app.post("/api/admin/memory/snapshots", dependencies=[Depends(admin.require_admin)])
+def take_memory_snapshot(limit: int = 25):
+    try:
+        return memory.take_snapshot(limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/admin/memory/snapshots", dependencies=[Depends(admin.require_admin)])
+def list_memory_snapshots():
+    return memory.list_snapshots()
+
+@app.get("/api/admin/memory/diff", dependencies=[Depends(admin.require_admin)])
+def diff_memory_snapshots(base: Optional[int] = None, current: Optional[int] = None, limit: int = 25):
+    # Defaults to the oldest vs. the newest kept snapshot
+    try:
+        return memory.diff_snapshots(base, current, limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+profiling.instrument_routes(app)
 
 if __name__ == "__main__":
     import uvicorn
+    from models.migrations import migrate
+    migrate()
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
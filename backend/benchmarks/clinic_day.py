@@ -0,0 +1,253 @@
+"""Clinic-day load test against a running backend.
+
+    python -m benchmarks.clinic_day --operatories 8 --duration 60 --speed 10
+    python -m benchmarks.clinic_day --operatories 4 8 16 32 --duration 30   # find the ceiling
+
+Each operatory runs cases back to back for --duration seconds of wall time.
+A case creates a patient and a record via /api/records/, then on a simulated
+clock (compressed by --speed):
+
+  every --vitals-interval s   POST vitals, then GET the vitals table (the
+                              frontend's rerun)
+  every --autosave s          PUT the record (the frontend's autosave)
+  ~every --dose-minutes min   POST a medication administration
+  at close                    GET the markdown and JSON exports
+
+Reports throughput and p50/p95/p99 latency and errors per route for each
+--operatories level. Start the server yourself, or pass --spawn to run the
+production profile (gunicorn.conf.py) against a fresh SQLite file or
+--database-url.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNAR_JSON = "application/vnd.anesthesia.columnar+json"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies[route].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[route] += 1
+        return response if ok else None
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_case(client, recorder: Recorder, args, rng: random.Random, context: dict, case_number: str):
+    patient = await recorder.call(client, "POST /api/patients/", "POST", "/api/patients/", json={
+        "open_dental_id": f"load-{case_number}", "first_name": "Load", "last_name": case_number,
+        "date_of_birth": "1970-01-01T00:00:00",
+    })
+    if patient is None:
+        return
+    record = await recorder.call(client, "POST /api/records/", "POST", "/api/records/", json={
+        "patient_id": patient.json()["id"], "location_id": context["location_id"], "asa_class": "II",
+    })
+    if record is None:
+        return
+    record_id = record.json()["id"]
+    version = record.json()["version"]
+    base = f"/api/records/{record_id}"
+
+    case_seconds = args.case_minutes * 60
+    next_vitals = args.vitals_interval
+    next_autosave = args.autosave
+    next_dose = rng.expovariate(1 / (args.dose_minutes * 60))
+    clock = 0.0
+    while True:
+        upcoming = min(next_vitals, next_autosave, next_dose)
+        if upcoming > case_seconds or time.monotonic() >= context["stop_at"]:
+            break
+        await asyncio.sleep((upcoming - clock) / args.speed)
+        clock = upcoming
+        if clock == next_vitals:
+            await recorder.call(client, "POST /api/records/{id}/vitals/", "POST", f"{base}/vitals/", json={
+                "bp_systolic": rng.randint(100, 140), "bp_diastolic": rng.randint(60, 90),
+                "heart_rate": rng.randint(55, 100), "spo2": rng.randint(94, 100), "etco2": rng.randint(30, 45),
+            })
+            await recorder.call(client, "GET /api/records/{id}/vitals/", "GET", f"{base}/vitals/",
+                                headers={"Accept": COLUMNAR_JSON})
+            next_vitals += args.vitals_interval
+        elif clock == next_autosave:
+            saved = await recorder.call(client, "PUT /api/records/{id}", "PUT", base, json={
+                "notes": f"autosave at {clock:.0f}s", "o2_flow_rate": rng.choice([2.0, 4.0, 6.0]),
+                "version": version,
+            })
+            if saved is not None:
+                version = saved.json()["version"]
+            next_autosave += args.autosave
+        else:
+            await recorder.call(client, "POST /api/records/{id}/medications/", "POST", f"{base}/medications/", json={
+                "medication_id": rng.choice(context["medication_ids"]), "dose_ml": round(rng.uniform(0.5, 2), 1),
+            })
+            next_dose += rng.expovariate(1 / (args.dose_minutes * 60))
+
+    await recorder.call(client, "GET /api/records/{id}/export/markdown", "GET", f"{base}/export/markdown")
+    await recorder.call(client, "GET /api/records/{id}/export/json", "GET", f"{base}/export/json")
+
+
+async def operatory(client, recorder, args, context, number: int):
+    rng = random.Random(args.seed * 1000 + number)
+    case = 0
+    while time.monotonic() < context["stop_at"]:
+        case += 1
+        await run_case(client, recorder, args, rng, context, f"{context['run']}-{number}-{case}")
+
+
+async def run_level(args, operatories: int) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=operatories * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        medications = (await client.get("/api/medications/")).json()
+        location = (await client.post("/api/locations/", json={"name": f"Load test {time.time_ns()}"})).json()
+        context = {
+            "run": time.time_ns(),
+            "location_id": location["id"],
+            "medication_ids": [m["id"] for m in medications],
+            "stop_at": time.monotonic() + args.duration,
+        }
+        started = time.monotonic()
+        await asyncio.gather(*(operatory(client, recorder, args, context, n) for n in range(operatories)))
+        elapsed = time.monotonic() - started
+
+    routes = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        routes[route] = {
+            "requests": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "errors": recorder.errors[route],
+            "error_rate": recorder.errors[route] / len(values),
+        }
+    total = sum(r["requests"] for r in routes.values())
+    errors = sum(r["errors"] for r in routes.values())
+    all_values = sorted(v for values in recorder.latencies.values() for v in values)
+    return {
+        "operatories": operatories,
+        "elapsed_s": elapsed,
+        "requests": total,
+        "rps": total / elapsed if elapsed else 0,
+        "p50_ms": percentile(all_values, 50) * 1000,
+        "p95_ms": percentile(all_values, 95) * 1000,
+        "p99_ms": percentile(all_values, 99) * 1000,
+        "error_rate": errors / total if total else 0,
+        "routes": routes,
+    }
+
+
+def print_level(result: dict):
+    print(f"\n{result['operatories']} operatories: {result['requests']} requests in {result['elapsed_s']:.1f}s, "
+          f"{result['rps']:.1f} req/s, error rate {result['error_rate']:.2%}")
+    print(f"  {'route':<42} {'req':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, r in result["routes"].items():
+        print(f"  {route:<42} {r['requests']:>6} {r['rps']:>7.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['errors']:>7}")
+
+
+def wait_ready(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/medications/", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError("server did not become ready")
+
+
+@contextmanager
+def spawned_server(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": args.database_url or f"sqlite:///{tmp}/clinic_day.db",
+            "BIND": args.base_url.split("://", 1)[1],
+            "ACCESS_LOG": "",
+            "LOG_LEVEL": "warning",
+        })
+        if args.workers:
+            env["WEB_CONCURRENCY"] = str(args.workers)
+        subprocess.run([sys.executable, "-m", "models.migrations"], cwd=BACKEND_DIR, env=env,
+                       check=True, capture_output=True)
+        proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api.main:app"],
+                                cwd=BACKEND_DIR, env=env)
+        try:
+            wait_ready(args.base_url)
+            yield
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--operatories", type=int, nargs="+", default=[8])
+    parser.add_argument("--duration", type=float, default=60, help="wall-clock seconds per level")
+    parser.add_argument("--speed", type=float, default=10, help="simulated seconds per wall-clock second")
+    parser.add_argument("--case-minutes", type=float, default=90)
+    parser.add_argument("--vitals-interval", type=float, default=5, help="simulated seconds")
+    parser.add_argument("--autosave", type=float, default=30, help="simulated seconds")
+    parser.add_argument("--dose-minutes", type=float, default=10, help="mean simulated minutes between doses")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--spawn", action="store_true", help="start gunicorn for the run")
+    parser.add_argument("--workers", type=int, help="WEB_CONCURRENCY for --spawn")
+    parser.add_argument("--database-url", help="DATABASE_URL for --spawn (default: fresh SQLite file)")
+    args = parser.parse_args()
+
+    results = []
+    for operatories in args.operatories:
+        if args.spawn:
+            with spawned_server(args):
+                result = asyncio.run(run_level(args, operatories))
+        else:
+            result = asyncio.run(run_level(args, operatories))
+        print_level(result)
+        results.append(result)
+
+    if len(results) > 1:
+        print(f"\n{'operatories':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8}")
+        for r in results:
+            print(f"{r['operatories']:>11} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+                  f"{r['p99_ms']:>8.1f} {r['error_rate']:>8.2%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Cold-start benchmark: time from process spawn to the first successful request.
+
+    python -m benchmarks.cold_start --runs 5
+
+Each run starts a fresh uvicorn process against a database migrated once
+up front, polls GET /api/medications/ until it answers 200 and then stops
+the server. Reports per-run times and the median.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_first_request(url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"No response from {url} within {timeout}s")
+
+
+def run_once(env: dict, port: int, timeout: float) -> float:
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        wait_for_first_request(f"http://127.0.0.1:{port}/api/medications/", timeout)
+        return time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--database-url", help="Defaults to a throwaway SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp}/cold_start.db"
+        env.pop("AUTO_MIGRATE", None)
+        subprocess.run([sys.executable, "-m", "models.migrations"], cwd=BACKEND_DIR, env=env, check=True)
+
+        times = [run_once(env, args.port, args.timeout) for _ in range(args.runs)]
+
+    for i, elapsed in enumerate(times, 1):
+        print(f"run {i}: {elapsed * 1000:.0f} ms")
+    print(f"median time-to-first-request: {statistics.median(times) * 1000:.0f} ms "
+          f"(min {min(times) * 1000:.0f}, max {max(times) * 1000:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Microbenchmarks for the crud hot paths and record serialization.
+
+    python -m benchmarks.micro run                       # prints the results only
+    python -m benchmarks.micro run --output benchmarks/baselines/micro.json   # records a baseline
+    python -m benchmarks.micro run --output current.json
+    python -m benchmarks.micro compare benchmarks/baselines/micro.json current.json --tolerance 0.25
+    python -m benchmarks.micro run --compare benchmarks/baselines/micro.json
+
+Every benchmark runs against in-memory and file-backed SQLite (WAL, the
+app's synchronous setting) with an existing record of --sizes vital signs
+and size/10 administrations. Each crud call gets its own session, as a
+request would. Results are median and p95 in microseconds.
+
+compare exits non-zero when a benchmark's median is slower than the
+baseline by more than --tolerance (a fraction) and by more than
+--min-delta-us, so sub-microsecond noise on fast paths does not fail a
+build. Baselines are machine specific, so none is committed: record one
+on the machine that compares against it, from the commit to compare with.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, models
+from models.database import SQLITE_SYNCHRONOUS
+from schemas import schemas
+from services import crud, serialization
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro.json")
+
+
+def make_engine(storage: str, tmp: str):
+    if storage == "memory":
+        return create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    engine = create_engine(f"sqlite:///{tmp}/micro.db", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.close()
+    return engine
+
+
+def seed(Session, size: int) -> dict:
+    db = Session()
+    try:
+        crud.initialize_default_medications(db)
+        medication = db.query(models.Medication).first()
+        location = models.Location(name="Micro")
+        patient = models.Patient(open_dental_id="micro", first_name="Micro", last_name="Bench",
+                                 date_of_birth=datetime(1980, 1, 1))
+        db.add_all([location, patient])
+        db.flush()
+        db.add(models.MedicationInventory(medication_id=medication.id, location_id=location.id, quantity=1e9,
+                                          lot_number="L", expiration_date=datetime(2030, 1, 1), supplier="S",
+                                          invoice_number="I", date_received=datetime(2025, 1, 1)))
+        start = datetime(2025, 1, 1, 8, 0)
+        record = models.AnesthesiaRecord(patient_id=patient.id, location_id=location.id, asa_class="II",
+                                         monitors=["BP", "SpO2"], anesthesia_start=start)
+        db.add(record)
+        db.flush()
+        db.add_all(models.VitalSign(record_id=record.id, timestamp=start + timedelta(seconds=5 * i), bp_systolic=120,
+                                    bp_diastolic=80, map=93, heart_rate=70, spo2=98, etco2=35, temperature=36.8)
+                   for i in range(size))
+        db.add_all(models.MedicationAdministration(record_id=record.id, medication_id=medication.id, dose_ml=1.0,
+                                                   timestamp=start + timedelta(minutes=i))
+                   for i in range(max(1, size // 10)))
+        db.commit()
+        return {"record_id": record.id, "patient_id": patient.id, "location_id": location.id,
+                "medication_id": medication.id}
+    finally:
+        db.close()
+
+
+def with_session(Session, fn):
+    def run():
+        db = Session()
+        try:
+            fn(db)
+        finally:
+            db.close()
+    return run
+
+
+def benchmarks(Session, ids: dict):
+    record_id = ids["record_id"]
+    loaded_db = Session()
+    record = crud.get_anesthesia_record(loaded_db, record_id)
+
+    def update(db):
+        # The record is already in the session when the update looks it up
+        version = db.get(models.AnesthesiaRecord, record_id).version
+        crud.update_anesthesia_record(
+            db, record_id, schemas.AnesthesiaRecordUpdate(notes="micro", o2_flow_rate=4.0, version=version))
+
+    def decrement(db):
+        crud.decrement_inventory(db, ids["medication_id"], ids["location_id"], 0.001)
+        db.commit()
+
+    return loaded_db, {
+        "create_anesthesia_record": with_session(Session, lambda db: crud.create_anesthesia_record(
+            db, schemas.AnesthesiaRecordCreate(patient_id=ids["patient_id"], location_id=ids["location_id"]))),
+        "update_anesthesia_record": with_session(Session, update),
+        "add_medication_administration": with_session(Session, lambda db: crud.add_medication_administration(
+            db, schemas.MedicationAdministrationCreate(record_id=record_id, medication_id=ids["medication_id"],
+                                                       dose_ml=0.5))),
+        "decrement_inventory": with_session(Session, decrement),
+        "get_anesthesia_record": with_session(Session, lambda db: crud.get_anesthesia_record(db, record_id)),
+        "generate_anesthesia_note": lambda: crud.generate_anesthesia_note(record),
+        "schema_validate_dump": lambda: schemas.AnesthesiaRecord.model_validate(record).model_dump(mode="json"),
+        "trusted_serialize": lambda: serialization.serialize_record(record),
+    }
+
+
+def measure(fn, iterations: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "median_us": round(statistics.median(times) * 1e6, 1),
+        "p95_us": round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1e6, 1),
+        "iterations": iterations,
+    }
+
+
+def run(args) -> dict:
+    results = {}
+    for storage in args.storage:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                engine = make_engine(storage, tmp)
+                Base.metadata.create_all(bind=engine)
+                Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                ids = seed(Session, size)
+                loaded_db, cases = benchmarks(Session, ids)
+                try:
+                    for name, fn in cases.items():
+                        if args.only and name not in args.only:
+                            continue
+                        key = f"{storage}/{size}/{name}"
+                        results[key] = measure(fn, args.iterations)
+                        print(f"{key:<52} {results[key]['median_us']:>10.1f} us  p95 {results[key]['p95_us']:>10.1f} us")
+                finally:
+                    loaded_db.close()
+                    engine.dispose()
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.node(),
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float, min_delta_us: float) -> int:
+    regressions = 0
+    print(f"{'benchmark':<52} {'baseline':>10} {'current':>10} {'change':>8}")
+    for key, base in sorted(baseline["results"].items()):
+        now = current["results"].get(key)
+        if now is None:
+            print(f"{key:<52} {base['median_us']:>10.1f} {'missing':>10}")
+            continue
+        change = now["median_us"] / base["median_us"] - 1 if base["median_us"] else 0
+        regressed = change > tolerance and now["median_us"] - base["median_us"] > min_delta_us
+        regressions += regressed
+        print(f"{key:<52} {base['median_us']:>10.1f} {now['median_us']:>10.1f} {change:>+8.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    for key in sorted(set(current["results"]) - set(baseline["results"])):
+        print(f"{key:<52} {'new':>10} {current['results'][key]['median_us']:>10.1f}")
+    return regressions
+
+
+def load_results(path: str) -> dict:
+    if not os.path.exists(path):
+        raise SystemExit(f"{path} does not exist; record it with: python -m benchmarks.micro run --output {path}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run the benchmarks and write a results file")
+    run_parser.add_argument("--storage", nargs="+", choices=["memory", "file"], default=["memory", "file"])
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    run_parser.add_argument("--iterations", type=int, default=50)
+    run_parser.add_argument("--only", nargs="+", help="benchmark names to run")
+    run_parser.add_argument("--output", help=f"results file to write, e.g. {os.path.relpath(DEFAULT_BASELINE)}"
+                                             " to record a baseline")
+    run_parser.add_argument("--compare", help="baseline to compare the new results against")
+
+    compare_parser = sub.add_parser("compare", help="compare two results files")
+    for p in (run_parser, compare_parser):
+        p.add_argument("--tolerance", type=float, default=0.25)
+        p.add_argument("--min-delta-us", type=float, default=20)
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.compare:
+            if args.output and os.path.abspath(args.output) == os.path.abspath(args.compare):
+                parser.error("--output would overwrite the --compare baseline")
+            baseline = load_results(args.compare)
+        current = run(args)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+            print(f"wrote {args.output}")
+        if not args.compare:
+            return
+    else:
+        baseline = load_results(args.baseline)
+        current = load_results(args.current)
+
+    regressions = compare(baseline, current, args.tolerance, args.min_delta_us)
+    if regressions:
+        raise SystemExit(f"{regressions} benchmark(s) regressed beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
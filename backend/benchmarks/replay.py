@@ -0,0 +1,266 @@
+"""Replay captured traffic (TRAFFIC_CAPTURE, services/traffic_capture.py).
+
+    python -m benchmarks.replay run traffic.jsonl --base-url http://127.0.0.1:8000 --output before.json
+    python -m benchmarks.replay run traffic.jsonl --speed 10 --output after.json --compare before.json
+    python -m benchmarks.replay compare before.json after.json
+
+Requests are sent at their captured offsets, divided by --speed, each as its
+own task, so bursts keep their concurrency. The captured log holds only
+body shapes, so each body is rebuilt from its shape:
+- strings are made unique, at their captured length or longer
+- numbers become 1, datetimes the current time
+
+Ids are chained. When a captured POST created id N, later references to N
+(path parameters and *_id body fields of the same kind) wait for the
+replayed POST and use the id it returned. Ids that were never created in the
+log are sent unchanged, so replay against a copy of the captured database
+keeps them valid.
+
+Latency is measured from send to response, not including any wait for a
+dependency. The report gives p50/p95/p99 per route, and how many replies
+differ from the captured status. compare prints per-route deltas between two
+runs, e.g. two backend builds. It exits non-zero when a route's p95 is slower
+by more than --tolerance and by more than --min-delta-ms.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.clinic_day import percentile
+
+# Which kind of object an id refers to, by field or path parameter name
+ID_KINDS = {
+    "record_id": "records", "patient_id": "patients", "location_id": "locations", "medication_id": "medications",
+    "anesthetist_id": "providers", "surgeon_id": "providers", "assistant_id": "providers",
+    "circulator_id": "providers", "push_id": "pushes",
+}
+# Which kind a POST route creates
+CREATES = {
+    "/api/patients/": "patients", "/api/locations/": "locations", "/api/providers/": "providers",
+    "/api/medications/": "medications", "/api/records/": "records",
+    "/api/open-dental/push-record/{record_id}": "pushes",
+}
+
+
+def load(path: str) -> list:
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries = [e for e in entries if e["route"] != "unmatched"]
+    entries.sort(key=lambda e: e["at"])
+    return entries
+
+
+class Replay:
+    def __init__(self, client: httpx.AsyncClient, entries: list, speed: float):
+        self.client = client
+        self.entries = entries
+        self.speed = speed
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.status_mismatches = defaultdict(int)
+        self.counter = 0
+        # (kind, captured id) -> future for the replayed id
+        self.created = {}
+        for entry in entries:
+            kind = CREATES.get(entry["route"])
+            if entry["method"] == "POST" and kind and "response_id" in entry:
+                self.created.setdefault((kind, entry["response_id"]), asyncio.get_running_loop().create_future())
+
+    async def resolve(self, kind, captured_id):
+        future = self.created.get((kind, captured_id))
+        return await future if future is not None else captured_id
+
+    def unique(self, length: int) -> str:
+        self.counter += 1
+        value = f"replay-{self.counter}-{time.time_ns() % 10 ** 9}"
+        return value.ljust(length, "x")
+
+    async def build(self, value, key: str = ""):
+        if isinstance(value, dict):
+            return {k: await self.build(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [await self.build(v) for v in value]
+        if isinstance(value, int) and not isinstance(value, bool):
+            kind = ID_KINDS.get(key)
+            return await self.resolve(kind, value) if kind else value
+        if value == "int":
+            return 1
+        if value == "float":
+            return 1.0
+        if value == "bool":
+            return True
+        if value == "null":
+            return None
+        if value == "datetime":
+            return datetime.now().isoformat()
+        if value == "date":
+            return date.today().isoformat()
+        if isinstance(value, str) and value.startswith("str:"):
+            return self.unique(int(value[4:]))
+        return value
+
+    async def send(self, entry: dict, delay: float):
+        await asyncio.sleep(delay)
+        kind = CREATES.get(entry["route"])
+        future = self.created.get((kind, entry.get("response_id"))) if entry["method"] == "POST" else None
+        created_id = None
+        try:
+            created_id = await self.request(entry)
+        finally:
+            if future is not None and not future.done():
+                # Dependants fall back to the captured id when the create failed
+                future.set_result(created_id if created_id is not None else entry["response_id"])
+
+    async def request(self, entry: dict):
+        """Sends one captured request; returns the id it created, if any"""
+        path_params = await self.build(entry["path_params"])
+        url = entry["route"].format(**path_params)
+        query = {k: await self.build(v) for k, v in entry["query"].items()}
+        body = await self.build(entry["body"]) if isinstance(entry["body"], (dict, list)) else None
+
+        route = f"{entry['method']} {entry['route']}"
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(entry["method"], url, params=query, json=body,
+                                                 headers={"Accept": entry["headers"].get("accept", "*/*")})
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, None
+        self.latencies[route].append(time.perf_counter() - start)
+        if status is None or status >= 400:
+            self.errors[route] += 1
+        if status != entry["status"]:
+            self.status_mismatches[route] += 1
+        if response is None or status >= 400 or entry["method"] != "POST":
+            return None
+        try:
+            return response.json()["id"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    async def run(self) -> float:
+        first = self.entries[0]["at"]
+        started = time.monotonic()
+        await asyncio.gather(*(self.send(e, (e["at"] - first) / self.speed) for e in self.entries))
+        return time.monotonic() - started
+
+
+async def replay(args) -> dict:
+    entries = load(args.log)
+    if not entries:
+        raise SystemExit(f"{args.log} has no replayable requests")
+    limits = httpx.Limits(max_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        runner = Replay(client, entries, args.speed)
+        elapsed = await runner.run()
+
+    captured = defaultdict(list)
+    for entry in entries:
+        captured[f"{entry['method']} {entry['route']}"].append(entry["duration_ms"])
+    routes = {}
+    for route, values in sorted(runner.latencies.items()):
+        values.sort()
+        routes[route] = {
+            "requests": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "captured_p50_ms": percentile(sorted(captured[route]), 50),
+            "errors": runner.errors[route],
+            "status_mismatches": runner.status_mismatches[route],
+        }
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "log": os.path.abspath(args.log),
+            "base_url": args.base_url,
+            "speed": args.speed,
+            "elapsed_s": elapsed,
+            "requests": len(entries),
+        },
+        "routes": routes,
+    }
+
+
+def print_run(result: dict):
+    meta = result["meta"]
+    print(f"{meta['requests']} requests in {meta['elapsed_s']:.1f}s at {meta['speed']}x against {meta['base_url']}")
+    print(f"{'route':<48} {'req':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'capt p50':>9} {'errors':>7} "
+          f"{'status≠':>8}")
+    for route, r in result["routes"].items():
+        print(f"{route:<48} {r['requests']:>6} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['captured_p50_ms']:>9.1f} {r['errors']:>7} {r['status_mismatches']:>8}")
+
+
+def compare(baseline: dict, current: dict, tolerance: float, min_delta_ms: float) -> int:
+    regressions = 0
+    print(f"{'route':<48} {'p50 before':>10} {'after':>8} {'p95 before':>10} {'after':>8} {'p95 change':>10}")
+    for route, base in sorted(baseline["routes"].items()):
+        now = current["routes"].get(route)
+        if now is None:
+            print(f"{route:<48} {base['p50_ms']:>10.1f} {'missing':>8}")
+            continue
+        change = now["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0
+        regressed = change > tolerance and now["p95_ms"] - base["p95_ms"] > min_delta_ms
+        regressions += regressed
+        print(f"{route:<48} {base['p50_ms']:>10.1f} {now['p50_ms']:>8.1f} {base['p95_ms']:>10.1f} "
+              f"{now['p95_ms']:>8.1f} {change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    for route in sorted(set(current["routes"]) - set(baseline["routes"])):
+        print(f"{route:<48} {'new':>10} {current['routes'][route]['p50_ms']:>8.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="replay a capture against a backend")
+    run_parser.add_argument("log")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="1 = captured pace, 10 = ten times faster")
+    run_parser.add_argument("--timeout", type=float, default=30)
+    run_parser.add_argument("--max-connections", type=int, default=100)
+    run_parser.add_argument("--output", help="write the results to this file")
+    run_parser.add_argument("--compare", help="results of an earlier run to compare against")
+
+    compare_parser = sub.add_parser("compare", help="per-route latency deltas between two runs")
+    for p in (run_parser, compare_parser):
+        p.add_argument("--tolerance", type=float, default=0.25)
+        p.add_argument("--min-delta-ms", type=float, default=5)
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = asyncio.run(replay(args))
+        print_run(current)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+        if not args.compare:
+            return
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.tolerance, args.min_delta_ms)
+    if regressions:
+        raise SystemExit(f"{regressions} route(s) regressed beyond {args.tolerance:.0%} at p95")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Latency and memory of the record serialization paths.
+
+    python -m benchmarks.serialization --vitals 1000 --iterations 50
+
+Builds one record with --vitals vital signs and --administrations doses in
+an in-memory SQLite database, then compares:
+
+  response_model  model_validate + jsonable_encoder + json.dumps, as FastAPI
+                  does for a response_model route
+  type_adapter    cached TypeAdapter validate + dump_json
+  trusted_orjson  services.serialization.to_dict + orjson (the API default)
+
+Each path is checked to produce the same JSON before timing. Reports median
+latency and tracemalloc peak per call.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, models
+from schemas import schemas
+from services import serialization
+
+
+def build_record(session, vitals: int, administrations: int):
+    medication = models.Medication(name="Midazolam (Versed)", concentration="5mg/mL", unit_dose="5mg",
+                                   dea_schedule="C-IV", how_supplied="5mL vial")
+    patient = models.Patient(open_dental_id="bench", first_name="Bench", last_name="Mark",
+                             date_of_birth=datetime(1980, 1, 1))
+    location = models.Location(name="Bench")
+    session.add_all([medication, patient, location])
+    session.flush()
+    start = datetime(2025, 1, 1, 8, 0)
+    record = models.AnesthesiaRecord(patient_id=patient.id, location_id=location.id, asa_class="II",
+                                     monitors=["BP", "SpO2", "EKG"], local_anesthetics={"Lidocaine": 2},
+                                     anesthesia_start=start)
+    session.add(record)
+    session.flush()
+    session.add_all(
+        models.VitalSign(record_id=record.id, timestamp=start + timedelta(seconds=5 * i), bp_systolic=120,
+                         bp_diastolic=80, map=93, heart_rate=70 + i % 10, spo2=98, etco2=35, temperature=36.8)
+        for i in range(vitals)
+    )
+    session.add_all(
+        models.MedicationAdministration(record_id=record.id, medication_id=medication.id, dose_ml=1.0,
+                                        waste_ml=0.0, timestamp=start + timedelta(minutes=i))
+        for i in range(administrations)
+    )
+    session.commit()
+    record = session.get(models.AnesthesiaRecord, record.id)
+    # Load the graph once so every path measures serialization, not lazy loads
+    for admin in record.medication_administrations:
+        admin.medication
+    record.vital_signs, record.patient
+    return record
+
+
+def response_model_path(record) -> bytes:
+    model = schemas.AnesthesiaRecord.model_validate(record)
+    return json.dumps(jsonable_encoder(model)).encode()
+
+
+def type_adapter_path(record) -> bytes:
+    adapter = serialization.adapter_for(schemas.AnesthesiaRecord)
+    return adapter.dump_json(adapter.validate_python(record, from_attributes=True))
+
+
+def trusted_orjson_path(record) -> bytes:
+    return orjson.dumps(serialization.to_dict(record, schemas.AnesthesiaRecord))
+
+
+PATHS = {
+    "response_model": response_model_path,
+    "type_adapter": type_adapter_path,
+    "trusted_orjson": trusted_orjson_path,
+}
+
+
+def measure(fn, record, iterations: int):
+    fn(record)  # warm-up
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(record)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(record)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vitals", type=int, default=1000)
+    parser.add_argument("--administrations", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    record = build_record(session, args.vitals, args.administrations)
+
+    reference = json.loads(response_model_path(record))
+    for name, fn in PATHS.items():
+        if json.loads(fn(record)) != reference:
+            raise SystemExit(f"{name} output differs from the response_model path")
+
+    print(f"record with {args.vitals} vitals, {args.administrations} administrations")
+    print(f"{'path':<16} {'median ms':>10} {'peak KiB':>10}")
+    for name, fn in PATHS.items():
+        median, peak = measure(fn, record, args.iterations)
+        print(f"{name:<16} {median * 1000:>10.2f} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
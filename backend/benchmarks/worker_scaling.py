@@ -0,0 +1,130 @@
+"""Throughput vs. gunicorn worker count.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --clients 16 --duration 10
+
+For each worker count, starts the production profile (gunicorn.conf.py)
+against a fresh migrated SQLite file, seeds one patient and record, then
+runs closed-loop clients for --duration seconds. Each client issues vitals
+POSTs with probability --write-ratio and record GETs otherwise. Prints
+requests/second, p50/p95 latency and errors per worker count.
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/medications/", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError("server did not become ready")
+
+
+def seed(base_url: str) -> int:
+    patient = httpx.post(f"{base_url}/api/patients/", json={
+        "open_dental_id": "bench-1", "first_name": "Bench", "last_name": "Mark",
+        "date_of_birth": "1980-01-01T00:00:00",
+    }).json()
+    record = httpx.post(f"{base_url}/api/records/", json={
+        "patient_id": patient["id"], "location_id": 1,
+    }).json()
+    return record["id"]
+
+
+def client_loop(base_url, record_id, write_ratio, stop_at, latencies, errors, seed_value):
+    rng = random.Random(seed_value)
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    response = client.post(f"/api/records/{record_id}/vitals/", json={
+                        "bp_systolic": rng.randint(100, 140), "bp_diastolic": rng.randint(60, 90),
+                        "heart_rate": rng.randint(55, 100), "spo2": rng.randint(94, 100),
+                    })
+                else:
+                    response = client.get(f"/api/records/{record_id}")
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors.append(1)
+
+
+def run(workers: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": f"sqlite:///{tmp}/scaling.db",
+            "WEB_CONCURRENCY": str(workers),
+            "BIND": f"127.0.0.1:{args.port}",
+            "ACCESS_LOG": "",
+            "LOG_LEVEL": "warning",
+        })
+        subprocess.run([sys.executable, "-m", "models.migrations"], cwd=BACKEND_DIR, env=env,
+                       check=True, capture_output=True)
+        proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api.main:app"],
+                                cwd=BACKEND_DIR, env=env)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_ready(base_url)
+            record_id = seed(base_url)
+            latencies, errors = [], []
+            stop_at = time.monotonic() + args.duration
+            threads = [
+                threading.Thread(target=client_loop, args=(
+                    base_url, record_id, args.write_ratio, stop_at, latencies, errors, i))
+                for i in range(args.clients)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "rps": len(latencies) / args.duration,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for workers in args.workers:
+        result = run(workers, args)
+        print(f"{result['workers']:>7} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
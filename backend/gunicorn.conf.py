@@ -0,0 +1,50 @@
+"""Production server profile: gunicorn managing uvicorn worker processes.
+
+    APP_ENV=production ./start.sh
+    gunicorn -c gunicorn.conf.py api.main:app
+
+Sizing guidance (measure your host with benchmarks/worker_scaling.py):
+- With SQLite every write is serialized by services.coordination.write_lock,
+  so extra workers only add read throughput, and only up to the core count.
+  On a 1-core host with 30% writes and 8 clients, 1 worker did 217 req/s,
+  2 workers 178 req/s and 4 workers 155 req/s. The default is therefore
+  one worker per core, capped at 4.
+- With a server database (DATABASE_URL=postgresql://...) start at
+  2 x cores + 1 and adjust with the benchmark.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+
+if os.getenv("DATABASE_URL", "sqlite").startswith("sqlite"):
+    _default_workers = min(multiprocessing.cpu_count(), 4)
+else:
+    _default_workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.getenv("WEB_CONCURRENCY", _default_workers))
+# The app reads WEB_CONCURRENCY to decide whether per-process caches are safe
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Import the app once in the master; workers fork with the code already loaded
+preload_app = True
+
+# SIGTERM stops accepting connections and lets in-flight requests (and the
+# app's shutdown handler, which drains writes) finish within graceful_timeout
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers periodically to bound slow memory growth; jitter keeps
+# them from restarting all at once
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+
+accesslog = os.getenv("ACCESS_LOG", "-") or None  # empty disables access logging
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Connections must never be shared across fork; drop any the master opened
+    from models.database import engine
+    engine.dispose(close=False)
@@ -1,2 +1,2 @@
-from .database import Base, engine, get_db
+from .database import Base, engine, get_db, SessionLocal
 from .models import *
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""Explicit schema migration step.
+
+Run once per deploy, before any API worker starts:
+
+    python -m models.migrations
+
+Creates missing tables, adds columns and indexes that were added to the
+models since the database was created, and seeds reference data. Every
+step is idempotent.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from .database import Base, SessionLocal, engine as default_engine
+from . import models  # noqa: F401  registers every table on Base.metadata
+
+logger = logging.getLogger(__name__)
+
+
+def _add_missing_columns(engine: Engine) -> list:
+    added = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _create_missing_indexes(engine: Engine) -> list:
+    created = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+    return created
+
+
+def migrate(engine: Engine = default_engine) -> dict:
+    Base.metadata.create_all(bind=engine)
+    summary = {
+        "columns_added": _add_missing_columns(engine),
+        "indexes_created": _create_missing_indexes(engine),
+    }
+
+    # Imported here to keep models free of a services dependency at import time
+    from services import crud
+    db = SessionLocal(bind=engine)
+    try:
+        crud.initialize_default_medications(db)
+    finally:
+        db.close()
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    result = migrate()
+    logger.info("Migration complete: %s", result)
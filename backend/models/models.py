@@ -9,6 +9,7 @@ class Location(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     address = Column(String)
+    open_dental_clinic_num = Column(String, index=True)  # ClinicNum used to place prefetched appointments
     
     inventories = relationship("MedicationInventory", back_populates="location")
     records = relationship("AnesthesiaRecord", back_populates="location")
@@ -41,6 +42,8 @@ class MedicationInventory(Base):
     medication_id = Column(Integer, ForeignKey("medications.id"))
     location_id = Column(Integer, ForeignKey("locations.id"))
     quantity = Column(Float)
+    # Optimistic concurrency: every UPDATE checks the version it read
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     lot_number = Column(String)
     expiration_date = Column(DateTime)
     supplier = Column(String)
@@ -49,6 +52,8 @@ class MedicationInventory(Base):
     
     medication = relationship("Medication", back_populates="inventories")
     location = relationship("Location", back_populates="inventories")
+    
+    __mapper_args__ = {"version_id_col": version}
 
 class Patient(Base):
     __tablename__ = "patients"
@@ -71,6 +76,16 @@ class AnesthesiaRecord(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Co-editing: version counts committed edits and is the sequence number
+    # stations see; field_versions maps a field to the version of its last edit.
+    # Every UPDATE checks the version it read (crud._stamp_fields sets the next).
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    field_versions = Column(JSON)
+    
+    # Open Dental appointment this record was prefetched for (draft shells)
+    open_dental_appt_id = Column(String, unique=True, index=True)
+    scheduled_at = Column(DateTime, index=True)
+    
     # Physical assessment
     asa_class = Column(String)  # I, II, III, IV, V, VI
     asa_modifier_e = Column(Boolean, default=False)
@@ -139,12 +154,14 @@ class AnesthesiaRecord(Base):
     location = relationship("Location", back_populates="records")
     medication_administrations = relationship("MedicationAdministration", back_populates="record")
     vital_signs = relationship("VitalSign", back_populates="record")
+    
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
 class MedicationAdministration(Base):
     __tablename__ = "medication_administrations"
     
     id = Column(Integer, primary_key=True, index=True)
-    record_id = Column(Integer, ForeignKey("anesthesia_records.id"))
+    record_id = Column(Integer, ForeignKey("anesthesia_records.id"), index=True)
     medication_id = Column(Integer, ForeignKey("medications.id"))
     dose_ml = Column(Float)
     waste_ml = Column(Float, default=0)
@@ -157,7 +174,7 @@ class VitalSign(Base):
     __tablename__ = "vital_signs"
     
     id = Column(Integer, primary_key=True, index=True)
-    record_id = Column(Integer, ForeignKey("anesthesia_records.id"))
+    record_id = Column(Integer, ForeignKey("anesthesia_records.id"), index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     bp_systolic = Column(Integer)
     bp_diastolic = Column(Integer)
@@ -167,4 +184,31 @@ class VitalSign(Base):
     etco2 = Column(Integer)
     temperature = Column(Float)
     
-    record = relationship("AnesthesiaRecord", back_populates="vital_signs")
\ No newline at end of file
+    record = relationship("AnesthesiaRecord", back_populates="vital_signs")
+
+class OpenDentalPush(Base):
+    __tablename__ = "open_dental_pushes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    record_id = Column(Integer, ForeignKey("anesthesia_records.id"), index=True)
+    idempotency_key = Column(String, unique=True, index=True)
+    payload = Column(JSON)  # Snapshot of the note taken when the push was requested
+    status = Column(String, default="pending", index=True)  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    record = relationship("AnesthesiaRecord")
+
+class IdempotencyKey(Base):
+    """Idempotency-Key of a create request, kept IDEMPOTENCY_TTL_HOURS (services/idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True)
+    request_path = Column(String)
+    request_hash = Column(String)  # sha256 of the request body
+    resource_id = Column(Integer)  # Row the request created
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
@@ -1,10 +1,11 @@
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional, List, Dict
+from datetime import date, datetime
+from typing import Any, Optional, List, Dict
 
 class LocationBase(BaseModel):
     name: str
     address: Optional[str] = None
+    open_dental_clinic_num: Optional[str] = None
 
 class LocationCreate(LocationBase):
     pass
@@ -188,17 +189,68 @@ class AnesthesiaRecordBase(BaseModel):
 class AnesthesiaRecordCreate(AnesthesiaRecordBase):
     pass
 
-class AnesthesiaRecordUpdate(AnesthesiaRecordBase):
+# Any subset of the fields, as field-level edits validate them
+class AnesthesiaRecordChanges(AnesthesiaRecordBase):
     patient_id: Optional[int] = None
     location_id: Optional[int] = None
 
+class AnesthesiaRecordUpdate(AnesthesiaRecordChanges):
+    # The version the changes are based on; a different current version is a 409.
+    # Required so a client that never read the record cannot overwrite newer edits
+    version: int
+
 class AnesthesiaRecord(AnesthesiaRecordBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    version: int = 1
+    field_versions: Optional[Dict[str, int]] = None
+    open_dental_appt_id: Optional[str] = None
+    scheduled_at: Optional[datetime] = None
     patient: Optional[Patient] = None
     medication_administrations: List[MedicationAdministration] = []
     vital_signs: List[VitalSign] = []
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Field-level edits (PATCH /api/records/{id}/fields and the co-editing socket)
+class FieldChange(BaseModel):
+    value: Any = None
+    base: Optional[int] = None  # version of the field the client last saw; None overwrites
+
+class FieldChanges(BaseModel):
+    changes: Dict[str, FieldChange]
+    station: Optional[str] = None
+
+class FieldConflict(BaseModel):
+    value: Any = None
+    version: int
+
+class FieldChangeResult(BaseModel):
+    version: int
+    applied: Dict[str, int] = {}
+    conflicts: Dict[str, FieldConflict] = {}
+    rejected: Dict[str, str] = {}
+
+class OpenDentalPush(BaseModel):
+    id: int
+    record_id: int
+    idempotency_key: str
+    status: str
+    attempts: int
+    next_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    sent_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class PrefetchSummary(BaseModel):
+    day: date
+    appointments: int
+    patients: int
+    drafts_created: int
+    appointments_skipped: int = 0
+    records_warmed: int
@@ -0,0 +1,141 @@
+"""Co-editing of one record by several stations over a WebSocket.
+
+    /api/records/{id}/edit?station=<name>
+
+Stations send field-level deltas instead of whole-record PUTs:
+
+    -> {"type": "edit", "id": 7, "changes": {"notes": {"value": "...", "base": 12}}}
+    <- {"type": "ack", "id": 7, "version": 13, "applied": {"notes": 13}, "conflicts": {}, "rejected": {}}
+
+and receive every committed change to the record, theirs included:
+
+    <- {"type": "snapshot", "version": 12, "fields": {...}, "versions": {"notes": 12, ...}}
+    <- {"type": "change", "version": 13, "fields": {"notes": "..."}, "versions": {"notes": 13}, "station": "..."}
+    <- {"type": "vital.added" | "administration.added", "data": {...}}
+
+`version` is the record's version, a server sequence number that grows with
+every committed edit; changes arrive in version order. A snapshot comes on
+connect and whenever changes may have been missed (see services/events.py),
+and replaces the station's state.
+
+Conflicts are resolved per field (crud.apply_field_changes): an edit whose
+base is older than the field's version is not applied, and the ack carries
+the current value as a conflict. Edits to different fields never conflict.
+PATCH /api/records/{id}/fields takes the same changes over plain HTTP.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from typing import Dict, Optional
+
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal
+from schemas import schemas
+from services import crud, events, group_commit, read_cache
+
+logger = logging.getLogger(__name__)
+
+# Close code for a record that does not exist (4000-4999 are application codes)
+CLOSE_NOT_FOUND = 4404
+
+
+def _apply(record_id: int, changes: Dict[str, schemas.FieldChange], station: str):
+    result = group_commit.run(crud.apply_field_changes, record_id, changes, station)
+    read_cache.invalidate_record(record_id)
+    return result
+
+
+def _read_snapshot(record_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        return crud.get_record_fields(db, record_id)
+    finally:
+        db.close()
+
+
+def _parse_edit(message) -> Dict[str, schemas.FieldChange]:
+    if not isinstance(message, dict) or message.get("type") != "edit" or not isinstance(message.get("changes"), dict):
+        raise ValueError('expected {"type": "edit", "changes": {field: {"value": ..., "base": ...}}}')
+    return {field: schemas.FieldChange.model_validate(change) for field, change in message["changes"].items()}
+
+
+class Station:
+    """One connected socket"""
+
+    def __init__(self, websocket: WebSocket, record_id: int):
+        self.websocket = websocket
+        self.record_id = record_id
+        self.name = websocket.query_params.get("station") or uuid.uuid4().hex[:8]
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict):
+        # Acks and forwarded changes are sent from two tasks
+        async with self._send_lock:
+            await self.websocket.send_text(orjson.dumps(message, default=str).decode())
+
+    async def send_snapshot(self) -> int:
+        snapshot = await asyncio.to_thread(_read_snapshot, self.record_id)
+        if snapshot is None:
+            return 0
+        await self.send({"type": "snapshot", **snapshot})
+        return snapshot["version"]
+
+    async def forward(self, marks):
+        version = 0
+        async for event in events.follow(self.record_id, None, marks, max_seconds=None):
+            if event is None:
+                continue  # the WebSocket server pings on its own
+            if event.type in ("ready", "resync", "record.changed"):
+                version = await self.send_snapshot()
+            elif event.type == "record.updated":
+                # Changes already contained in the last snapshot are skipped
+                if event.data["version"] > version:
+                    version = event.data["version"]
+                    await self.send({"type": "change", **event.data})
+            else:
+                await self.send({"type": event.type, "data": event.data})
+
+    async def receive(self):
+        while True:
+            message = await self.websocket.receive_text()
+            try:
+                decoded = orjson.loads(message)
+                changes = _parse_edit(decoded)
+            except (ValueError, ValidationError) as e:
+                await self.send({"type": "error", "detail": str(e)})
+                continue
+            result = await asyncio.to_thread(_apply, self.record_id, changes, self.name)
+            if result is None:
+                await self.websocket.close(code=CLOSE_NOT_FOUND)
+                return
+            await self.send({"type": "ack", "id": decoded.get("id"), **result.model_dump()})
+
+
+async def run_station(websocket: WebSocket, record_id: int):
+    marks = await events.get_marks(record_id)
+    await websocket.accept()
+    if marks is None:
+        # Closing before accept() would only tell the client "403"
+        await websocket.close(code=CLOSE_NOT_FOUND)
+        return
+    station = Station(websocket, record_id)
+    forwarder = asyncio.create_task(station.forward(marks))
+    try:
+        await station.receive()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        forwarder.cancel()
+        try:
+            await forwarder
+        except (asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+            pass
+        except Exception:
+            logger.exception("Co-editing forwarder for record %s failed", record_id)
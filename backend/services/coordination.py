@@ -0,0 +1,150 @@
+"""Coordination between API worker processes sharing one database.
+
+SQLite allows a single writer at a time. Instead of letting every worker
+collide on the database lock and spin in busy handlers, writes take
+`write_lock()`: a thread lock inside the process plus an flock on a file
+next to the database across processes. Endpoints take it through
+`run_write()`, in the thread that runs the write. Background jobs use
+`acquire_leadership()` so exactly one worker runs them.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import SessionLocal, engine
+from services import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+IS_SQLITE = engine.dialect.name == "sqlite"
+SQLITE_WRITE_LOCK = os.getenv("SQLITE_WRITE_LOCK", "1" if IS_SQLITE else "0") == "1"
+
+
+def _lock_dir() -> str:
+    if IS_SQLITE and engine.url.database and engine.url.database != ":memory:":
+        return os.path.dirname(os.path.abspath(engine.url.database))
+    return os.getenv("LOCK_DIR", "/tmp")
+
+
+def _lock_path(name: str) -> str:
+    base = os.path.basename(engine.url.database or "anesthesia") if IS_SQLITE else "anesthesia"
+    return os.path.join(_lock_dir(), f".{base}.{name}.lock")
+
+
+class FileLock:
+    """Exclusive flock on a file; a no-op where fcntl is unavailable"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if fcntl is None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+_thread_write_lock = threading.Lock()
+_inflight_writes = 0
+_inflight_lock = threading.Condition()
+
+
+@contextmanager
+def write_lock():
+    """Serialize writers across threads and worker processes, and track them for draining"""
+    global _inflight_writes
+    with _inflight_lock:
+        _inflight_writes += 1
+    try:
+        if not SQLITE_WRITE_LOCK:
+            yield
+            return
+        wait_start = time.perf_counter()
+        with _thread_write_lock:
+            file_lock = FileLock(_lock_path("write"))
+            file_lock.acquire()
+            if metrics.METRICS_ENABLED:
+                metrics.lock_wait.observe((), time.perf_counter() - wait_start)
+            try:
+                yield
+            finally:
+                file_lock.release()
+    finally:
+        with _inflight_lock:
+            _inflight_writes -= 1
+            _inflight_lock.notify_all()
+
+
+def drain_writes(timeout: float) -> bool:
+    """Wait for in-flight writes to finish; returns False if the timeout expired"""
+    deadline = time.monotonic() + timeout
+    with _inflight_lock:
+        while _inflight_writes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("Shutting down with %s write(s) still in flight", _inflight_writes)
+                return False
+            _inflight_lock.wait(remaining)
+    return True
+
+
+def run_write(fn: Callable[..., Any], *args):
+    """fn(db, *args) in its own session under write_lock(), in the calling thread.
+
+    Mutating endpoints call this from their body rather than holding the lock
+    in a yield dependency: FastAPI runs such a dependency and the endpoint in
+    different threadpool threads, so once every pool thread waits for the
+    lock, the holder's endpoint never gets a thread and the worker hangs.
+    fn returns plain data; the session is closed when it returns."""
+    with write_lock():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+
+_leader_lock = None
+
+
+def acquire_leadership() -> bool:
+    """True in exactly one process per database; held until the process exits"""
+    global _leader_lock
+    if _leader_lock is not None:
+        return True
+    lock = FileLock(_lock_path("leader"))
+    if lock.acquire(blocking=False):
+        _leader_lock = lock
+        return True
+    return False
+
+
+def release_leadership():
+    global _leader_lock
+    if _leader_lock is not None:
+        _leader_lock.release()
+        _leader_lock = None
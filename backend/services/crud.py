@@ -1,7 +1,9 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from datetime import datetime
-from typing import List, Optional
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import and_, func, select
+from pydantic import ValidationError
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
 
 import sys
 import os
@@ -9,25 +11,34 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models import models
 from schemas import schemas
+from services import events, serialization
+
+def _insert(db: Session, model):
+    """INSERT construct for the bound dialect, so ON CONFLICT clauses are available"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+DEFAULT_MEDICATIONS = [
+    {"name": "Midazolam (Versed)", "concentration": "5mg/mL", "unit_dose": "5mg", "dea_schedule": "C-IV", "how_supplied": "5mL vial"},
+    {"name": "Fentanyl", "concentration": "50mcg/mL", "unit_dose": "100mcg", "dea_schedule": "C-II", "how_supplied": "2mL ampule"},
+    {"name": "Propofol", "concentration": "10mg/mL", "unit_dose": "200mg", "dea_schedule": "Non-controlled", "how_supplied": "20mL vial"},
+    {"name": "Ketamine", "concentration": "50mg/mL", "unit_dose": "100mg", "dea_schedule": "C-III", "how_supplied": "2mL vial"},
+    {"name": "Dexmedetomidine", "concentration": "100mcg/mL", "unit_dose": "200mcg", "dea_schedule": "Non-controlled", "how_supplied": "2mL vial"},
+    {"name": "Decadron", "concentration": "10mg/mL", "unit_dose": "10mg", "dea_schedule": "Non-controlled", "how_supplied": "1mL vial"},
+    {"name": "Zofran", "concentration": "4mg/2mL", "unit_dose": "4mg", "dea_schedule": "Non-controlled", "how_supplied": "2mL vial"}
+]
 
 def initialize_default_medications(db: Session):
-    """Initialize default medications if they don't exist"""
-    default_meds = [
-        {"name": "Midazolam (Versed)", "concentration": "5mg/mL", "unit_dose": "5mg", "dea_schedule": "C-IV", "how_supplied": "5mL vial"},
-        {"name": "Fentanyl", "concentration": "50mcg/mL", "unit_dose": "100mcg", "dea_schedule": "C-II", "how_supplied": "2mL ampule"},
-        {"name": "Propofol", "concentration": "10mg/mL", "unit_dose": "200mg", "dea_schedule": "Non-controlled", "how_supplied": "20mL vial"},
-        {"name": "Ketamine", "concentration": "50mg/mL", "unit_dose": "100mg", "dea_schedule": "C-III", "how_supplied": "2mL vial"},
-        {"name": "Dexmedetomidine", "concentration": "100mcg/mL", "unit_dose": "200mcg", "dea_schedule": "Non-controlled", "how_supplied": "2mL vial"},
-        {"name": "Decadron", "concentration": "10mg/mL", "unit_dose": "10mg", "dea_schedule": "Non-controlled", "how_supplied": "1mL vial"},
-        {"name": "Zofran", "concentration": "4mg/2mL", "unit_dose": "4mg", "dea_schedule": "Non-controlled", "how_supplied": "2mL vial"}
-    ]
-    
-    for med_data in default_meds:
-        existing = db.query(models.Medication).filter_by(name=med_data["name"]).first()
-        if not existing:
-            med = models.Medication(**med_data)
-            db.add(med)
-    
+    """Initialize default medications if they don't exist.
+
+    One INSERT ... ON CONFLICT DO NOTHING, so workers starting together
+    cannot race each other into duplicate-name errors.
+    """
+    stmt = _insert(db, models.Medication).values(DEFAULT_MEDICATIONS)
+    db.execute(stmt.on_conflict_do_nothing(index_elements=["name"]))
     db.commit()
 
 # Patient CRUD
@@ -41,6 +52,38 @@ def create_patient(db: Session, patient: schemas.PatientCreate):
     db.refresh(db_patient)
     return db_patient
 
+def upsert_patient(db: Session, patient: schemas.PatientCreate):
+    """Create or refresh the local copy of an Open Dental patient"""
+    db_patient = get_patient_by_open_dental_id(db, patient.open_dental_id)
+    if not db_patient:
+        return create_patient(db, patient)
+    
+    for field, value in patient.dict().items():
+        setattr(db_patient, field, value)
+    db.commit()
+    db.refresh(db_patient)
+    return db_patient
+
+def bulk_upsert_patients(db: Session, patients: List[schemas.PatientCreate]) -> Dict[str, int]:
+    """Insert or refresh many patients in one statement; returns open_dental_id -> id"""
+    if not patients:
+        return {}
+    rows = [patient.dict() for patient in patients]
+    stmt = _insert(db, models.Patient).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["open_dental_id"],
+        set_={field: stmt.excluded[field] for field in rows[0] if field != "open_dental_id"}
+    )
+    db.execute(stmt)
+    db.commit()
+    
+    open_dental_ids = [row["open_dental_id"] for row in rows]
+    return dict(
+        db.query(models.Patient.open_dental_id, models.Patient.id)
+        .filter(models.Patient.open_dental_id.in_(open_dental_ids))
+        .all()
+    )
+
 # Location CRUD
 def get_locations(db: Session):
     return db.query(models.Location).all()
@@ -90,69 +133,268 @@ def add_inventory(db: Session, inventory: schemas.MedicationInventoryCreate):
     db.refresh(db_inventory)
     return db_inventory
 
-def decrement_inventory(db: Session, medication_id: int, location_id: int, amount: float):
-    inventory = db.query(models.MedicationInventory).filter(
-        and_(
-            models.MedicationInventory.medication_id == medication_id,
-            models.MedicationInventory.location_id == location_id,
-            models.MedicationInventory.quantity >= amount
-        )
-    ).first()
-    
-    if inventory:
-        inventory.quantity -= amount
-        db.commit()
-        return True
+def decrement_inventory(db: Session, medication_id: int, location_id: int, amount: float, attempts: int = 3):
+    # Compare-and-set on the row version instead of a lock: when another
+    # request decremented the row first, the UPDATE matches nothing and the
+    # stock is read again
+    inventory_model = models.MedicationInventory
+    for _ in range(attempts):
+        row = db.query(inventory_model.id, inventory_model.version).filter(
+            and_(
+                inventory_model.medication_id == medication_id,
+                inventory_model.location_id == location_id,
+                inventory_model.quantity >= amount
+            )
+        ).first()
+        if row is None:
+            return False
+        updated = db.query(inventory_model).filter(
+            inventory_model.id == row.id, inventory_model.version == row.version
+        ).update({inventory_model.quantity: inventory_model.quantity - amount,
+                  inventory_model.version: inventory_model.version + 1}, synchronize_session=False)
+        if updated:
+            db.commit()
+            return True
     return False
 
 # Anesthesia Record CRUD
 def get_anesthesia_record(db: Session, record_id: int):
-    return db.query(models.AnesthesiaRecord).filter(models.AnesthesiaRecord.id == record_id).first()
+    # The full record is always serialized with its patient, doses and vitals;
+    # load them in three queries instead of one lazy load per row
+    return db.query(models.AnesthesiaRecord).options(
+        joinedload(models.AnesthesiaRecord.patient),
+        selectinload(models.AnesthesiaRecord.medication_administrations)
+        .joinedload(models.MedicationAdministration.medication),
+        selectinload(models.AnesthesiaRecord.vital_signs),
+    ).filter(models.AnesthesiaRecord.id == record_id).first()
+
+def get_anesthesia_record_partial(db: Session, record_id: int, columns: Iterable[str], relationships: Iterable[str]):
+    """Load only the named columns, and eager-load only the named relationships"""
+    record_cls = models.AnesthesiaRecord
+    options = [load_only(*[getattr(record_cls, column) for column in columns])]
+    relationships = set(relationships)
+    if "patient" in relationships:
+        options.append(joinedload(record_cls.patient))
+    if "vital_signs" in relationships:
+        options.append(selectinload(record_cls.vital_signs))
+    if "medication_administrations.medication" in relationships:
+        options.append(selectinload(record_cls.medication_administrations)
+                       .joinedload(models.MedicationAdministration.medication))
+    elif "medication_administrations" in relationships:
+        options.append(selectinload(record_cls.medication_administrations))
+    return db.query(record_cls).options(*options).filter(record_cls.id == record_id).first()
+
+def _claim_key(db: Session, idempotency_key: Optional[models.IdempotencyKey], obj):
+    """Stores a new Idempotency-Key in the transaction creating obj (services/idempotency.py)"""
+    if idempotency_key is not None:
+        db.flush()
+        idempotency_key.resource_id = obj.id
+        db.add(idempotency_key)
 
-def create_anesthesia_record(db: Session, record: schemas.AnesthesiaRecordCreate):
+def create_anesthesia_record(db: Session, record: schemas.AnesthesiaRecordCreate,
+                             idempotency_key: Optional[models.IdempotencyKey] = None):
     db_record = models.AnesthesiaRecord(**record.dict())
     db.add(db_record)
+    _claim_key(db, idempotency_key, db_record)
     db.commit()
     db.refresh(db_record)
     return db_record
 
+def create_draft_records(db: Session, drafts: List[dict]) -> int:
+    """Bulk-create record shells for scheduled appointments, skipping ones that exist"""
+    if not drafts:
+        return 0
+    stmt = _insert(db, models.AnesthesiaRecord).values(drafts)
+    stmt = stmt.on_conflict_do_nothing(index_elements=["open_dental_appt_id"])
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+def get_draft_records(db: Session, day: date):
+    """Prefetched records scheduled on `day` that have not been started"""
+    start = datetime.combine(day, datetime.min.time())
+    return db.query(models.AnesthesiaRecord).options(
+        joinedload(models.AnesthesiaRecord.patient),
+        selectinload(models.AnesthesiaRecord.medication_administrations)
+        .joinedload(models.MedicationAdministration.medication),
+        selectinload(models.AnesthesiaRecord.vital_signs),
+    ).filter(
+        models.AnesthesiaRecord.scheduled_at >= start,
+        models.AnesthesiaRecord.scheduled_at < start + timedelta(days=1),
+        models.AnesthesiaRecord.anesthesia_start.is_(None)
+    ).order_by(models.AnesthesiaRecord.scheduled_at).all()
+
+def get_draft_record_id(db: Session, open_dental_id: str, location_id: Optional[int], day: date) -> Optional[int]:
+    start = datetime.combine(day, datetime.min.time())
+    query = db.query(models.AnesthesiaRecord.id).join(models.Patient).filter(
+        models.Patient.open_dental_id == open_dental_id,
+        models.AnesthesiaRecord.scheduled_at >= start,
+        models.AnesthesiaRecord.scheduled_at < start + timedelta(days=1),
+        models.AnesthesiaRecord.anesthesia_start.is_(None)
+    )
+    if location_id is not None:
+        query = query.filter(models.AnesthesiaRecord.location_id == location_id)
+    return query.order_by(models.AnesthesiaRecord.scheduled_at).limit(1).scalar()
+
+def get_record_change_marks(db: Session, record_id: int):
+    """(updated_at, last vital id, last administration id) in one query; None for a missing record"""
+    last_vital = select(func.max(models.VitalSign.id)).where(
+        models.VitalSign.record_id == record_id).scalar_subquery()
+    last_administration = select(func.max(models.MedicationAdministration.id)).where(
+        models.MedicationAdministration.record_id == record_id).scalar_subquery()
+    return db.query(models.AnesthesiaRecord.updated_at, last_vital, last_administration).filter(
+        models.AnesthesiaRecord.id == record_id
+    ).first()
+
+def _stamp_fields(db_record: models.AnesthesiaRecord, fields: Iterable[str]) -> Dict[str, int]:
+    """Bumps the record version and marks `fields` as written at it"""
+    db_record.version = (db_record.version or 0) + 1
+    versions = dict(db_record.field_versions or {})
+    for field in fields:
+        versions[field] = db_record.version
+    db_record.field_versions = versions
+    db_record.updated_at = datetime.utcnow()
+    return {field: db_record.version for field in fields}
+
+def _record_change(db_record: models.AnesthesiaRecord, values: dict, versions: Dict[str, int],
+                   station: Optional[str] = None) -> dict:
+    # Payload of the record.updated event
+    return {"fields": values, "versions": versions, "version": db_record.version,
+            "updated_at": db_record.updated_at, "station": station}
+
+class VersionConflict(Exception):
+    """The write was based on an outdated version; `current` is the record as it is now"""
+
+    def __init__(self, current):
+        super().__init__("Record was changed since it was read")
+        self.current = current
+
 def update_anesthesia_record(db: Session, record_id: int, record_update: schemas.AnesthesiaRecordUpdate):
-    db_record = get_anesthesia_record(db, record_id)
+    """Raises VersionConflict when record_update.version is not the current version"""
+    db_record = db.get(models.AnesthesiaRecord, record_id)
     if not db_record:
         return None
+    if record_update.version != db_record.version:
+        raise VersionConflict(get_anesthesia_record(db, record_id))
     
-    update_data = record_update.dict(exclude_unset=True)
+    update_data = record_update.dict(exclude_unset=True, exclude={"version"})
     for field, value in update_data.items():
         setattr(db_record, field, value)
     
-    db_record.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_record)
-    return db_record
+    change = _record_change(db_record, update_data, _stamp_fields(db_record, update_data))
+    try:
+        db.commit()
+    except StaleDataError:
+        # Another writer committed between our read and this UPDATE
+        db.rollback()
+        raise VersionConflict(get_anesthesia_record(db, record_id))
+    events.publish(record_id, "record.updated", change)
+    # Reload with relationships for the response
+    return get_anesthesia_record(db, record_id)
+
+# Field-level edits from several stations
+COEDIT_FIELDS = frozenset(schemas.AnesthesiaRecordChanges.model_fields) - {"patient_id", "location_id"}
+
+def get_record_fields(db: Session, record_id: int) -> Optional[dict]:
+    """Editable fields with their versions, as co-editing stations start from"""
+    db_record = db.get(models.AnesthesiaRecord, record_id)
+    if not db_record:
+        return None
+    return {"version": db_record.version, "fields": {field: getattr(db_record, field) for field in COEDIT_FIELDS},
+            "versions": db_record.field_versions or {}}
+
+def apply_field_changes(db: Session, record_id: int, changes: Dict[str, schemas.FieldChange],
+                        station: Optional[str] = None, attempts: int = 3) -> Optional[schemas.FieldChangeResult]:
+    """Per-field last-writer-wins with version checks. A change applies when
+    its base is the field's current version (or None); otherwise the field's
+    current value comes back as a conflict for the client to resolve."""
+    for attempt in range(attempts):
+        try:
+            return _apply_field_changes(db, record_id, changes, station)
+        except StaleDataError:
+            # The record moved on between read and write: check the fields again
+            db.rollback()
+            if attempt == attempts - 1:
+                raise
+
+def _apply_field_changes(db: Session, record_id: int, changes: Dict[str, schemas.FieldChange],
+                         station: Optional[str]) -> Optional[schemas.FieldChangeResult]:
+    db_record = db.get(models.AnesthesiaRecord, record_id)
+    if not db_record:
+        return None
+    
+    versions = db_record.field_versions or {}
+    result = schemas.FieldChangeResult(version=db_record.version)
+    values = {}
+    for field, change in changes.items():
+        if field not in COEDIT_FIELDS:
+            result.rejected[field] = "not an editable field"
+            continue
+        current = versions.get(field, 0)
+        if change.base is not None and change.base < current:
+            result.conflicts[field] = schemas.FieldConflict(value=getattr(db_record, field), version=current)
+            continue
+        try:
+            value = schemas.AnesthesiaRecordChanges.model_validate({field: change.value}).dict(exclude_unset=True)[field]
+        except ValidationError as e:
+            result.rejected[field] = e.errors()[0]["msg"]
+            continue
+        if getattr(db_record, field) == value:
+            # Nothing to write; the client is current
+            result.applied[field] = current
+        else:
+            values[field] = value
+    
+    if values:
+        for field, value in values.items():
+            setattr(db_record, field, value)
+        stamped = _stamp_fields(db_record, values)
+        result.applied.update(stamped)
+        result.version = db_record.version
+        change = _record_change(db_record, values, stamped, station)
+        db.commit()
+        events.publish(record_id, "record.updated", change)
+    return result
 
 # Medication Administration CRUD
-def add_medication_administration(db: Session, administration: schemas.MedicationAdministrationCreate):
+def add_medication_administration(db: Session, administration: schemas.MedicationAdministrationCreate,
+                                  idempotency_key: Optional[models.IdempotencyKey] = None):
     db_admin = models.MedicationAdministration(**administration.dict())
     db.add(db_admin)
+    _claim_key(db, idempotency_key, db_admin)
     
     # Decrement inventory
-    record = get_anesthesia_record(db, administration.record_id)
-    if record:
+    location_id = db.query(models.AnesthesiaRecord.location_id).filter(
+        models.AnesthesiaRecord.id == administration.record_id
+    ).scalar()
+    if location_id is not None:
         total_used = administration.dose_ml + administration.waste_ml
-        decrement_inventory(db, administration.medication_id, record.location_id, total_used)
+        decrement_inventory(db, administration.medication_id, location_id, total_used)
     
     db.commit()
     db.refresh(db_admin)
+    events.publish(db_admin.record_id, "administration.added",
+                   lambda: serialization.to_dict(db_admin, schemas.MedicationAdministration))
     return db_admin
 
 # Vital Signs CRUD
-def add_vital_sign(db: Session, vital_sign: schemas.VitalSignCreate):
+def add_vital_sign(db: Session, vital_sign: schemas.VitalSignCreate,
+                   idempotency_key: Optional[models.IdempotencyKey] = None):
     db_vital = models.VitalSign(**vital_sign.dict())
     db.add(db_vital)
+    _claim_key(db, idempotency_key, db_vital)
     db.commit()
     db.refresh(db_vital)
+    events.publish(db_vital.record_id, "vital.added", lambda: serialization.to_dict(db_vital, schemas.VitalSign))
     return db_vital
 
+def get_vital_signs(db: Session, record_id: int, since: Optional[int] = None):
+    """since: only vitals with a greater id (the live view's cursor)"""
+    query = db.query(models.VitalSign).filter(models.VitalSign.record_id == record_id)
+    if since is not None:
+        query = query.filter(models.VitalSign.id > since)
+    return query.order_by(models.VitalSign.timestamp, models.VitalSign.id).all()
+
 # Export functions
 def generate_anesthesia_note(record: models.AnesthesiaRecord) -> str:
     """Generate markdown formatted anesthesia note"""
@@ -168,7 +410,7 @@ def generate_anesthesia_note(record: models.AnesthesiaRecord) -> str:
 - Mallampati: {record.mallampati or 'Not assessed'}
 - Height: {record.height_cm} cm
 - Weight: {record.weight_kg} kg
-- BMI: {record.bmi:.1f if record.bmi else 'Not calculated'}
+- BMI: {f'{record.bmi:.1f}' if record.bmi else 'Not calculated'}
 - NPO Since: {record.npo_since.strftime('%H:%M') if record.npo_since else 'Not recorded'}
 
 ## Providers
@@ -0,0 +1,88 @@
+"""Content negotiation for vitals-bearing responses.
+
+A long case carries thousands of vital signs, each repeating every channel
+name. Clients that send
+
+  Accept: application/vnd.anesthesia.columnar+json
+
+get the vitals as one array per channel instead, and
+
+  Accept: application/msgpack
+
+gets the same columnar body packed as MessagePack. Anything else, or no
+Accept header, keeps the plain JSON list of objects.
+"""
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse, Response
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import serialization
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.anesthesia.columnar+json"
+MSGPACK = "application/msgpack"
+SUPPORTED = (JSON, COLUMNAR_JSON, MSGPACK)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Pick the supported media type with the highest q-value; JSON by default"""
+    best, best_q = JSON, 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if media_type == "application/x-msgpack":
+            media_type = MSGPACK
+        if media_type not in SUPPORTED:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def pack(data) -> bytes:
+    try:
+        import msgpack
+    except ImportError:
+        raise HTTPException(status_code=406, detail="MessagePack is not available on this server")
+    return msgpack.packb(data, default=_msgpack_default)
+
+
+def render(data, media_type: str) -> Response:
+    """Encode an already columnar (or plain) body as `media_type`"""
+    headers = {"Vary": "Accept"}
+    if media_type == MSGPACK:
+        return Response(content=pack(data), media_type=MSGPACK, headers=headers)
+    if media_type == COLUMNAR_JSON:
+        return ORJSONResponse(data, media_type=COLUMNAR_JSON, headers=headers)
+    return ORJSONResponse(data, headers=headers)
+
+
+def render_record(data: dict, media_type: str) -> Response:
+    """Record body with `vital_signs` in columnar form unless plain JSON was asked for"""
+    if media_type != JSON and "vital_signs" in data:
+        data = dict(data, vital_signs=serialization.columnar_vitals(data["vital_signs"]))
+    return render(data, media_type)
+
+
+def render_vitals(vitals: list, media_type: str) -> Response:
+    if media_type != JSON:
+        return render(serialization.columnar_vitals(vitals), media_type)
+    return render(vitals, media_type)
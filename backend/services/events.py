@@ -0,0 +1,328 @@
+"""Change events for anesthesia records, streamed as Server-Sent Events.
+
+The crud write functions call publish() after their commit, and every
+GET /api/records/{id}/events stream subscribes to its record:
+
+- vital.added / administration.added carry the new row as the API returns it
+- record.updated carries the fields set by the PUT and the new updated_at
+- ready (on connect) and resync (when events were missed) carry no change;
+  clients load the record after ready and reload it after resync
+
+Events are numbered per record. The last EVENT_BACKLOG events of a watched
+record are kept, so a reconnecting EventSource resumes from its
+Last-Event-ID without gaps. Ids include a token of the worker process; an id
+from another process (or from before a restart) gets resync.
+
+The bus lives in the worker process, so with several workers a stream only
+sees writes handled by its own worker. Streams then also poll the record's
+change marks (crud.get_record_change_marks) every EVENTS_POLL_INTERVAL
+seconds and send record.changed when they moved without a matching event.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+import orjson
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+_MULTI_WORKER = int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+EVENT_BACKLOG = int(os.getenv("EVENT_BACKLOG", "256"))
+# Events queued for a stream that is not keeping up; past this it gets resync
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "2" if _MULTI_WORKER else "0"))
+# Streams end after this long and the client reconnects with Last-Event-ID,
+# so open streams do not hold up a graceful shutdown and rebalance over workers
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", "300"))
+# How long the backlog of a record is kept after its last subscriber left
+CHANNEL_IDLE_TTL = float(os.getenv("EVENTS_CHANNEL_IDLE_TTL", "600"))
+RETRY_MS = 2000
+
+_BOOT = uuid.uuid4().hex[:8]
+
+
+class Event(NamedTuple):
+    seq: Optional[int]
+    type: str
+    data: dict
+    payload: bytes
+
+
+def _format(event_id: Optional[str], event_type: str, data) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event_type}\ndata: ".encode() + orjson.dumps(data, default=str) + b"\n\n"
+
+
+def _event_id(seq: int) -> str:
+    return f"{_BOOT}-{seq}"
+
+
+def _parse_event_id(value: Optional[str]) -> Optional[int]:
+    """Sequence number of an id issued by this process, else None"""
+    if not value:
+        return None
+    boot, _, seq = value.partition("-")
+    if boot != _BOOT or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+class Subscription:
+    def __init__(self, record_id: int, loop: asyncio.AbstractEventLoop):
+        self.record_id = record_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def deliver(self, event: Event):
+        # publish() runs in threadpool threads; the queue belongs to the loop
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # loop closed during shutdown
+
+
+class _Channel:
+    __slots__ = ("seq", "backlog", "subscribers", "idle_since")
+
+    def __init__(self):
+        self.seq = 0
+        self.backlog: deque = deque(maxlen=EVENT_BACKLOG)
+        self.subscribers: set = set()
+        self.idle_since: Optional[float] = None
+
+
+class EventBus:
+    """Per-record fan-out. Records nobody watches have no channel, so
+    publishing to them is a dict lookup and the payload is never built."""
+
+    def __init__(self):
+        self._channels: Dict[int, _Channel] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, record_id: int, event_type: str, data: Union[dict, Callable[[], dict]]) -> Optional[Event]:
+        if record_id not in self._channels:
+            return None
+        if callable(data):
+            data = data()
+        with self._lock:
+            channel = self._channels.get(record_id)
+            if channel is None:
+                return None
+            channel.seq += 1
+            event = Event(channel.seq, event_type, data, _format(_event_id(channel.seq), event_type, data))
+            channel.backlog.append(event)
+            subscribers = list(channel.subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, record_id: int) -> Subscription:
+        subscription = Subscription(record_id, asyncio.get_running_loop())
+        with self._lock:
+            self._expire_idle()
+            channel = self._channels.get(record_id)
+            if channel is None:
+                channel = self._channels[record_id] = _Channel()
+            channel.subscribers.add(subscription)
+            channel.idle_since = None
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            channel = self._channels.get(subscription.record_id)
+            if channel is not None:
+                channel.subscribers.discard(subscription)
+                if not channel.subscribers:
+                    channel.idle_since = time.monotonic()
+
+    def position(self, record_id: int) -> int:
+        channel = self._channels.get(record_id)
+        return channel.seq if channel else 0
+
+    def replay(self, record_id: int, after: int) -> Optional[List[Event]]:
+        """Events after seq `after`, or None when the backlog no longer reaches back that far"""
+        with self._lock:
+            channel = self._channels.get(record_id)
+            if channel is None or after > channel.seq:
+                return None
+            missed = [event for event in channel.backlog if event.seq > after]
+        if len(missed) < channel.seq - after:
+            return None
+        return missed
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(channel.subscribers) for channel in self._channels.values())
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - CHANNEL_IDLE_TTL
+        for record_id in [record_id for record_id, channel in self._channels.items()
+                          if channel.idle_since is not None and channel.idle_since < cutoff]:
+            del self._channels[record_id]
+
+
+bus = EventBus()
+
+
+# Writes committed later as part of a batch (services/group_commit.py) hold
+# their events until the batch is committed
+_held = threading.local()
+
+
+@contextmanager
+def held():
+    """publish() calls in this thread are collected in the yielded list
+    instead of sent; hand it to release() once the commit succeeded"""
+    _held.events = pending = []
+    try:
+        yield pending
+    finally:
+        _held.events = None
+
+
+def release(pending: list):
+    for args in pending:
+        publish(*args)
+
+
+def publish(record_id: int, event_type: str, data: Union[dict, Callable[[], dict]]):
+    """Called by crud after a commit; `data` may be a function so nothing is
+    serialized for records without subscribers"""
+    pending = getattr(_held, "events", None)
+    if pending is not None:
+        pending.append((record_id, event_type, data))
+        return
+    try:
+        bus.publish(record_id, event_type, data)
+    except Exception:
+        # The write is committed; a lost event must not fail the request
+        logger.exception("Publishing %s for record %s failed", event_type, record_id)
+
+
+# Change marks, for existence checks and the multi-worker poll
+def _read_marks(record_id: int):
+    from models import SessionLocal
+    from services import crud
+
+    db = SessionLocal()
+    try:
+        return crud.get_record_change_marks(db, record_id)
+    finally:
+        db.close()
+
+
+async def get_marks(record_id: int):
+    # run_in_executor does not copy the request context, so the poll's
+    # queries stay out of the stream's QueryStats and its N+1 check
+    return await asyncio.get_running_loop().run_in_executor(None, _read_marks, record_id)
+
+
+def _marks_data(marks) -> dict:
+    updated_at, last_vital_id, last_administration_id = marks
+    return {"updated_at": updated_at, "last_vital_id": last_vital_id,
+            "last_administration_id": last_administration_id}
+
+
+def _advance(marks: list, event: Event):
+    """Moves the marks a stream has seen past a delivered event"""
+    if event.type == "vital.added":
+        marks[1] = max(marks[1] or 0, event.data["id"])
+    elif event.type == "administration.added":
+        marks[2] = max(marks[2] or 0, event.data["id"])
+    elif event.type == "record.updated":
+        marks[0] = event.data["updated_at"]
+
+
+def _control(seq: Optional[int], event_type: str, record_id: int, marks) -> Event:
+    """An event that is not in the backlog: ready, resync, record.changed"""
+    data = {"record_id": record_id, **_marks_data(marks)}
+    return Event(seq, event_type, data, _format(_event_id(seq) if seq is not None else None, event_type, data))
+
+
+async def follow(record_id: int, last_event_id: Optional[str], marks,
+                 max_seconds: Optional[float] = EVENTS_MAX_STREAM_SECONDS):
+    """Events of one record for one client, and None whenever EVENTS_HEARTBEAT
+    passed without one. `marks` are the record's change marks read when the
+    client was accepted. Ends after max_seconds (None: when the record is gone)."""
+    subscription = bus.subscribe(record_id)
+    loop = asyncio.get_running_loop()
+    seen = list(marks)
+    try:
+        after = _parse_event_id(last_event_id)
+        missed = bus.replay(record_id, after) if after is not None else None
+        if missed is None:
+            # Events published since subscribe() are in the queue as well
+            sent = bus.position(record_id)
+            yield _control(sent, "resync" if last_event_id else "ready", record_id, seen)
+        else:
+            sent = after
+            for event in missed:
+                sent = event.seq
+                yield event
+
+        deadline = loop.time() + max_seconds if max_seconds else float("inf")
+        tick = min(EVENTS_POLL_INTERVAL or EVENTS_HEARTBEAT, EVENTS_HEARTBEAT)
+        last_write = next_poll = loop.time()
+        while loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=tick)
+            except asyncio.TimeoutError:
+                event = None
+
+            if subscription.overflowed:
+                # Too slow to keep up: drop the queue and let the client refetch
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.overflowed = False
+                sent = bus.position(record_id)
+                seen = list(await get_marks(record_id) or seen)
+                yield _control(sent, "resync", record_id, seen)
+                last_write = loop.time()
+                continue
+
+            if event is not None and event.seq > sent:
+                sent = event.seq
+                _advance(seen, event)
+                yield event
+                last_write = loop.time()
+
+            now = loop.time()
+            if EVENTS_POLL_INTERVAL and now >= next_poll:
+                next_poll = now + EVENTS_POLL_INTERVAL
+                current = await get_marks(record_id)
+                if current is None:
+                    return
+                if list(current) != seen:
+                    # Written through another worker
+                    seen = list(current)
+                    yield _control(None, "record.changed", record_id, seen)
+                    last_write = loop.time()
+            if loop.time() - last_write >= EVENTS_HEARTBEAT:
+                yield None
+                last_write = loop.time()
+    finally:
+        bus.unsubscribe(subscription)
+
+
+async def stream(record_id: int, last_event_id: Optional[str], marks):
+    """SSE body for one client"""
+    yield f"retry: {RETRY_MS}\n\n".encode()
+    async for event in follow(record_id, last_event_id, marks):
+        yield event.payload if event is not None else b": keepalive\n\n"
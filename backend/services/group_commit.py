@@ -0,0 +1,150 @@
+"""Group commit: one writer thread commits many writes at once.
+
+With GROUP_COMMIT=1 (SQLite only) the hot write endpoints (vitals, doses,
+record PUT and field edits) hand their work to run() instead of running it
+in its own session under the write lock (coordination.run_write). A single
+writer thread collects the operations that arrive within
+GROUP_COMMIT_WINDOW_MS, up to GROUP_COMMIT_MAX_BATCH, and runs them in one
+transaction under the write lock, so the batch pays for one lock acquisition
+and one fsync.
+
+Each operation gets its own Session joined to the batch's connection with
+join_transaction_mode="create_savepoint": crud's commit() releases a
+SAVEPOINT, and an operation that fails is rolled back alone while the rest
+of the batch commits. Operations run in order and see the writes before
+them. Their events (services/events.py) are sent once the batch committed;
+if the commit fails, every operation of the batch gets the error.
+
+Operations return plain data (serialized rows), never ORM objects: their
+session is closed before the caller receives the result.
+"""
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, NamedTuple
+
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import engine
+from services import coordination, events, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1" and coordination.IS_SQLITE
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+batch_size = metrics.Histogram("db_group_commit_batch_size", "Writes committed per group commit", (),
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class _Operation(NamedTuple):
+    fn: Callable
+    args: tuple
+    context: contextvars.Context
+    future: Future
+
+
+class GroupCommitter:
+    def __init__(self, window_ms: float = GROUP_COMMIT_WINDOW_MS, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[_Operation]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        if self._thread is None:
+            self.start()
+        # The caller's context, so the queries count towards its request
+        # (QueryStats) and a profiled request includes them
+        operation = _Operation(fn, args, contextvars.copy_context(), Future())
+        self._queue.put(operation)
+        return operation.future
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Commits what is queued, then ends the thread"""
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+            self._thread = None
+
+    def _collect(self, first: _Operation) -> List[_Operation]:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                # Whatever queued up during the last commit is taken without waiting
+                operation = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if operation is None:
+                self._queue.put(None)
+                break
+            batch.append(operation)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.exception("Group commit of %s write(s) failed", len(batch))
+                for operation in batch:
+                    if not operation.future.done():
+                        operation.future.set_exception(e)
+
+    def _commit(self, batch: List[_Operation]):
+        results = []
+        with coordination.write_lock(), engine.connect() as connection, events.held() as pending:
+            transaction = connection.begin()
+            # pysqlite only opens a transaction before DML, and a SAVEPOINT
+            # outside one is committed by its RELEASE
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            for operation in batch:
+                db = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
+                try:
+                    results.append((operation, operation.context.run(
+                        profiling.run_profiled, operation.fn, db, *operation.args), None))
+                except Exception as e:
+                    results.append((operation, None, e))
+                finally:
+                    db.close()
+            transaction.commit()
+        if metrics.METRICS_ENABLED:
+            batch_size.observe((), len(batch))
+        events.release(pending)
+        for operation, result, error in results:
+            if error is not None:
+                operation.future.set_exception(error)
+            else:
+                operation.future.set_result(result)
+
+
+committer = GroupCommitter()
+
+
+def run(fn: Callable[..., Any], *args):
+    """fn(db, *args) in a committed transaction, batched with other writes when
+    GROUP_COMMIT is on; otherwise in its own session under the write lock"""
+    if GROUP_COMMIT:
+        return committer.submit(fn, *args).result()
+    return coordination.run_write(fn, *args)
@@ -0,0 +1,83 @@
+"""Idempotency-Key support for the create endpoints.
+
+POST /api/records/, /api/records/{id}/medications/ and /api/records/{id}/vitals/
+accept an `Idempotency-Key` header. The key is stored in the transaction that
+creates the row (crud._claim_key), so a retry of a request that committed
+gets the row it created, with `Idempotent-Replayed: true`, instead of a
+duplicate dose or vital. The same key with another path or body is a 422.
+
+Keys are kept IDEMPOTENCY_TTL_HOURS and purged by the write path itself.
+Lookups run under the write lock (group_commit.run); without it
+(PostgreSQL) the unique index turns a concurrent duplicate into an error,
+and the client's next retry gets the replay.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import models
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+PURGE_INTERVAL = 300
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+_next_purge = 0.0
+
+
+def request_hash(body: BaseModel) -> str:
+    return hashlib.sha256(orjson.dumps(body.model_dump(), option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def _purge_expired(db: Session, cutoff: datetime):
+    """Committed on its own: a replay or a 422 closes the session uncommitted.
+    Runs before the request has written anything."""
+    global _next_purge
+    now = time.monotonic()
+    if now < _next_purge:
+        return
+    db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    _next_purge = now + PURGE_INTERVAL
+
+
+def lookup(db: Session, key: Optional[str], path: str, body: BaseModel, model) -> Optional[models.IdempotencyKey]:
+    """None without a key. Otherwise the stored key, whose resource_id is the
+    `model` row to replay, or a new one for crud to claim along with the row it
+    creates. A key whose row was deleted since counts as expired."""
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+    digest = request_hash(body)
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    _purge_expired(db, cutoff)
+
+    stored = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).first()
+    if stored is not None and stored.created_at >= cutoff:
+        if stored.request_path != path or stored.request_hash != digest:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if db.get(model, stored.resource_id) is not None:
+            return stored
+    if stored is not None:
+        # Expired, or its row was deleted: the request is processed again
+        db.delete(stored)
+        db.flush()
+    return models.IdempotencyKey(key=key, request_path=path, request_hash=digest)
+
+
+def replayed(content: dict) -> ORJSONResponse:
+    return ORJSONResponse(content=content, headers={REPLAYED_HEADER: "true"})
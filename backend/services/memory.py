@@ -0,0 +1,179 @@
+"""Memory snapshots and growth alerts for long-running workers.
+
+tracemalloc is off by default (it slows allocation-heavy code noticeably);
+switch it on through the admin endpoint or with TRACEMALLOC=1. Snapshots
+are kept in memory, the oldest dropped past MEMORY_SNAPSHOTS_KEPT, and can
+be diffed to find the allocation sites that grew.
+
+Independently of tracing, MemoryWatch checks RSS every
+MEMORY_WATCH_INTERVAL seconds and logs a warning once growth over the first
+reading passes MEMORY_GROWTH_ALERT_MB.
+"""
+import asyncio
+import logging
+import os
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+MEMORY_SNAPSHOTS_KEPT = int(os.getenv("MEMORY_SNAPSHOTS_KEPT", "5"))
+MEMORY_GROWTH_ALERT_MB = float(os.getenv("MEMORY_GROWTH_ALERT_MB", "256"))
+MEMORY_WATCH_INTERVAL = float(os.getenv("MEMORY_WATCH_INTERVAL", "60"))
+
+MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size; None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Tracing and snapshots
+_snapshots: "OrderedDict[int, dict]" = OrderedDict()
+_next_id = 1
+
+
+def set_tracing(enabled: bool):
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        # Snapshots cannot be compared across tracing sessions
+        _snapshots.clear()
+
+
+def _top(statistics, limit: int) -> List[dict]:
+    rows = []
+    for stat in statistics[:limit]:
+        frame = stat.traceback[0]
+        rows.append({
+            "site": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+            "size_diff_kb": round(getattr(stat, "size_diff", 0) / 1024, 1),
+            "count_diff": getattr(stat, "count_diff", 0),
+        })
+    return rows
+
+
+def _summary(entry: dict, limit: int = 0) -> dict:
+    summary = {key: entry[key] for key in ("id", "taken_at", "traced_kb", "peak_kb", "rss_mb")}
+    if limit:
+        summary["top"] = _top(entry["snapshot"].statistics("lineno"), limit)
+    return summary
+
+
+def take_snapshot(limit: int = 25) -> dict:
+    """Raises RuntimeError when tracing is off"""
+    global _next_id
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing; enable it first")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    rss = rss_bytes()
+    entry = {
+        "id": _next_id,
+        "taken_at": datetime.now(),
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "rss_mb": round(rss / MB, 1) if rss else None,
+        "snapshot": snapshot,
+    }
+    _snapshots[_next_id] = entry
+    _next_id += 1
+    while len(_snapshots) > MEMORY_SNAPSHOTS_KEPT:
+        _snapshots.popitem(last=False)
+    return _summary(entry, limit)
+
+
+def list_snapshots() -> List[dict]:
+    return [_summary(entry) for entry in _snapshots.values()]
+
+
+def diff_snapshots(base_id: Optional[int] = None, current_id: Optional[int] = None, limit: int = 25) -> dict:
+    """Top allocation sites by growth; defaults to oldest vs. newest kept snapshot.
+    Raises KeyError for unknown ids and ValueError with fewer than two snapshots."""
+    if len(_snapshots) < 2 and (base_id is None or current_id is None):
+        raise ValueError("Need two snapshots to diff")
+    ids = list(_snapshots)
+    base = _snapshots[base_id if base_id is not None else ids[0]]
+    current = _snapshots[current_id if current_id is not None else ids[-1]]
+    stats = current["snapshot"].compare_to(base["snapshot"], "lineno")
+    return {
+        "base": _summary(base),
+        "current": _summary(current),
+        "traced_growth_kb": round(current["traced_kb"] - base["traced_kb"], 1),
+        "top": _top(stats, limit),
+    }
+
+
+# RSS growth watch
+class MemoryWatch:
+    def __init__(self, interval: float = MEMORY_WATCH_INTERVAL, threshold_mb: float = MEMORY_GROWTH_ALERT_MB):
+        self.interval = interval
+        self.threshold_mb = threshold_mb
+        self.baseline: Optional[int] = None
+        self.last: Optional[int] = None
+        self.alerted = False
+        self._task: Optional[asyncio.Task] = None
+
+    def check(self) -> dict:
+        rss = rss_bytes()
+        if rss is not None:
+            if self.baseline is None:
+                self.baseline = rss
+            self.last = rss
+            growth_mb = (rss - self.baseline) / MB
+            if growth_mb > self.threshold_mb and not self.alerted:
+                self.alerted = True
+                logger.warning("RSS grew %.0f MB since startup (now %.0f MB, alert at %.0f MB growth)",
+                               growth_mb, rss / MB, self.threshold_mb)
+        return self.status()
+
+    def status(self) -> dict:
+        growth = (self.last - self.baseline) / MB if self.last is not None and self.baseline is not None else None
+        return {
+            "rss_mb": round(self.last / MB, 1) if self.last else None,
+            "baseline_mb": round(self.baseline / MB, 1) if self.baseline else None,
+            "growth_mb": round(growth, 1) if growth is not None else None,
+            "alert_threshold_mb": self.threshold_mb,
+            "alert": self.alerted,
+            "tracing": tracemalloc.is_tracing(),
+            "snapshots": len(_snapshots),
+        }
+
+    def start(self):
+        self.check()
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+memory_watch = MemoryWatch()
+
+if os.getenv("TRACEMALLOC", "0") == "1":
+    set_tracing(True)
@@ -0,0 +1,190 @@
+"""Request metrics in the Prometheus text format.
+
+MetricsMiddleware times every request against its route template (e.g.
+/api/records/{record_id}), so the label set stays bounded. Observations are
+a bisect and a few integer increments under an uncontended lock, which is
+cheap enough to leave on. Each worker process keeps its own numbers; scrape
+the workers individually or sum them in Prometheus.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import engine
+from services import memory
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Every Counter and Histogram, here or in other modules, is rendered by /metrics
+_registry: List = []
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by a label tuple"""
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # bucket counts, then +Inf, sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            label_text = _labels(self.label_names, labels)
+            prefix = label_text + "," if label_text else ""
+            suffix = f"{{{label_text}}}" if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{suffix} {series[-1]}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _gauge(name: str, help: str, value) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+request_latency = Histogram("http_request_duration_seconds", "Request latency by route",
+                            ("method", "route"))
+request_count = Counter("http_requests_total", "Requests by route and status", ("method", "route", "status"))
+lock_wait = Histogram("db_write_lock_wait_seconds", "Time spent waiting for the database write lock", ())
+_in_flight = 0
+
+
+class MetricsMiddleware:
+    """ASGI middleware; plain ASGI rather than BaseHTTPMiddleware to keep the per-request cost small"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        global _in_flight
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _in_flight -= 1
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot blow up the series count
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            request_latency.observe((method, path), elapsed)
+            request_count.inc((method, path, status))
+
+
+def _pool_lines() -> List[str]:
+    pool = engine.pool
+    lines = []
+    for name, attr, help in (
+        ("db_pool_size", "size", "Configured connection pool size"),
+        ("db_pool_checked_out", "checkedout", "Connections currently in use"),
+        ("db_pool_checked_in", "checkedin", "Idle connections in the pool"),
+        ("db_pool_overflow", "overflow", "Connections opened beyond the pool size"),
+    ):
+        fn = getattr(pool, attr, None)
+        if fn is not None:
+            lines += _gauge(name, help, fn())
+    return lines
+
+
+def _cache_lines() -> List[str]:
+    from services import patient_lookup, read_cache
+
+    lines = ["# HELP cache_events_total Cache lookups by outcome", "# TYPE cache_events_total counter"]
+    sizes = ["# HELP cache_entries Entries currently cached", "# TYPE cache_entries gauge"]
+    for cache_name, cache in (
+        ("reference", read_cache.reference_cache),
+        ("record", read_cache.record_cache),
+        ("patient", patient_lookup.patient_cache),
+    ):
+        snapshot = cache.snapshot()
+        sizes.append(f'cache_entries{{cache="{cache_name}"}} {snapshot.pop("size")}')
+        for event, value in sorted(snapshot.items()):
+            lines.append(f'cache_events_total{{cache="{cache_name}",event="{event}"}} {value}')
+    return lines + sizes
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += _gauge("http_requests_in_flight", "Requests currently being handled", _in_flight)
+    from services import events
+    lines += _gauge("record_event_subscribers", "Open record event streams", events.bus.subscriber_count())
+    rss = memory.rss_bytes()
+    if rss is not None:
+        lines += _gauge("process_resident_memory_bytes", "Resident memory of this worker", rss)
+    lines += _pool_lines()
+    lines += _cache_lines()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+import os
+import threading
+from datetime import date, datetime
+from typing import TYPE_CHECKING, List, Optional
+
+# httpx is imported where it is used so the API starts without paying for
+# it until the integration is actually exercised
+if TYPE_CHECKING:
+    import httpx
+
+# Open Dental API configuration. Leave OPEN_DENTAL_URL unset to keep the
+# integration endpoints in stub mode.
+OPEN_DENTAL_URL = os.getenv("OPEN_DENTAL_URL", "").rstrip("/")
+OPEN_DENTAL_API_KEY = os.getenv("OPEN_DENTAL_API_KEY", "")
+OPEN_DENTAL_TIMEOUT = float(os.getenv("OPEN_DENTAL_TIMEOUT", "10"))
+OPEN_DENTAL_MAX_CONNECTIONS = int(os.getenv("OPEN_DENTAL_MAX_CONNECTIONS", "8"))
+OPEN_DENTAL_PAGE_SIZE = 100  # Open Dental caps list endpoints at 100 rows per call
+
+
+class OpenDentalError(Exception):
+    """Raised when Open Dental rejects or fails a request"""
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: float = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def is_configured() -> bool:
+    return bool(OPEN_DENTAL_URL)
+
+
+def _client_options() -> dict:
+    import httpx
+    headers = {"Content-Type": "application/json"}
+    if OPEN_DENTAL_API_KEY:
+        headers["Authorization"] = f"ODFHIR {OPEN_DENTAL_API_KEY}"
+    return {
+        "base_url": OPEN_DENTAL_URL,
+        "headers": headers,
+        "timeout": OPEN_DENTAL_TIMEOUT,
+        "limits": httpx.Limits(
+            max_connections=OPEN_DENTAL_MAX_CONNECTIONS,
+            max_keepalive_connections=OPEN_DENTAL_MAX_CONNECTIONS,
+        ),
+    }
+
+
+def create_async_client() -> "httpx.AsyncClient":
+    """Pooled client shared by the background workers"""
+    import httpx
+    return httpx.AsyncClient(**_client_options())
+
+
+_client: Optional["httpx.Client"] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> "httpx.Client":
+    """Process-wide pooled client for lookups made from request handlers"""
+    import httpx
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(**_client_options())
+        return _client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def build_commlog(record, note: str) -> dict:
+    """Open Dental commlog payload carrying the anesthesia note"""
+    return {
+        "PatNum": record.patient.open_dental_id if record.patient else None,
+        "CommDateTime": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "Note": note,
+    }
+
+
+def _raise_for_response(response: "httpx.Response"):
+    if response.status_code < 400:
+        return
+    retry_after = response.headers.get("Retry-After")
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    retryable = response.status_code == 429 or response.status_code >= 500
+    raise OpenDentalError(
+        f"Open Dental returned {response.status_code}: {response.text[:200]}",
+        retryable=retryable,
+        retry_after=retry_after,
+    )
+
+
+async def push_commlog(client: "httpx.AsyncClient", payload: dict, idempotency_key: str) -> dict:
+    import httpx
+    try:
+        response = await client.post(
+            "/commlogs", json=payload, headers={"Idempotency-Key": idempotency_key}
+        )
+    except httpx.TransportError as e:
+        raise OpenDentalError(f"{type(e).__name__}: {e}") from e
+    _raise_for_response(response)
+    return response.json()
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    # Open Dental sends dates as yyyy-MM-dd
+    return datetime.strptime(value[:10], "%Y-%m-%d") if value else None
+
+
+def parse_patient(data: dict) -> dict:
+    """Map an Open Dental patient to the fields of schemas.PatientCreate"""
+    return {
+        "open_dental_id": str(data["PatNum"]),
+        "first_name": data.get("FName") or "",
+        "last_name": data.get("LName") or "",
+        "date_of_birth": _parse_date(data.get("Birthdate")),
+        "medical_record_number": data.get("ChartNumber") or None,
+    }
+
+
+def stub_patient(patient_id: str) -> dict:
+    # Used while OPEN_DENTAL_URL is unset
+    return {
+        "PatNum": patient_id,
+        "FName": "John",
+        "LName": "Doe",
+        "Birthdate": "1990-01-01",
+        "ChartNumber": "MRN123456"
+    }
+
+
+def fetch_patient(patient_id: str) -> Optional[dict]:
+    """Fetch one patient; returns None when Open Dental does not know the ID"""
+    if not is_configured():
+        return parse_patient(stub_patient(patient_id))
+    import httpx
+    try:
+        response = get_client().get(f"/patients/{patient_id}")
+    except httpx.TransportError as e:
+        raise OpenDentalError(f"{type(e).__name__}: {e}") from e
+    if response.status_code in (400, 404):
+        return None
+    _raise_for_response(response)
+    return parse_patient(response.json())
+
+
+def fetch_schedule(day: date) -> List[dict]:
+    """All appointments booked on `day`, following Open Dental's Offset paging"""
+    if not is_configured():
+        return []
+    import httpx
+    appointments = []
+    while True:
+        try:
+            response = get_client().get("/appointments", params={
+                "date": day.isoformat(),
+                "Offset": len(appointments),
+            })
+        except httpx.TransportError as e:
+            raise OpenDentalError(f"{type(e).__name__}: {e}") from e
+        _raise_for_response(response)
+        page = response.json()
+        appointments.extend(page)
+        if len(page) < OPEN_DENTAL_PAGE_SIZE:
+            return appointments
+
+
+def parse_appointment_time(value: str) -> datetime:
+    # AptDateTime is sent as yyyy-MM-dd HH:mm:ss
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
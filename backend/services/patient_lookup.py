@@ -0,0 +1,81 @@
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import schemas
+from services import coordination, crud, open_dental
+from services.cache import SingleFlight, TTLCache
+
+logger = logging.getLogger(__name__)
+
+PATIENT_CACHE_TTL = float(os.getenv("PATIENT_CACHE_TTL", "900"))
+PATIENT_CACHE_NEGATIVE_TTL = float(os.getenv("PATIENT_CACHE_NEGATIVE_TTL", "60"))
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "4096"))
+
+patient_cache = TTLCache(PATIENT_CACHE_TTL, PATIENT_CACHE_NEGATIVE_TTL, PATIENT_CACHE_SIZE)
+_inflight = SingleFlight()
+stats = {"upstream_calls": 0, "upstream_errors": 0, "stale_served": 0}
+
+
+def _local_copy(db: Session, patient_id: str) -> Optional[dict]:
+    db_patient = crud.get_patient_by_open_dental_id(db, patient_id)
+    return schemas.Patient.model_validate(db_patient).model_dump() if db_patient else None
+
+
+def _store(db: Session, data: dict) -> dict:
+    db_patient = crud.upsert_patient(db, schemas.PatientCreate(**data))
+    return schemas.Patient.model_validate(db_patient).model_dump()
+
+
+def _load(patient_id: str) -> Optional[dict]:
+    # Runs once per key no matter how many requests are waiting on it. Writes
+    # in its own session because followers never touch the leader's session.
+    stats["upstream_calls"] += 1
+    data = open_dental.fetch_patient(patient_id)
+    if data is None:
+        patient_cache.set_negative(patient_id)
+        return None
+
+    patient = coordination.run_write(_store, data)
+    patient_cache.set(patient_id, patient)
+    return patient
+
+
+def lookup_patient(db: Session, patient_id: str) -> Optional[dict]:
+    """Cached Open Dental patient lookup with write-through to the patients table.
+
+    Returns None for IDs Open Dental does not know. If Open Dental is
+    unreachable the last local copy is served instead. Without Open Dental
+    configured only local rows are served: fetch_patient() would return demo
+    data, which must not replace a real patient.
+    """
+    if not open_dental.is_configured():
+        return _local_copy(db, patient_id)
+
+    found, patient = patient_cache.get(patient_id)
+    if found:
+        return patient
+
+    try:
+        return _inflight.do(patient_id, lambda: _load(patient_id))
+    except open_dental.OpenDentalError as e:
+        stats["upstream_errors"] += 1
+        patient = _local_copy(db, patient_id)
+        if patient is None:
+            raise
+        logger.warning("Serving local copy of patient %s: %s", patient_id, e)
+        stats["stale_served"] += 1
+        return patient
+
+
+def invalidate(patient_id: str):
+    patient_cache.invalidate(patient_id)
+
+
+def cache_stats() -> dict:
+    return {**patient_cache.snapshot(), **stats, "deduplicated": _inflight.stats["shared"]}
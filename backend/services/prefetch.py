@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal
+from schemas import schemas
+from services import coordination, crud, open_dental, patient_lookup, read_cache
+
+logger = logging.getLogger(__name__)
+
+# Local time the next day's schedule is pulled; empty disables the job
+PREFETCH_AT = os.getenv("PREFETCH_AT", "19:00")
+# Location of appointments whose clinic maps to no location; used only if it exists
+PREFETCH_DEFAULT_LOCATION_ID = int(os.getenv("PREFETCH_DEFAULT_LOCATION_ID", "1"))
+
+
+def _fetch_patient(pat_num: str) -> Optional[dict]:
+    try:
+        return open_dental.fetch_patient(pat_num)
+    except open_dental.OpenDentalError as e:
+        logger.warning("Prefetch could not load patient %s: %s", pat_num, e)
+        return None
+
+
+def _store_day(db: Session, fetched: List[dict], appointments: List[dict]) -> Tuple[Dict[str, int], int, int]:
+    """Upserts the patients and creates the drafts; returns the patient ids,
+    the number of drafts created and the appointments skipped"""
+    patient_ids = crud.bulk_upsert_patients(db, [schemas.PatientCreate(**p) for p in fetched])
+
+    locations = crud.get_locations(db)
+    clinic_locations = {
+        location.open_dental_clinic_num: location.id
+        for location in locations
+        if location.open_dental_clinic_num
+    }
+    default_location_id = PREFETCH_DEFAULT_LOCATION_ID if any(
+        location.id == PREFETCH_DEFAULT_LOCATION_ID for location in locations) else None
+    drafts = []
+    skipped = 0
+    for appt in appointments:
+        patient_id = patient_ids.get(str(appt["PatNum"]))
+        if patient_id is None:
+            continue
+        location_id = clinic_locations.get(str(appt.get("ClinicNum")), default_location_id)
+        if location_id is None:
+            logger.warning("Prefetch skipped appointment %s: no location for clinic %s",
+                           appt["AptNum"], appt.get("ClinicNum"))
+            skipped += 1
+            continue
+        drafts.append({
+            "patient_id": patient_id,
+            "location_id": location_id,
+            "open_dental_appt_id": str(appt["AptNum"]),
+            "scheduled_at": open_dental.parse_appointment_time(appt["AptDateTime"]),
+        })
+    return patient_ids, crud.create_draft_records(db, drafts), skipped
+
+
+def prefetch_day(db: Session, day: date) -> schemas.PrefetchSummary:
+    """Pull `day`'s schedule, upsert its patients and create draft record shells.
+    `db` is only read from; the writes take the write lock (coordination.run_write)."""
+    appointments = open_dental.fetch_schedule(day)
+    pat_nums = sorted({str(appt["PatNum"]) for appt in appointments})
+    with ThreadPoolExecutor(max_workers=open_dental.OPEN_DENTAL_MAX_CONNECTIONS) as pool:
+        fetched = [p for p in pool.map(_fetch_patient, pat_nums) if p]
+
+    patient_ids, created, skipped = coordination.run_write(_store_day, fetched, appointments)
+    for data in fetched:
+        patient = schemas.Patient(id=patient_ids[data["open_dental_id"]], **data)
+        patient_lookup.patient_cache.set(data["open_dental_id"], patient.model_dump())
+
+    read_cache.warm_reference(db)
+    warmed = read_cache.warm_drafts(db, day)
+    return schemas.PrefetchSummary(
+        day=day,
+        appointments=len(appointments),
+        patients=len(patient_ids),
+        drafts_created=created,
+        appointments_skipped=skipped,
+        records_warmed=warmed,
+    )
+
+
+def run_prefetch(day: date) -> schemas.PrefetchSummary:
+    db = SessionLocal()
+    try:
+        summary = prefetch_day(db, day)
+    finally:
+        db.close()
+    logger.info("Prefetched %s: %s", day, summary)
+    return summary
+
+
+def warm_day(day: date) -> int:
+    """Reload caches from drafts already in the database, e.g. after a restart"""
+    db = SessionLocal()
+    try:
+        read_cache.warm_reference(db)
+        return read_cache.warm_drafts(db, day)
+    finally:
+        db.close()
+
+
+def seconds_until(at: str, now: Optional[datetime] = None) -> float:
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(":"))
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+class PrefetchScheduler:
+    """Runs the prefetch for the following day once a day at PREFETCH_AT"""
+
+    def __init__(self, at: str = PREFETCH_AT):
+        self.at = at
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(warm_day, date.today())
+        except Exception:
+            logger.exception("Warming today's drafts failed")
+        while True:
+            await asyncio.sleep(seconds_until(self.at))
+            try:
+                await asyncio.to_thread(run_prefetch, date.today() + timedelta(days=1))
+            except Exception:
+                logger.exception("Scheduled prefetch failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch a day's Open Dental schedule")
+    parser.add_argument("--date", type=date.fromisoformat,
+                        default=date.today() + timedelta(days=1),
+                        help="Day to prefetch (YYYY-MM-DD, default tomorrow)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(run_prefetch(args.date).model_dump_json(indent=2))
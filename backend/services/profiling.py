@@ -0,0 +1,300 @@
+"""On-demand CPU profiling.
+
+Two ways in, both behind the admin token (services/admin.py):
+
+- Per request: send `X-Profile: 1` with `X-Admin-Token`, or switch on
+  profiling of every request (optionally one route) through the admin
+  endpoint. The endpoint function runs under cProfile and the stats are
+  written to PROFILE_DIR as a .prof file (open with snakeviz or pstats);
+  the response names it in X-Profile-File. Work the request hands to the
+  group-commit writer thread is profiled there and merged into the file.
+  The switch is a file in PROFILE_DIR, so it reaches every worker process
+  within TOGGLE_CHECK_INTERVAL seconds.
+- Sampling window: a background thread samples every thread's stack for a
+  fixed number of seconds and writes collapsed stacks (`a;b;c count`) to a
+  .folded file, ready for flamegraph.pl or speedscope. It samples only the
+  worker process that received the request; its status names the pid.
+
+Route endpoints are wrapped once at startup; with profiling off the wrapper
+costs a context variable lookup. PROFILE_DIR keeps the newest
+PROFILE_MAX_FILES profiles.
+"""
+import asyncio
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import admin
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.abspath(os.getenv("PROFILE_DIR", "./profiles"))
+SAMPLING_MAX_SECONDS = float(os.getenv("PROFILE_SAMPLING_MAX_SECONDS", "300"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+TOGGLE_CHECK_INTERVAL = 1.0
+
+# Leaf frames of threads that are only waiting; dropped from samples
+IDLE_LEAVES = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get")}
+
+
+class ProfileTarget:
+    def __init__(self, label: str):
+        self.label = label
+        self.path: Optional[str] = None
+        # Profiles of work run on other threads for this request
+        self.other_threads: list = []
+
+
+_current_target: ContextVar[Optional[ProfileTarget]] = ContextVar("profile_target", default=None)
+
+# Admin toggle: profile every request, or only those matching `route`.
+# Stored in _TOGGLE_PATH for the other workers; profile_all is this
+# process's copy, re-read when the file changed.
+_TOGGLE_PATH = os.path.join(PROFILE_DIR, ".request-profiling.json")
+profile_all = {"enabled": False, "route": None}
+_toggle = {"mtime": None, "next_check": 0.0}
+
+
+def set_request_profiling(enabled: bool, route: Optional[str] = None) -> dict:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    temporary = f"{_TOGGLE_PATH}.{os.getpid()}"
+    with open(temporary, "w") as f:
+        json.dump({"enabled": enabled, "route": route}, f)
+    os.replace(temporary, _TOGGLE_PATH)
+    profile_all.update(enabled=enabled, route=route)
+    return profile_all
+
+
+def request_profiling() -> dict:
+    """The admin toggle as last written by any worker"""
+    now = time.monotonic()
+    if now < _toggle["next_check"]:
+        return profile_all
+    _toggle["next_check"] = now + TOGGLE_CHECK_INTERVAL
+    try:
+        mtime = os.stat(_TOGGLE_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime != _toggle["mtime"]:
+        _toggle["mtime"] = mtime
+        settings = {"enabled": False, "route": None}
+        if mtime is not None:
+            try:
+                with open(_TOGGLE_PATH) as f:
+                    settings.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("Could not read %s: %s", _TOGGLE_PATH, e)
+                return profile_all
+        profile_all.update(settings)
+    return profile_all
+
+
+def _prune():
+    for name in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def _file_name(label: str, suffix: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+    return os.path.join(PROFILE_DIR, f"{stamp}-{safe}{suffix}")
+
+
+def _dump(profiler: cProfile.Profile, target: ProfileTarget):
+    target.path = _file_name(target.label, ".prof")
+    stats = pstats.Stats(profiler)
+    for other in target.other_threads:
+        stats.add(other)
+    stats.dump_stats(target.path)
+    _prune()
+
+
+def run_profiled(fn, *args):
+    """fn(*args), profiled into the current request's profile if it has one.
+    For work a request hands to another thread, run in the request's context."""
+    target = _current_target.get()
+    if target is None:
+        return fn(*args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        target.other_threads.append(profiler)
+
+
+def _wrap(call):
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            target = _current_target.get()
+            if target is None:
+                return await call(*args, **kwargs)
+            # cProfile follows the thread, so awaited work on other tasks is
+            # included while this coroutine is suspended
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profiler.disable()
+                _dump(profiler, target)
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        target = _current_target.get()
+        if target is None:
+            return call(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(call, *args, **kwargs)
+        finally:
+            _dump(profiler, target)
+    return wrapper
+
+
+def instrument_routes(app):
+    """Wrap every endpoint so it can run under cProfile; call after all routes are added"""
+    for route in app.routes:
+        dependant = getattr(route, "dependant", None)
+        if dependant is not None and dependant.call is not None and not getattr(dependant.call, "_profiled", False):
+            dependant.call = _wrap(dependant.call)
+            dependant.call._profiled = True
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not admin.ADMIN_TOKEN:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        requested = headers.get(b"x-profile") == b"1" and admin.is_admin(
+            headers.get(b"x-admin-token", b"").decode("latin-1"))
+        settings = request_profiling()
+        if not requested and not settings["enabled"]:
+            return await self.app(scope, receive, send)
+        if not requested and settings["route"] and not scope["path"].startswith(settings["route"]):
+            return await self.app(scope, receive, send)
+
+        target = ProfileTarget(f"{scope['method']}-{scope['path']}")
+        token = _current_target.set(target)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and target.path:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-file", os.path.basename(target.path).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_target.reset(token)
+
+
+# Sampling profiler
+class SamplingWindow:
+    def __init__(self, seconds: float, interval: float):
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self.path = _file_name("sampling", ".folded")
+        self.started_at = datetime.now()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        _prune()
+        logger.info("Sampling profile written to %s (%s samples)", self.path, self.samples)
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "running": self.running,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "file": os.path.basename(self.path),
+        }
+
+
+_window: Optional[SamplingWindow] = None
+
+
+def start_sampling(seconds: float, interval_ms: float) -> SamplingWindow:
+    """Start a sampling window; raises RuntimeError if one is already running"""
+    global _window
+    if _window is not None and _window.running:
+        raise RuntimeError("A sampling window is already running")
+    _window = SamplingWindow(min(seconds, SAMPLING_MAX_SECONDS), max(interval_ms, 1) / 1000)
+    _window.start()
+    return _window
+
+
+def sampling_status() -> Optional[dict]:
+    return _window.status() if _window else None
+
+
+def list_profiles() -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith((".prof", ".folded"))), reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of a saved profile, or None; never resolves outside PROFILE_DIR"""
+    if os.path.basename(name) != name or name not in list_profiles():
+        return None
+    return os.path.join(PROFILE_DIR, name)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import models
+from services import coordination, crud, open_dental
+
+logger = logging.getLogger(__name__)
+
+PUSH_BATCH_SIZE = int(os.getenv("OPEN_DENTAL_PUSH_BATCH_SIZE", "20"))
+PUSH_CONCURRENCY = int(os.getenv("OPEN_DENTAL_PUSH_CONCURRENCY", "4"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("OPEN_DENTAL_PUSH_MAX_ATTEMPTS", "8"))
+PUSH_BACKOFF_BASE = float(os.getenv("OPEN_DENTAL_PUSH_BACKOFF_BASE", "2"))
+PUSH_BACKOFF_MAX = float(os.getenv("OPEN_DENTAL_PUSH_BACKOFF_MAX", "600"))
+PUSH_POLL_INTERVAL = float(os.getenv("OPEN_DENTAL_PUSH_POLL_INTERVAL", "5"))
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter, capped at PUSH_BACKOFF_MAX"""
+    ceiling = min(PUSH_BACKOFF_MAX, PUSH_BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return random.uniform(0, ceiling)
+
+
+def enqueue_push(db: Session, record: models.AnesthesiaRecord) -> models.OpenDentalPush:
+    """Queue a record for delivery, reusing a push that has not been claimed yet.
+    A push being sent already carries its payload, so a newer snapshot gets a
+    push of its own."""
+    existing = db.query(models.OpenDentalPush).filter(
+        models.OpenDentalPush.record_id == record.id,
+        models.OpenDentalPush.status == "pending"
+    ).first()
+    note = crud.generate_anesthesia_note(record)
+    payload = open_dental.build_commlog(record, note)
+    if existing:
+        # Latest snapshot wins; the idempotency key stays the same so a
+        # retry of an earlier failed send cannot create a second commlog
+        existing.payload = payload
+        db.commit()
+        db.refresh(existing)
+        return existing
+
+    push = models.OpenDentalPush(
+        record_id=record.id,
+        idempotency_key=str(uuid.uuid4()),
+        payload=payload,
+        status="pending",
+        next_attempt_at=datetime.utcnow()
+    )
+    db.add(push)
+    db.commit()
+    db.refresh(push)
+    return push
+
+
+def get_push(db: Session, push_id: int):
+    return db.query(models.OpenDentalPush).filter(models.OpenDentalPush.id == push_id).first()
+
+
+def claim_batch(db: Session, limit: int = PUSH_BATCH_SIZE) -> List[dict]:
+    """Mark up to `limit` due pushes as sending and return what is needed to send them"""
+    now = datetime.utcnow()
+    pushes = db.query(models.OpenDentalPush).filter(
+        models.OpenDentalPush.status == "pending",
+        models.OpenDentalPush.next_attempt_at <= now
+    ).order_by(models.OpenDentalPush.next_attempt_at).limit(limit).all()
+
+    batch = []
+    for push in pushes:
+        push.status = "sending"
+        push.attempts = (push.attempts or 0) + 1
+        batch.append({
+            "id": push.id,
+            "idempotency_key": push.idempotency_key,
+            "payload": push.payload,
+            "attempts": push.attempts,
+        })
+    db.commit()
+    return batch
+
+
+def mark_sent(db: Session, push_id: int):
+    push = get_push(db, push_id)
+    if push:
+        push.status = "sent"
+        push.sent_at = datetime.utcnow()
+        push.last_error = None
+        db.commit()
+
+
+def mark_failed(db: Session, push_id: int, error: str, retryable: bool, retry_after: Optional[float] = None):
+    push = get_push(db, push_id)
+    if not push:
+        return
+    push.last_error = error
+    if retryable and push.attempts < PUSH_MAX_ATTEMPTS:
+        delay = max(backoff_delay(push.attempts), retry_after or 0)
+        push.status = "pending"
+        push.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    else:
+        push.status = "failed"
+    db.commit()
+
+
+def requeue_interrupted(db: Session):
+    """Pushes left in `sending` by a crashed worker go back to the queue"""
+    db.query(models.OpenDentalPush).filter(
+        models.OpenDentalPush.status == "sending"
+    ).update({"status": "pending"}, synchronize_session=False)
+    db.commit()
+
+
+def _with_session(fn, *args):
+    # The queue updates are writes like any other
+    return coordination.run_write(fn, *args)
+
+
+class PushWorker:
+    """Background sender for queued Open Dental pushes"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._client = None
+        self._loop = None
+
+    def start(self):
+        self._stopping = False
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        """Wake the worker so a fresh push is sent without waiting for the next poll.
+
+        Safe to call from the threadpool that runs sync endpoints.
+        """
+        if self._task and self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        await asyncio.to_thread(_with_session, requeue_interrupted)
+        semaphore = asyncio.Semaphore(PUSH_CONCURRENCY)
+        async with open_dental.create_async_client() as client:
+            self._client = client
+            while not self._stopping:
+                # Cleared before claiming so a notify() during the sends below
+                # is not lost
+                self._wakeup.clear()
+                try:
+                    batch = await asyncio.to_thread(_with_session, claim_batch)
+                except Exception:
+                    logger.exception("Failed to claim Open Dental push batch")
+                    batch = []
+
+                if batch:
+                    await asyncio.gather(*(self._send(item, semaphore) for item in batch))
+                    if len(batch) == PUSH_BATCH_SIZE:
+                        continue
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=PUSH_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _send(self, item: dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                await open_dental.push_commlog(self._client, item["payload"], item["idempotency_key"])
+            except open_dental.OpenDentalError as e:
+                logger.warning("Open Dental push %s failed (attempt %s): %s", item["id"], item["attempts"], e)
+                await asyncio.to_thread(
+                    _with_session, mark_failed, item["id"], str(e), e.retryable, e.retry_after
+                )
+                return
+            except Exception as e:
+                logger.exception("Unexpected error pushing %s to Open Dental", item["id"])
+                await asyncio.to_thread(_with_session, mark_failed, item["id"], repr(e), True)
+                return
+            await asyncio.to_thread(_with_session, mark_sent, item["id"])
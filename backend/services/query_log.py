@@ -0,0 +1,69 @@
+"""Per-request SQL accounting.
+
+QueryLogMiddleware gives each request a QueryStats (models/database.py) and,
+when the request finishes:
+
+- adds the query count to the db_queries_total metric for its route
+- logs statements repeated N_PLUS_ONE_THRESHOLD or more times as a likely
+  N+1 pattern (a lazy load per row)
+- with SQL_DEBUG=1, adds X-Query-Count and X-Query-Time-Ms response headers
+"""
+import logging
+import os
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.database import QueryStats, current_query_stats
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+SQL_DEBUG = os.getenv("SQL_DEBUG", "0") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+query_count = metrics.Counter("db_queries_total", "SQL statements executed by route", ("method", "route"))
+query_time = metrics.Counter("db_query_seconds_total", "Time spent in SQL statements by route", ("method", "route"))
+n_plus_one = metrics.Counter("db_n_plus_one_total", "Requests with a statement repeated past the N+1 threshold",
+                             ("method", "route"))
+
+
+def repeated_statements(stats: QueryStats):
+    return [(statement, count) for statement, count in stats.statements.most_common()
+            if count >= N_PLUS_ONE_THRESHOLD]
+
+
+class QueryLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_wrapper(message):
+            if SQL_DEBUG and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-query-count", str(stats.count).encode()),
+                    (b"x-query-time-ms", f"{stats.total_time * 1000:.1f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_stats.reset(token)
+            labels = (scope["method"], getattr(scope.get("route"), "path", "unmatched"))
+            if stats.count:
+                query_count.inc(labels, stats.count)
+                query_time.inc(labels, stats.total_time)
+            repeated = repeated_statements(stats)
+            if repeated:
+                n_plus_one.inc(labels)
+                for statement, count in repeated:
+                    logger.warning("Possible N+1 in %s %s: %d x %s", labels[0], labels[1], count,
+                                   " ".join(statement.split()))
@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import schemas
+from services import crud, serialization
+from services.cache import TTLCache
+
+# In-process caches for the hot read paths. Writes made through the API
+# invalidate the affected entries; the TTL bounds staleness otherwise.
+# Invalidation does not reach other worker processes, so with several
+# workers records are not cached and reference lists expire quickly.
+_MULTI_WORKER = int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "30" if _MULTI_WORKER else "300"))
+RECORD_CACHE_TTL = float(os.getenv("RECORD_CACHE_TTL", "0" if _MULTI_WORKER else "900"))
+RECORD_CACHE_SIZE = int(os.getenv("RECORD_CACHE_SIZE", "512"))
+
+reference_cache = TTLCache(REFERENCE_CACHE_TTL, maxsize=64)
+record_cache = TTLCache(RECORD_CACHE_TTL, maxsize=RECORD_CACHE_SIZE)
+
+
+def _cached_list(key, loader, schema) -> List[dict]:
+    found, value = reference_cache.get(key)
+    if not found:
+        value = [schema.model_validate(row).model_dump() for row in loader()]
+        reference_cache.set(key, value)
+    return value
+
+
+# Reference data
+def get_medications(db: Session) -> List[dict]:
+    return _cached_list("medications", lambda: crud.get_medications(db), schemas.Medication)
+
+
+def get_locations(db: Session) -> List[dict]:
+    return _cached_list("locations", lambda: crud.get_locations(db), schemas.Location)
+
+
+def get_providers(db: Session, role: Optional[str] = None) -> List[dict]:
+    return _cached_list(("providers", role), lambda: crud.get_providers(db, role), schemas.Provider)
+
+
+def invalidate_reference():
+    reference_cache.clear()
+
+
+def warm_reference(db: Session):
+    invalidate_reference()
+    get_medications(db)
+    get_locations(db)
+    get_providers(db)
+
+
+# Anesthesia records.
+# A reader that loaded a record before a write committed must not store it
+# after the write invalidated the entry. Readers take snapshot() before they
+# load, and put_record() refuses rows loaded before the record's last
+# invalidation. Only the latest invalidations are remembered; _forgotten_at
+# is the newest one dropped, and rows loaded before it are not cached.
+_INVALIDATION_HISTORY = max(RECORD_CACHE_SIZE, 1024)
+_invalidations = 0
+_invalidated_at: "OrderedDict[int, int]" = OrderedDict()
+_forgotten_at = 0
+_invalidation_lock = threading.Lock()
+
+
+def snapshot() -> int:
+    return _invalidations
+
+
+def put_record(record, loaded_at: int) -> dict:
+    data = serialization.serialize_record(record)
+    with _invalidation_lock:
+        if _invalidated_at.get(record.id, _forgotten_at) <= loaded_at:
+            record_cache.set(record.id, data)
+    return data
+
+
+def get_record(db: Session, record_id: int) -> Optional[dict]:
+    found, data = record_cache.get(record_id)
+    if found:
+        return data
+    loaded_at = snapshot()
+    record = crud.get_anesthesia_record(db, record_id)
+    if not record:
+        return None
+    return put_record(record, loaded_at)
+
+
+def get_record_sparse(db: Session, record_id: int, sparse) -> Optional[dict]:
+    """Project a cached record, or load just the requested parts from the database"""
+    found, data = record_cache.get(record_id)
+    if found:
+        return serialization.project_record(data, sparse)
+    record = crud.get_anesthesia_record_partial(db, record_id, sparse.columns, sparse.relationships)
+    if not record:
+        return None
+    return serialization.serialize_record_sparse(record, sparse)
+
+
+def get_vitals(db: Session, record_id: int, since: Optional[int] = None) -> Optional[List[dict]]:
+    """Vital signs of a record, from the cached record when there is one.
+    With since, only those with a greater id."""
+    found, data = record_cache.get(record_id)
+    if found:
+        vitals = data["vital_signs"]
+        return vitals if since is None else [v for v in vitals if v["id"] > since]
+    if not crud.get_anesthesia_record_partial(db, record_id, ("id",), ()):
+        return None
+    return [serialization.to_dict(v, schemas.VitalSign) for v in crud.get_vital_signs(db, record_id, since)]
+
+
+def invalidate_record(record_id: int):
+    """Call after the write committed"""
+    global _invalidations, _forgotten_at
+    with _invalidation_lock:
+        _invalidations += 1
+        _invalidated_at[record_id] = _invalidations
+        _invalidated_at.move_to_end(record_id)
+        while len(_invalidated_at) > _INVALIDATION_HISTORY:
+            _forgotten_at = _invalidated_at.popitem(last=False)[1]
+        record_cache.invalidate(record_id)
+
+
+def _draft_key(open_dental_id: str, location_id: Optional[int], day: date):
+    return ("draft", open_dental_id, location_id, day)
+
+
+def get_draft_record(db: Session, open_dental_id: str, location_id: Optional[int], day: date) -> Optional[dict]:
+    """Draft shell prefetched for a patient's appointment on `day`"""
+    key = _draft_key(open_dental_id, location_id, day)
+    found, record_id = record_cache.get(key)
+    if found:
+        record = get_record(db, record_id)
+        if record is not None and record["anesthesia_start"] is None:
+            return record
+        # The case has started: the record is no longer a draft
+        record_cache.invalidate(key)
+    record_id = crud.get_draft_record_id(db, open_dental_id, location_id, day)
+    if record_id is None:
+        return None
+    return get_record(db, record_id)
+
+
+def warm_drafts(db: Session, day: date) -> int:
+    """Load every draft scheduled on `day` into the record cache"""
+    loaded_at = snapshot()
+    records = crud.get_draft_records(db, day)
+    for record in records:
+        put_record(record, loaded_at)
+        open_dental_id = record.patient.open_dental_id if record.patient else None
+        record_cache.set(_draft_key(open_dental_id, record.location_id, day), record.id)
+        record_cache.set(_draft_key(open_dental_id, None, day), record.id)
+    return len(records)
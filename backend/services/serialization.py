@@ -0,0 +1,169 @@
+"""Fast serialization of ORM objects for the large record responses.
+
+The default FastAPI path validates the whole ORM graph through the
+response_model, builds a model instance per vital sign, then walks it again
+in jsonable_encoder. Rows loaded from our own database are already well
+formed, so the trusted path reads the attributes named by the schema
+straight into dicts and hands them to orjson.
+
+FAST_SERIALIZATION=0 switches back to validating through cached
+TypeAdapters, e.g. while checking the two paths agree.
+"""
+import os
+import typing
+from functools import lru_cache
+from inspect import isclass
+from typing import Any, FrozenSet, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import schemas
+
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "1") == "1"
+
+
+@lru_cache(maxsize=None)
+def adapter_for(tp) -> TypeAdapter:
+    """TypeAdapters are expensive to build; build each one once"""
+    return TypeAdapter(tp)
+
+
+def _nested_schema(annotation) -> Tuple[str, Type[BaseModel]]:
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        for arg in typing.get_args(annotation):
+            if arg is not type(None):
+                return _nested_schema(arg)
+    if origin in (list, List):
+        kind, schema = _nested_schema(typing.get_args(annotation)[0])
+        return ("many", schema) if schema else (None, None)
+    if isclass(annotation) and issubclass(annotation, BaseModel):
+        return "one", annotation
+    return None, None
+
+
+@lru_cache(maxsize=None)
+def _plan(schema: Type[BaseModel]) -> tuple:
+    plan = []
+    for name, field in schema.model_fields.items():
+        kind, nested = _nested_schema(field.annotation)
+        plan.append((name, kind, nested))
+    return tuple(plan)
+
+
+def to_dict(obj: Any, schema: Type[BaseModel], exclude: frozenset = frozenset()) -> dict:
+    """Copy the attributes `schema` declares from a trusted ORM object, without validation"""
+    data = {}
+    for name, kind, nested in _plan(schema):
+        if name in exclude:
+            continue
+        value = getattr(obj, name)
+        if kind == "many":
+            value = [to_dict(item, nested) for item in value]
+        elif kind == "one" and value is not None:
+            value = to_dict(value, nested)
+        data[name] = value
+    return data
+
+
+def serialize(obj: Any, schema: Type[BaseModel]) -> dict:
+    if FAST_SERIALIZATION:
+        return to_dict(obj, schema)
+    adapter = adapter_for(schema)
+    return adapter.dump_python(adapter.validate_python(obj, from_attributes=True))
+
+
+def serialize_record(record) -> dict:
+    return serialize(record, schemas.AnesthesiaRecord)
+
+
+# Sparse fieldsets for record responses.
+# `include` names the relationships to embed; `fields` the scalar columns.
+RECORD_INCLUDES = {
+    "patient": "patient",
+    "vitals": "vital_signs",
+    "administrations": "medication_administrations",
+    "administrations.medication": "medication_administrations.medication",
+}
+RECORD_FIELDS = tuple(name for name, kind, _ in _plan(schemas.AnesthesiaRecord) if kind is None)
+
+
+class SparseRecordRequest:
+    """Parsed `fields=` / `include=` query parameters"""
+
+    def __init__(self, fields: Optional[Tuple[str, ...]], include: FrozenSet[str]):
+        self.fields = fields
+        self.include = include
+
+    @property
+    def relationships(self) -> FrozenSet[str]:
+        return frozenset(RECORD_INCLUDES[name] for name in self.include)
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return self.fields if self.fields is not None else RECORD_FIELDS
+
+
+def parse_sparse(fields: Optional[str], include: Optional[str]) -> Optional[SparseRecordRequest]:
+    """None means the full record. Raises ValueError naming unknown entries.
+
+    With only `include`, every column is returned plus the listed
+    relationships; with only `fields`, no relationships are embedded.
+    """
+    if fields is None and include is None:
+        return None
+    field_list = None
+    if fields is not None:
+        field_list = tuple(dict.fromkeys(["id"] + [f.strip() for f in fields.split(",") if f.strip()]))
+        unknown = [f for f in field_list if f not in RECORD_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    include_set = frozenset(i.strip() for i in (include or "").split(",") if i.strip())
+    unknown = sorted(include_set - RECORD_INCLUDES.keys())
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(unknown)}")
+    if "administrations.medication" in include_set:
+        include_set |= {"administrations"}
+    return SparseRecordRequest(field_list, include_set)
+
+
+def serialize_record_sparse(record, sparse: SparseRecordRequest) -> dict:
+    """Serialize only what was asked for, so unrequested relationships are never loaded"""
+    data = {name: getattr(record, name) for name in sparse.columns}
+    if "patient" in sparse.include:
+        data["patient"] = to_dict(record.patient, schemas.Patient) if record.patient else None
+    if "vitals" in sparse.include:
+        data["vital_signs"] = [to_dict(v, schemas.VitalSign) for v in record.vital_signs]
+    if "administrations" in sparse.include:
+        exclude = frozenset() if "administrations.medication" in sparse.include else frozenset({"medication"})
+        data["medication_administrations"] = [
+            to_dict(a, schemas.MedicationAdministration, exclude) for a in record.medication_administrations
+        ]
+    return data
+
+
+def project_record(data: dict, sparse: SparseRecordRequest) -> dict:
+    """Cut a fully serialized record down to a sparse request"""
+    projected = {name: data[name] for name in sparse.columns}
+    if "patient" in sparse.include:
+        projected["patient"] = data["patient"]
+    if "vitals" in sparse.include:
+        projected["vital_signs"] = data["vital_signs"]
+    if "administrations" in sparse.include:
+        administrations = data["medication_administrations"]
+        if "administrations.medication" not in sparse.include:
+            administrations = [{k: v for k, v in a.items() if k != "medication"} for a in administrations]
+        projected["medication_administrations"] = administrations
+    return projected
+
+
+# Columnar vitals: one array per channel instead of one object per sample.
+# record_id is dropped, the arrays all belong to the requested record.
+VITAL_COLUMNS = tuple(name for name in schemas.VitalSign.model_fields if name != "record_id")
+
+
+def columnar_vitals(vitals: List[dict]) -> dict:
+    return {name: [vital[name] for vital in vitals] for name in VITAL_COLUMNS}
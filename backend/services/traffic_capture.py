@@ -0,0 +1,176 @@
+"""Opt-in capture of real API traffic for replay (benchmarks/replay.py).
+
+With TRAFFIC_CAPTURE=/path/to/traffic.jsonl every API request is appended as
+one JSON line. A line holds the time, method, route template, path
+parameters, query, Accept/Content-Type, status, duration, response size, and
+for POSTs the id the response created.
+
+PHI never reaches the log. Bodies, free-text path parameters, and query
+values are reduced to their shape: a type, or the length for strings. Only
+integer ids (keys ending in _id, and int path parameters) and the values of
+SAFE_QUERY_PARAMS are kept verbatim, so that replay can chain a created
+record into the requests that use it.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "")
+# Never captured: admin tooling and the scrape endpoint
+SKIP_PREFIXES = ("/api/admin", "/metrics", "/docs", "/openapi.json")
+# Event streams stay open for minutes; a replay could only hold them open too
+SKIP_SUFFIXES = ("/events",)
+# Query parameters whose values carry no patient data
+SAFE_QUERY_PARAMS = {"fields", "include", "role", "enabled", "since", "limit", "day"}
+# Largest request body parsed for its shape; larger bodies are recorded as "large"
+MAX_BODY_BYTES = 256 * 1024
+
+_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def is_id_key(key: str) -> bool:
+    return key == "id" or key.endswith("_id")
+
+
+def shape(value, key: str = ""):
+    """Type-only stand-in for value; integer ids are kept for replay"""
+    if isinstance(value, dict):
+        return {k: shape(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [shape(v) for v in value]
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return value if is_id_key(key) else "int"
+    if isinstance(value, float):
+        return "float"
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        if _DATETIME.match(value):
+            return "datetime"
+        if _DATE.match(value):
+            return "date"
+        return f"str:{len(value)}"
+    return type(value).__name__
+
+
+def scrub_path_params(route, params: dict) -> dict:
+    """Keeps parameters the route declares as int (our own ids); string ones
+    such as an Open Dental patient number are reduced to their shape"""
+    dependant = getattr(route, "dependant", None)
+    int_params = {f.name for f in dependant.path_params if f.field_info.annotation is int} if dependant else set()
+    return {k: int(v) if k in int_params and str(v).isdigit() else shape(v) for k, v in params.items()}
+
+
+def scrub_query(query_string: bytes) -> dict:
+    return {k: v if k in SAFE_QUERY_PARAMS else shape(v)
+            for k, v in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)}
+
+
+class CaptureLog:
+    """Appends one line per write; O_APPEND keeps lines whole across workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, entry: dict):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", buffering=1)
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class CaptureMiddleware:
+    """Plain ASGI; request and response messages pass through unchanged"""
+
+    def __init__(self, app, log: CaptureLog = None):
+        self.app = app
+        self.log = log or CaptureLog(TRAFFIC_CAPTURE)
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith(SKIP_PREFIXES)
+                or scope["path"].endswith(SKIP_SUFFIXES)):
+            return await self.app(scope, receive, send)
+
+        body = bytearray()
+        response_body = bytearray()
+        status = 500
+        response_bytes = 0
+        keep_response = scope["method"] == "POST"
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= MAX_BODY_BYTES:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response_bytes += len(chunk)
+                if keep_response and len(response_body) <= MAX_BODY_BYTES:
+                    response_body.extend(chunk)
+            await send(message)
+
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            try:
+                self.log.write(self.entry(scope, started, duration, status, response_bytes, body, response_body))
+            except Exception as e:
+                logger.warning("Traffic capture failed for %s %s: %s", scope["method"], scope["path"], e)
+
+    def entry(self, scope, started, duration, status, response_bytes, body, response_body) -> dict:
+        headers = dict(scope["headers"])
+        route = scope.get("route")
+        entry = {
+            "at": round(started, 4),
+            "method": scope["method"],
+            # Unmatched paths share one label; the raw path may hold anything
+            "route": getattr(route, "path", "unmatched"),
+            "path_params": scrub_path_params(route, scope.get("path_params", {})),
+            "query": scrub_query(scope.get("query_string", b"")),
+            "headers": {name: headers[key].decode("latin-1")
+                        for name, key in (("accept", b"accept"), ("content-type", b"content-type"))
+                        if key in headers},
+            "body": None,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            "response_bytes": response_bytes,
+        }
+        if body:
+            try:
+                entry["body"] = shape(json.loads(body)) if len(body) <= MAX_BODY_BYTES else "large"
+            except ValueError:
+                entry["body"] = f"bytes:{len(body)}"
+        if response_body and status < 400:
+            try:
+                created = json.loads(response_body)
+                if isinstance(created, dict) and isinstance(created.get("id"), int):
+                    entry["response_id"] = created["id"]
+            except ValueError:
+                pass
+        return entry
@@ -0,0 +1,11 @@
+#!/bin/sh
+set -e
+
+# Schema migration runs once, before any worker starts
+python -m models.migrations
+
+if [ "$APP_ENV" = "production" ]; then
+    exec gunicorn -c gunicorn.conf.py api.main:app
+else
+    exec uvicorn api.main:app --host 0.0.0.0 --port 8000 --reload
+fi
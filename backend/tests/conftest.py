@@ -0,0 +1,66 @@
+"""Shared fixtures. The app runs in-process against a temporary SQLite file.
+
+    cd backend && python -m pytest -q
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_DIR = tempfile.mkdtemp(prefix="anesthesia-tests-")
+DB_PATH = os.path.join(DB_DIR, "test.db")
+
+# Read at import time by models.database and the services, so set before the app is imported
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{DB_PATH}",
+    "AUTO_MIGRATE": "1",
+    "RECORD_CACHE_TTL": "0",
+    "OPEN_DENTAL_URL": "",
+    "GROUP_COMMIT": "0",
+    "METRICS_ENABLED": "0",
+})
+sys.path.insert(0, BACKEND_DIR)
+
+_unique = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from api.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def location(client) -> dict:
+    response = client.post("/api/locations/", json={"name": f"Operatory {next(_unique)}"})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.fixture
+def record(client, location) -> dict:
+    patient = client.post("/api/patients/", json={
+        "open_dental_id": f"test-{next(_unique)}", "first_name": "Test", "last_name": "Patient",
+        "date_of_birth": "1980-01-01T00:00:00",
+    }).json()
+    response = client.post("/api/records/", json={"patient_id": patient["id"], "location_id": location["id"]})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.fixture
+def inventory(client, location) -> dict:
+    """10 mL of medication 1 (a default medication) at the record's location"""
+    response = client.post("/api/inventory/", json={
+        "medication_id": 1, "location_id": location["id"], "quantity": 10, "lot_number": "L1",
+        "expiration_date": "2030-01-01T00:00:00", "supplier": "Test", "invoice_number": "I1",
+        "date_received": "2026-01-01T00:00:00",
+    })
+    assert response.status_code == 200
+    return response.json()
@@ -0,0 +1,60 @@
+"""Regression tests for on-demand profiling: the toggle reaches every worker,
+group-commit work is part of the request's profile, and PROFILE_DIR is
+capped."""
+import os
+import pstats
+
+import pytest
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    from services import admin, profiling
+
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", ADMIN["X-Admin-Token"])
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "_TOGGLE_PATH", str(tmp_path / ".request-profiling.json"))
+    monkeypatch.setattr(profiling, "profile_all", {"enabled": False, "route": None})
+    monkeypatch.setattr(profiling, "_toggle", {"mtime": None, "next_check": 0.0})
+    return profiling
+
+
+def test_toggle_set_by_another_worker_applies_here(client, record, profiling, monkeypatch):
+    url = f"/api/records/{record['id']}"
+    response = client.post("/api/admin/profiling/requests", params={"enabled": True, "route": url}, headers=ADMIN)
+    assert response.json() == {"enabled": True, "route": url}
+    # This process has not seen the switch yet, as in a worker that did not serve it
+    monkeypatch.setattr(profiling, "profile_all", {"enabled": False, "route": None})
+    monkeypatch.setattr(profiling, "_toggle", {"mtime": None, "next_check": 0.0})
+    assert "x-profile-file" in client.get(url).headers
+    assert "x-profile-file" not in client.get("/api/locations/").headers
+
+    profiling.set_request_profiling(False)
+    monkeypatch.setattr(profiling, "profile_all", {"enabled": True, "route": None})
+    profiling._toggle["next_check"] = 0.0
+    assert "x-profile-file" not in client.get(url).headers
+
+
+def test_profile_includes_the_group_commit_writer(client, record, profiling, monkeypatch):
+    from services import group_commit
+
+    committer = group_commit.GroupCommitter()
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(group_commit, "committer", committer)
+    try:
+        response = client.post(f"/api/records/{record['id']}/vitals/", json={"heart_rate": 70},
+                               headers={"X-Profile": "1", **ADMIN})
+    finally:
+        committer.stop()
+    assert response.status_code == 200
+    stats = pstats.Stats(os.path.join(profiling.PROFILE_DIR, response.headers["x-profile-file"]))
+    assert any(function == "add_vital_sign" and path.endswith("crud.py") for path, _, function in stats.stats)
+
+
+def test_profile_dir_keeps_the_newest_files(client, profiling, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 2)
+    names = [client.get("/api/locations/", headers={"X-Profile": "1", **ADMIN}).headers["x-profile-file"]
+             for _ in range(4)]
+    assert profiling.list_profiles() == sorted(names[-2:], reverse=True)
@@ -0,0 +1,113 @@
+"""Regression tests for the Open Dental push queue: coalescing of queued
+snapshots, retry backoff and recovery of sends interrupted by a crash."""
+from datetime import datetime
+
+
+def enqueue(record_id: int) -> dict:
+    from services import coordination, crud, push_queue
+
+    def _enqueue(db):
+        push = push_queue.enqueue_push(db, crud.get_anesthesia_record(db, record_id))
+        return {"id": push.id, "idempotency_key": push.idempotency_key, "payload": push.payload}
+    return coordination.run_write(_enqueue)
+
+
+def claim(push_id: int) -> dict:
+    from services import coordination, push_queue
+
+    batch = coordination.run_write(push_queue.claim_batch, 1000)
+    return next(item for item in batch if item["id"] == push_id)
+
+
+def fetch(push_id: int):
+    from services import coordination, push_queue
+
+    def _fetch(db):
+        push = push_queue.get_push(db, push_id)
+        db.expunge(push)
+        return push
+    return coordination.run_write(_fetch)
+
+
+def edit_notes(client, record_id: int, notes: str):
+    response = client.patch(f"/api/records/{record_id}/fields",
+                            json={"changes": {"notes": {"value": notes, "base": None}}, "station": "test"})
+    assert response.status_code == 200 and response.json()["applied"]
+
+
+def test_pending_push_takes_the_latest_snapshot(client, record):
+    first = enqueue(record["id"])
+    edit_notes(client, record["id"], "second snapshot")
+    second = enqueue(record["id"])
+    assert second["id"] == first["id"]
+    assert second["idempotency_key"] == first["idempotency_key"]
+    assert second["payload"] != first["payload"]
+
+
+def test_snapshot_taken_during_a_send_gets_a_push_of_its_own(client, record):
+    first = enqueue(record["id"])
+    claimed = claim(first["id"])
+    edit_notes(client, record["id"], "edited during the send")
+    second = enqueue(record["id"])
+    assert second["id"] != first["id"]
+    assert second["idempotency_key"] != first["idempotency_key"]
+    # The in-flight send keeps the payload it was claimed with
+    assert fetch(first["id"]).payload == claimed["payload"]
+    assert fetch(second["id"]).status == "pending"
+
+
+def test_retryable_failure_backs_off(record, monkeypatch):
+    from services import coordination, push_queue
+
+    monkeypatch.setattr(push_queue, "backoff_delay", lambda attempts: 120.0)
+    push = enqueue(record["id"])
+    claim(push["id"])
+    before = datetime.utcnow()
+    coordination.run_write(push_queue.mark_failed, push["id"], "timeout", True)
+    failed = fetch(push["id"])
+    assert failed.status == "pending"
+    assert failed.last_error == "timeout"
+    assert (failed.next_attempt_at - before).total_seconds() >= 120
+
+
+
+def test_retry_after_is_honoured_when_longer_than_the_backoff(record, monkeypatch):
+    from services import coordination, push_queue
+
+    monkeypatch.setattr(push_queue, "backoff_delay", lambda attempts: 1.0)
+    push = enqueue(record["id"])
+    claim(push["id"])
+    before = datetime.utcnow()
+    coordination.run_write(push_queue.mark_failed, push["id"], "429", True, 30)
+    assert (fetch(push["id"]).next_attempt_at - before).total_seconds() >= 30
+
+
+def test_push_fails_after_max_attempts_or_a_permanent_error(record, monkeypatch):
+    from services import coordination, push_queue
+
+    monkeypatch.setattr(push_queue, "PUSH_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(push_queue, "backoff_delay", lambda attempts: 0.0)
+    push = enqueue(record["id"])
+    claim(push["id"])
+    coordination.run_write(push_queue.mark_failed, push["id"], "timeout", True)
+    assert fetch(push["id"]).status == "pending"
+    assert claim(push["id"])["attempts"] == 2
+    coordination.run_write(push_queue.mark_failed, push["id"], "timeout", True)
+    assert fetch(push["id"]).status == "failed"
+
+    other = enqueue(record["id"])
+    claim(other["id"])
+    coordination.run_write(push_queue.mark_failed, other["id"], "400", False)
+    assert fetch(other["id"]).status == "failed"
+
+
+def test_sends_interrupted_by_a_crash_are_requeued(record):
+    from services import coordination, push_queue
+
+    push = enqueue(record["id"])
+    claim(push["id"])
+    assert fetch(push["id"]).status == "sending"
+    coordination.run_write(push_queue.requeue_interrupted)
+    requeued = fetch(push["id"])
+    assert requeued.status == "pending"
+    assert requeued.attempts == 1
@@ -0,0 +1,115 @@
+"""Regression tests for the read caches and the schedule prefetch that warms
+them: stale rows must not be cached after an invalidation, the vitals
+cursor is the same with and without a cached record, and appointments
+without a location are skipped."""
+import sqlite3
+from collections import OrderedDict
+from datetime import date
+
+import pytest
+
+from conftest import DB_PATH
+
+
+@pytest.fixture
+def record_cache(monkeypatch):
+    """A record cache with a TTL; the tests run with RECORD_CACHE_TTL=0"""
+    from services import read_cache
+    from services.cache import TTLCache
+
+    cache = TTLCache(60, maxsize=64)
+    monkeypatch.setattr(read_cache, "record_cache", cache)
+    return cache
+
+
+def load_record(record_id: int):
+    from models import SessionLocal
+    from services import crud
+
+    db = SessionLocal()
+    try:
+        return crud.get_anesthesia_record(db, record_id)
+    finally:
+        db.close()
+
+
+# Records
+def test_row_loaded_before_an_invalidation_is_not_cached(record, record_cache):
+    from services import read_cache
+
+    loaded_at = read_cache.snapshot()
+    stale = load_record(record["id"])
+    # A write commits and invalidates while the reader serializes its row
+    read_cache.invalidate_record(record["id"])
+    read_cache.put_record(stale, loaded_at)
+    assert record_cache.get(record["id"]) == (False, None)
+
+    read_cache.put_record(load_record(record["id"]), read_cache.snapshot())
+    assert record_cache.get(record["id"])[0]
+
+
+def test_invalidation_history_is_bounded(record, record_cache, monkeypatch):
+    from services import read_cache
+
+    monkeypatch.setattr(read_cache, "_INVALIDATION_HISTORY", 2)
+    monkeypatch.setattr(read_cache, "_invalidated_at", OrderedDict())
+    loaded_at = read_cache.snapshot()
+    row = load_record(record["id"])
+    for other_id in range(10**6, 10**6 + 5):
+        read_cache.invalidate_record(other_id)
+    assert len(read_cache._invalidated_at) == 2
+    # Whether this record was invalidated after loaded_at has been forgotten
+    read_cache.put_record(row, loaded_at)
+    assert record_cache.get(record["id"]) == (False, None)
+
+    read_cache.put_record(row, read_cache.snapshot())
+    assert record_cache.get(record["id"])[0]
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["uncached", "cached"])
+def test_vitals_since_cursor(client, record, record_cache, cached):
+    from services import read_cache
+
+    url = f"/api/records/{record['id']}/vitals/"
+    empty = client.get(url)
+    assert empty.json() == [] and empty.headers["X-Vitals-Cursor"] == "0"
+    ids = [client.post(url, json={"heart_rate": 60 + i}).json()["id"] for i in range(3)]
+    if cached:
+        client.get(f"/api/records/{record['id']}")
+    else:
+        read_cache.invalidate_record(record["id"])
+    assert record_cache.get(record["id"])[0] == cached
+
+    full = client.get(url)
+    assert [v["id"] for v in full.json()] == ids and full.headers["X-Vitals-Cursor"] == str(ids[-1])
+    newer = client.get(url, params={"since": ids[0]})
+    assert [v["id"] for v in newer.json()] == ids[1:] and newer.headers["X-Vitals-Cursor"] == str(ids[-1])
+    # Nothing new arrived: the cursor stays where the client is
+    caught_up = client.get(url, params={"since": ids[-1]})
+    assert caught_up.json() == [] and caught_up.headers["X-Vitals-Cursor"] == str(ids[-1])
+    assert record_cache.get(record["id"])[0] == cached
+
+
+# Prefetch
+def test_prefetch_skips_appointments_of_unmapped_clinics(client, monkeypatch):
+    from services import open_dental, prefetch
+
+    location = client.post("/api/locations/", json={"name": "Prefetch operatory",
+                                                    "open_dental_clinic_num": "7"}).json()
+    appointments = [
+        {"AptNum": 9001, "PatNum": 9101, "ClinicNum": 7, "AptDateTime": "2030-01-02 09:00:00"},
+        {"AptNum": 9002, "PatNum": 9102, "ClinicNum": 8, "AptDateTime": "2030-01-02 10:00:00"},
+    ]
+    monkeypatch.setattr(open_dental, "fetch_schedule", lambda day: appointments)
+    # No default location to fall back on
+    monkeypatch.setattr(prefetch, "PREFETCH_DEFAULT_LOCATION_ID", 10**6)
+
+    response = client.post("/api/open-dental/prefetch", params={"day": date(2030, 1, 2).isoformat()})
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["appointments"] == 2 and summary["patients"] == 2
+    assert summary["drafts_created"] == 1 and summary["appointments_skipped"] == 1
+    with sqlite3.connect(DB_PATH) as other:
+        drafts = other.execute("SELECT open_dental_appt_id, location_id FROM anesthesia_records "
+                               "WHERE open_dental_appt_id IN ('9001', '9002')").fetchall()
+    assert drafts == [("9001", location["id"])]
@@ -0,0 +1,57 @@
+"""The trusted serialization path (serialization.to_dict) must produce the
+same JSON as validating through the response schema."""
+import orjson
+import pytest
+
+
+@pytest.fixture
+def populated_record(client, record, inventory) -> dict:
+    url = f"/api/records/{record['id']}"
+    assert client.put(url, json={
+        "asa_class": "II", "monitors": ["BP", "SpO2"], "o2_flow_rate": 4.5, "anesthesia_start": "2026-01-01T08:00:00",
+        "local_anesthetics": {"lidocaine": 2}, "escort_present": True, "version": record["version"],
+    }).status_code == 200
+    for path, body in [
+        (f"{url}/vitals/", {"bp_systolic": 120, "bp_diastolic": 80, "heart_rate": 70, "spo2": 98}),
+        (f"{url}/medications/", {"medication_id": inventory["medication_id"], "dose_ml": 1.5}),
+        ("/api/providers/", {"name": "Dr. Serialization", "role": "surgeon"}),
+    ]:
+        assert client.post(path, json=body).status_code == 200
+    return record
+
+
+def served_objects(record_id: int):
+    """(schema, ORM object) for every schema the endpoints serve through to_dict"""
+    from models import SessionLocal, models
+    from schemas import schemas
+    from services import coordination, crud, push_queue
+
+    db = SessionLocal()
+    record = crud.get_anesthesia_record(db, record_id)
+    push = coordination.run_write(lambda write_db: push_queue.enqueue_push(
+        write_db, crud.get_anesthesia_record(write_db, record_id)).id)
+    objects = [
+        (schemas.AnesthesiaRecord, record),
+        (schemas.Patient, record.patient),
+        (schemas.VitalSign, record.vital_signs[0]),
+        (schemas.MedicationAdministration, record.medication_administrations[0]),
+        (schemas.Medication, db.query(models.Medication).first()),
+        (schemas.MedicationInventory, db.query(models.MedicationInventory).first()),
+        (schemas.Location, db.query(models.Location).first()),
+        (schemas.Provider, db.query(models.Provider).first()),
+        (schemas.OpenDentalPush, push_queue.get_push(db, push)),
+    ]
+    return db, objects
+
+
+def test_to_dict_matches_schema_validation(populated_record):
+    from services import serialization
+
+    db, objects = served_objects(populated_record["id"])
+    try:
+        for schema, obj in objects:
+            assert obj is not None, schema.__name__
+            fast = orjson.loads(orjson.dumps(serialization.to_dict(obj, schema)))
+            assert fast == schema.model_validate(obj).model_dump(mode="json"), schema.__name__
+    finally:
+        db.close()
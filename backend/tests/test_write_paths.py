@@ -0,0 +1,323 @@
+"""Regression tests for the concurrent write paths: field-level edits,
+version checks, idempotent retries, group commit and the write lock; plus
+the query budgets of tools/check_queries.py."""
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+from sqlalchemy import event
+
+from conftest import BACKEND_DIR, DB_PATH
+
+
+def inventory_quantity(client, location_id: int) -> float:
+    return client.get(f"/api/inventory/location/{location_id}").json()[0]["quantity"]
+
+
+# Field-level edits (PATCH /api/records/{id}/fields)
+def patch_fields(client, record_id, changes, station="test"):
+    response = client.patch(f"/api/records/{record_id}/fields", json={"changes": changes, "station": station})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_field_edit_applies_and_bumps_versions(client, record):
+    result = patch_fields(client, record["id"], {"notes": {"value": "first", "base": None}})
+    assert result["applied"] == {"notes": record["version"] + 1}
+    assert result["conflicts"] == {} and result["rejected"] == {}
+    assert client.get(f"/api/records/{record['id']}").json()["notes"] == "first"
+
+
+def test_stale_field_edit_conflicts_and_keeps_the_newer_value(client, record):
+    first = patch_fields(client, record["id"], {"notes": {"value": "station a", "base": None}}, "a")
+    base = first["applied"]["notes"]
+    patch_fields(client, record["id"], {"notes": {"value": "station b", "base": base}}, "b")
+
+    # Station a still edits from its own version of the field
+    result = patch_fields(client, record["id"], {"notes": {"value": "station a again", "base": base}}, "a")
+    assert result["applied"] == {}
+    assert result["conflicts"]["notes"]["value"] == "station b"
+    assert client.get(f"/api/records/{record['id']}").json()["notes"] == "station b"
+
+
+def test_edits_to_different_fields_do_not_conflict(client, record):
+    base = record["version"]
+    patch_fields(client, record["id"], {"notes": {"value": "notes", "base": base}}, "a")
+    result = patch_fields(client, record["id"], {"asa_class": {"value": "II", "base": base}}, "b")
+    assert "asa_class" in result["applied"] and result["conflicts"] == {}
+
+
+def test_unknown_and_invalid_fields_are_rejected(client, record):
+    result = patch_fields(client, record["id"], {"patient_id": {"value": 99, "base": None},
+                                                 "height_cm": {"value": "tall", "base": None}})
+    assert set(result["rejected"]) == {"patient_id", "height_cm"}
+    assert result["applied"] == {}
+
+
+def test_field_edit_of_a_missing_record_is_404(client):
+    response = client.patch("/api/records/999999/fields", json={"changes": {"notes": {"value": "x", "base": None}}})
+    assert response.status_code == 404
+
+
+# Version checks
+def test_put_with_the_current_version_applies(client, record):
+    response = client.put(f"/api/records/{record['id']}", json={"notes": "checked", "version": record["version"]})
+    assert response.status_code == 200
+    assert response.json()["version"] == record["version"] + 1
+
+
+def test_put_with_a_stale_version_is_409_with_the_current_record(client, record):
+    client.put(f"/api/records/{record['id']}", json={"notes": "newer", "version": record["version"]})
+    response = client.put(f"/api/records/{record['id']}", json={"notes": "stale", "version": record["version"]})
+    assert response.status_code == 409
+    current = response.json()["detail"]["record"]
+    assert current["notes"] == "newer" and current["version"] == record["version"] + 1
+
+
+def test_put_without_a_version_is_422_and_changes_nothing(client, record):
+    response = client.put(f"/api/records/{record['id']}", json={"notes": "blind overwrite"})
+    assert response.status_code == 422
+    current = client.get(f"/api/records/{record['id']}").json()
+    assert current["notes"] == record["notes"] and current["version"] == record["version"]
+
+
+def test_put_of_a_missing_record_is_404(client):
+    assert client.put("/api/records/999999", json={"notes": "x", "version": 1}).status_code == 404
+
+
+def test_inventory_decrement_retries_when_the_row_moved(client, record, inventory):
+    from models import engine
+
+    # Another writer takes 1 mL between the decrement's read and its UPDATE
+    attempts = []
+
+    def interleave(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE medication_inventory"):
+            attempts.append(statement)
+            if len(attempts) == 1:
+                with sqlite3.connect(DB_PATH) as other:
+                    other.execute("UPDATE medication_inventory SET quantity = quantity - 1, version = version + 1 "
+                                  "WHERE id = ?", (inventory["id"],))
+
+    event.listen(engine, "before_cursor_execute", interleave)
+    try:
+        response = client.post(f"/api/records/{record['id']}/medications/", json={"medication_id": 1, "dose_ml": 2})
+    finally:
+        event.remove(engine, "before_cursor_execute", interleave)
+    assert response.status_code == 200
+    # The first UPDATE matched the old version only; the retry saw the other write
+    assert len(attempts) == 2
+    assert inventory_quantity(client, inventory["location_id"]) == 7
+
+
+# Idempotent retries (Idempotency-Key)
+def test_retried_dose_is_recorded_and_taken_from_inventory_once(client, record, inventory):
+    url = f"/api/records/{record['id']}/medications/"
+    body = {"medication_id": 1, "dose_ml": 2}
+    first = client.post(url, json=body, headers={"Idempotency-Key": "dose-retry"})
+    retry = client.post(url, json=body, headers={"Idempotency-Key": "dose-retry"})
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert inventory_quantity(client, inventory["location_id"]) == 8
+    assert len(client.get(f"/api/records/{record['id']}").json()["medication_administrations"]) == 1
+
+
+def test_retried_record_create_returns_the_same_record(client, record):
+    body = {"patient_id": record["patient_id"], "location_id": record["location_id"]}
+    first = client.post("/api/records/", json=body, headers={"Idempotency-Key": "record-retry"})
+    retry = client.post("/api/records/", json=body, headers={"Idempotency-Key": "record-retry"})
+    assert retry.json()["id"] == first.json()["id"]
+
+
+def test_key_reused_for_a_different_request_is_422(client, record):
+    url = f"/api/records/{record['id']}/vitals/"
+    assert client.post(url, json={"heart_rate": 70}, headers={"Idempotency-Key": "reused"}).status_code == 200
+    assert client.post(url, json={"heart_rate": 71}, headers={"Idempotency-Key": "reused"}).status_code == 422
+    other_path = client.post(f"/api/records/{record['id']}/medications/", json={"medication_id": 1, "dose_ml": 1},
+                             headers={"Idempotency-Key": "reused"})
+    assert other_path.status_code == 422
+    assert len(client.get(url).json()) == 1
+
+
+def test_key_of_a_deleted_row_processes_the_request_again(client, record):
+    from models import SessionLocal, models
+
+    url = f"/api/records/{record['id']}/vitals/"
+    first = client.post(url, json={"heart_rate": 70}, headers={"Idempotency-Key": "deleted"}).json()
+    db = SessionLocal()
+    try:
+        db.delete(db.get(models.VitalSign, first["id"]))
+        db.commit()
+    finally:
+        db.close()
+    retry = client.post(url, json={"heart_rate": 70}, headers={"Idempotency-Key": "deleted"})
+    assert retry.status_code == 200
+    assert "Idempotent-Replayed" not in retry.headers
+    assert len(client.get(url).json()) == 1
+
+
+@pytest.mark.parametrize("retry_body", [{"heart_rate": 70}, {"heart_rate": 71}], ids=["replay", "mismatch"])
+def test_expired_keys_are_purged_by_requests_that_write_nothing(client, record, monkeypatch, retry_body):
+    from services import idempotency
+
+    url = f"/api/records/{record['id']}/vitals/"
+    old_key, key = f"expired-{retry_body['heart_rate']}", f"current-{retry_body['heart_rate']}"
+    client.post(url, json={"heart_rate": 70}, headers={"Idempotency-Key": old_key})
+    client.post(url, json={"heart_rate": 70}, headers={"Idempotency-Key": key})
+    with sqlite3.connect(DB_PATH) as other:
+        other.execute("UPDATE idempotency_keys SET created_at = '2000-01-01 00:00:00' WHERE key = ?", (old_key,))
+    monkeypatch.setattr(idempotency, "_next_purge", 0.0)
+
+    # Returns a replay or a 422: the request's own session is never committed
+    assert client.post(url, json=retry_body, headers={"Idempotency-Key": key}).status_code in (200, 422)
+    with sqlite3.connect(DB_PATH) as other:
+        keys = {row[0] for row in other.execute("SELECT key FROM idempotency_keys WHERE key IN (?, ?)",
+                                                 (old_key, key))}
+    assert keys == {key}
+    assert idempotency._next_purge > 0
+
+
+def test_overlong_key_is_400(client, record):
+    response = client.post(f"/api/records/{record['id']}/vitals/", json={"heart_rate": 70},
+                           headers={"Idempotency-Key": "k" * 300})
+    assert response.status_code == 400
+
+
+# Group commit
+def _count_vitals(record_id: int) -> int:
+    with sqlite3.connect(DB_PATH) as other:
+        return other.execute("SELECT count(*) FROM vital_signs WHERE record_id = ?", (record_id,)).fetchone()[0]
+
+
+def test_failed_write_in_a_batch_rolls_back_alone(record):
+    from models import models
+    from services import group_commit
+
+    def add_vital(db, heart_rate):
+        db.add(models.VitalSign(record_id=record["id"], heart_rate=heart_rate))
+        db.commit()
+        # Not visible to other connections before the whole batch commits
+        return _count_vitals(record["id"])
+
+    def add_vital_then_fail(db):
+        db.add(models.VitalSign(record_id=record["id"], heart_rate=1))
+        db.flush()
+        raise ValueError("rejected")
+
+    committer = group_commit.GroupCommitter(window_ms=200)
+    batches = []
+    commit = committer._commit
+    committer._commit = lambda batch: batches.append(len(batch)) or commit(batch)
+    try:
+        futures = [committer.submit(add_vital, 60), committer.submit(add_vital_then_fail),
+                   committer.submit(add_vital, 61)]
+        assert futures[0].result(timeout=10) == 0
+        with pytest.raises(ValueError):
+            futures[1].result(timeout=10)
+        assert futures[2].result(timeout=10) == 0
+    finally:
+        committer.stop()
+    assert batches == [3]
+    with sqlite3.connect(DB_PATH) as other:
+        rates = other.execute("SELECT heart_rate FROM vital_signs WHERE record_id = ? ORDER BY id",
+                              (record["id"],)).fetchall()
+    assert rates == [(60,), (61,)]
+
+
+def test_endpoints_write_through_group_commit(client, record, monkeypatch):
+    from services import group_commit
+
+    committer = group_commit.GroupCommitter()
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(group_commit, "committer", committer)
+    statuses = []
+
+    def post_vitals(heart_rate):
+        for _ in range(5):
+            response = client.post(f"/api/records/{record['id']}/vitals/", json={"heart_rate": heart_rate})
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post_vitals, args=(60 + i,)) for i in range(10)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        stale = client.put(f"/api/records/{record['id']}", json={"notes": "x", "version": record["version"] - 1})
+    finally:
+        committer.stop()
+    assert statuses == [200] * 50
+    assert _count_vitals(record["id"]) == 50
+    assert stale.status_code == 409
+
+
+# Write lock
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_more_concurrent_writes_than_threadpool_threads_complete(tmp_path):
+    # A real server: the hang needs the threadpool's 40 threads all waiting on the lock
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}/api"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path}/server.db")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port),
+                               "--log-level", "warning"], cwd=BACKEND_DIR, env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(f"{base_url}/medications/", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            assert time.monotonic() < deadline, "server did not start"
+            time.sleep(0.1)
+        location = httpx.post(f"{base_url}/locations/", json={"name": "Concurrency"}).json()
+        patient = httpx.post(f"{base_url}/patients/", json={
+            "open_dental_id": "concurrency", "first_name": "Test", "last_name": "Patient",
+            "date_of_birth": "1980-01-01T00:00:00",
+        }).json()
+
+        statuses = []
+
+        def create_record():
+            try:
+                response = httpx.post(f"{base_url}/records/", json={
+                    "patient_id": patient["id"], "location_id": location["id"]}, timeout=20)
+                statuses.append(response.status_code)
+            except httpx.TimeoutException:
+                statuses.append("timeout")
+
+        threads = [threading.Thread(target=create_record) for _ in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        assert statuses == [200] * 100
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # A hung worker does not finish its graceful shutdown
+            server.kill()
+            server.wait()
+
+
+# Query budgets
+def test_query_budgets():
+    # Seeds its own database; a subprocess because it configures the app before importing it
+    result = subprocess.run([sys.executable, "-m", "tools.check_queries"], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,173 @@
+"""Query-count budgets and query-plan checks for the hot endpoints.
+
+    python -m tools.check_queries [--vitals 300] [--administrations 20] [--verbose]
+
+Seeds a fresh SQLite file, calls each endpoint in ENDPOINTS through the
+ASGI app with the read caches disabled, and records every statement the
+call issues. A call fails when it issues more statements than its budget,
+or when EXPLAIN QUERY PLAN shows a full scan of one of GUARDED_TABLES.
+Exits non-zero on any failure, so it can gate CI.
+
+When a change legitimately needs another query, raise the budget in the
+same commit and say why.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUARDED_TABLES = ("vital_signs", "medication_administrations", "anesthesia_records")
+
+# (method, path, body, query budget); {record_id} and {open_dental_id} are filled in after seeding
+ENDPOINTS = [
+    ("GET", "/api/medications/", None, 1),
+    ("GET", "/api/locations/", None, 1),
+    ("GET", "/api/providers/", None, 1),
+    ("GET", "/api/patients/{open_dental_id}", None, 1),
+    ("GET", "/api/inventory/location/1", None, 1),
+    ("GET", "/api/records/{record_id}", None, 3),
+    ("GET", "/api/records/{record_id}?fields=id,anesthesia_start,aldrete_total", None, 1),
+    ("GET", "/api/records/{record_id}?fields=id&include=vitals", None, 2),
+    ("GET", "/api/records/{record_id}/vitals/", None, 2),
+    ("GET", "/api/records/{record_id}/vitals/?since=1", None, 2),
+    ("GET", "/api/records/draft?open_dental_id={open_dental_id}", None, 4),
+    ("GET", "/api/records/{record_id}/export/json", None, 3),
+    ("GET", "/api/records/{record_id}/export/markdown", None, 3),
+    ("POST", "/api/records/", {"patient_id": 1, "location_id": 1}, 5),
+    # The seeded record is still at version 1 here
+    ("PUT", "/api/records/{record_id}", {"asa_class": "II", "notes": "budget check", "version": 1}, 5),
+    ("PATCH", "/api/records/{record_id}/fields", {"changes": {"notes": {"value": "delta", "base": None}}}, 2),
+    ("POST", "/api/records/{record_id}/vitals/", {"heart_rate": 72, "spo2": 98}, 2),
+    ("POST", "/api/records/{record_id}/medications/", {"medication_id": 1, "dose_ml": 1.0}, 6),
+]
+
+_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)")
+
+
+def configure_environment(db_path: str):
+    # Must run before the app is imported: these are read at import time
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "AUTO_MIGRATE": "1",
+        "RECORD_CACHE_TTL": "0",
+        "REFERENCE_CACHE_TTL": "0",
+        "OPEN_DENTAL_URL": "",
+        # Group commit wraps each write in a SAVEPOINT pair; budgets count the endpoint's own statements
+        "GROUP_COMMIT": "0",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def seed(vitals: int, administrations: int) -> dict:
+    from datetime import datetime, timedelta
+
+    from models import SessionLocal, models
+    from models.migrations import migrate
+
+    migrate()
+    db = SessionLocal()
+    try:
+        location = models.Location(name="Main")
+        provider = models.Provider(name="Dr. Budget", role="surgeon")
+        db.add_all([location, provider])
+        db.flush()
+        medication_ids = [m.id for m in db.query(models.Medication).all()]
+        db.add(models.MedicationInventory(medication_id=medication_ids[0], location_id=location.id, quantity=100,
+                                          lot_number="L1", expiration_date=datetime(2030, 1, 1), supplier="Budget",
+                                          invoice_number="INV1", date_received=datetime(2025, 1, 1)))
+        start = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        record_id = None
+        # Several patients so lookups have other rows to skip past
+        for n in range(20):
+            patient = models.Patient(open_dental_id=f"budget-{n}", first_name="Budget", last_name=str(n),
+                                     date_of_birth=datetime(1980, 1, 1))
+            db.add(patient)
+            db.flush()
+            record = models.AnesthesiaRecord(patient_id=patient.id, location_id=location.id,
+                                             scheduled_at=start + timedelta(minutes=30 * n), monitors=["BP"])
+            db.add(record)
+            db.flush()
+            db.add_all(models.VitalSign(record_id=record.id, timestamp=start + timedelta(seconds=15 * i),
+                                        heart_rate=70, spo2=98) for i in range(vitals))
+            db.add_all(models.MedicationAdministration(record_id=record.id,
+                                                       medication_id=medication_ids[i % len(medication_ids)],
+                                                       dose_ml=1.0, timestamp=start + timedelta(minutes=i))
+                       for i in range(administrations))
+            if n == 10:
+                record_id, open_dental_id = record.id, patient.open_dental_id
+        db.commit()
+        return {"record_id": record_id, "open_dental_id": open_dental_id}
+    finally:
+        db.close()
+
+
+def full_scans(connection, statement: str, parameters) -> list:
+    plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = _SCAN.search(detail)
+        if match and match.group(1) in GUARDED_TABLES:
+            scans.append(detail)
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vitals", type=int, default=300)
+    parser.add_argument("--administrations", type=int, default=20)
+    parser.add_argument("--verbose", action="store_true", help="print every statement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(os.path.join(tmp, "budget.db"))
+        ids = seed(args.vitals, args.administrations)
+
+        from fastapi.testclient import TestClient
+        from sqlalchemy import event
+
+        from api.main import app
+        from models import engine
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters, executemany))
+
+        failures = 0
+        with TestClient(app, raise_server_exceptions=False) as client, engine.connect() as explain_conn:
+            event.listen(engine, "before_cursor_execute", capture)
+            print(f"{'endpoint':<68} {'queries':>7} {'budget':>6}  result")
+            for method, path, body, budget in ENDPOINTS:
+                url = path.format(**ids)
+                statements.clear()
+                response = client.request(method, url, json=body)
+                issued = list(statements)
+                problems = []
+                if response.status_code >= 400:
+                    problems.append(f"HTTP {response.status_code}")
+                if len(issued) > budget:
+                    problems.append("over budget")
+                for statement, parameters, executemany in issued:
+                    if executemany or not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                        continue
+                    for scan in full_scans(explain_conn, statement, parameters):
+                        problems.append(f"full scan: {scan}")
+                failures += bool(problems)
+                print(f"{method + ' ' + path:<68} {len(issued):>7} {budget:>6}  "
+                      f"{'; '.join(problems) or 'ok'}")
+                if args.verbose or problems:
+                    for statement, _, _ in issued:
+                        print(f"    {' '.join(statement.split())[:160]}")
+            event.remove(engine, "before_cursor_execute", capture)
+        engine.dispose()
+
+    if failures:
+        raise SystemExit(f"{failures} endpoint(s) failed the query checks")
+
+
+if __name__ == "__main__":
+    main()
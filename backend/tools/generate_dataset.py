@@ -0,0 +1,291 @@
+"""Deterministic synthetic dataset for scale testing.
+
+    python -m tools.generate_dataset --database-url sqlite:///./scale.db --records 100000
+    python -m tools.generate_dataset --records 200000 --vitals-interval 30 --seed 7
+
+Fills an empty database (tables are created if missing) with locations, providers, patients,
+inventory lots, and anesthesia records. Each record gets vitals every
+--vitals-interval seconds for its whole case and a plausible dosing
+pattern. The same arguments and --seed always produce the same rows.
+
+Distributions, roughly:
+- Case length is lognormal around 75 minutes, clipped to 20–240.
+- ASA class is I 40%, II 45%, III 13%, IV 2%.
+- Vitals random-walk around a per-patient baseline with small noise.
+- Doses are an induction bolus, then top-ups about every 15 minutes.
+
+100,000 records at the default 60 s interval make roughly 10M rows.
+
+Rows are written with DBAPI executemany in chunks, ids assigned up front.
+On SQLite the load runs with synchronous=OFF. Non-unique indexes on the record,
+vitals and administration tables are dropped first and rebuilt afterwards.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, inspect, text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, models
+
+CHUNK = 50_000
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria",
+               "Wei", "Mei", "Ahmed", "Fatima", "Raj", "Priya", "Olga", "Ivan", "Kenji", "Yuki"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+              "Lee", "Perez", "Thompson", "White", "Harris", "Chen", "Patel", "Kim", "Nguyen", "Ivanova"]
+PROVIDER_ROLES = ["anesthetist", "surgeon", "assistant", "circulator"]
+ASA_CLASSES = (["I"] * 40) + (["II"] * 45) + (["III"] * 13) + (["IV"] * 2)
+MONITOR_SETS = [["BP", "SpO2", "EKG"], ["BP", "SpO2", "EKG", "EtCO2"], ["BP", "SpO2", "EKG", "EtCO2", "Temp"]]
+LOCAL_ANESTHETICS = ["Articaine 4% 1:100k epi", "Lidocaine 2% 1:100k epi", "Mepivacaine 3% plain"]
+
+
+class Loader:
+    """Chunked executemany with the driver's own placeholder style"""
+
+    def __init__(self, connection, sqlite: bool):
+        self.connection = connection
+        self.sqlite = sqlite
+        self.placeholder = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+        self.counts = {}
+
+    def value(self, v):
+        # Store datetimes and JSON exactly as SQLAlchemy would on SQLite, so
+        # string comparisons on indexed datetime columns stay correct
+        if self.sqlite and isinstance(v, datetime):
+            return v.strftime("%Y-%m-%d %H:%M:%S.%f")
+        if isinstance(v, (list, dict)):
+            return json.dumps(v)
+        return v
+
+    def insert(self, table: str, columns, rows, convert: bool = True):
+        """convert=False for rows already holding driver-ready values (the hot tables)"""
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+               f"VALUES ({', '.join([self.placeholder] * len(columns))})")
+        batch = []
+        for row in rows:
+            batch.append(tuple(self.value(v) for v in row) if convert else row)
+            if len(batch) >= CHUNK:
+                self.connection.exec_driver_sql(sql, batch)
+                self.counts[table] = self.counts.get(table, 0) + len(batch)
+                batch = []
+        if batch:
+            self.connection.exec_driver_sql(sql, batch)
+            self.counts[table] = self.counts.get(table, 0) + len(batch)
+
+
+def reference_rows(rng: random.Random, args):
+    locations = [(i, f"Clinic {i}", f"{100 + i} Main St", str(i)) for i in range(1, args.locations + 1)]
+    providers = [(i, f"Dr. {rng.choice(LAST_NAMES)} {i}", PROVIDER_ROLES[i % 4], f"LIC{i:06d}")
+                 for i in range(1, args.providers + 1)]
+    patients = []
+    for i in range(1, args.patients + 1):
+        dob = datetime(1940, 1, 1) + timedelta(days=rng.randrange(365 * 75))
+        patients.append((i, f"syn-{i}", rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), dob, f"MRN{i:08d}"))
+    return locations, providers, patients
+
+
+def inventory_rows(rng: random.Random, args, medication_ids, start_day: datetime):
+    row_id = 0
+    for location_id in range(1, args.locations + 1):
+        for medication_id in medication_ids:
+            for lot in range(rng.randint(1, 4)):
+                row_id += 1
+                received = start_day + timedelta(days=rng.randrange(args.days))
+                yield (row_id, medication_id, location_id, f"LOT{location_id:03d}{medication_id:02d}{lot}",
+                       received + timedelta(days=rng.randint(180, 900)), rng.choice(["Henry Schein", "Patterson"]),
+                       f"INV{row_id:07d}", received, float(rng.randint(0, 50)))
+
+
+def case_rows(rng: random.Random, args, medication_ids, start_day: datetime, stamp):
+    """Yield (record, vitals, administrations) per case, in record id order.
+    Vitals and administrations carry timestamps already passed through stamp."""
+    vital_id = 0
+    admin_id = 0
+    induction = medication_ids[:2]
+    per_day = max(1, args.records // args.days)
+    for record_id in range(1, args.records + 1):
+        day = start_day + timedelta(days=(record_id - 1) // per_day)
+        scheduled = day.replace(hour=rng.randint(7, 16), minute=rng.choice((0, 15, 30, 45)))
+        length = min(240.0, max(20.0, rng.lognormvariate(math.log(75), 0.35)))
+        start = scheduled + timedelta(minutes=rng.randint(0, 20))
+        end = start + timedelta(minutes=length)
+        height = round(rng.gauss(170, 10), 1)
+        weight = round(rng.gauss(78, 16), 1)
+        asa = rng.choice(ASA_CLASSES)
+        aldrete = [2, 2, 2, 2 if rng.random() < 0.9 else 1, 2 if rng.random() < 0.95 else 1]
+        record = (
+            record_id, rng.randint(1, args.patients), rng.randint(1, args.locations), start - timedelta(hours=12),
+            end, scheduled, asa, False, rng.choice(["I", "II", "III", "IV"]), height, weight,
+            round(weight / (height / 100) ** 2, 1), start - timedelta(hours=rng.randint(6, 12)),
+            rng.randint(1, args.providers), rng.randint(1, args.providers),
+            rng.choice(["Catheter", "Catheter", "Butterfly"]), rng.choice(["20G", "22G", "24G"]),
+            rng.choice(["L hand", "R hand", "L AC", "R AC"]), rng.choice([1, 1, 1, 2]),
+            rng.choice(MONITOR_SETS), start, end, start + timedelta(minutes=5), end - timedelta(minutes=5),
+            True, True, True, True, True, True, True, *aldrete, sum(aldrete), end + timedelta(minutes=30), True, True,
+            {rng.choice(LOCAL_ANESTHETICS): rng.randint(1, 4)},
+        )
+
+        # Vitals: random walk around this patient's baseline
+        hr = rng.uniform(60, 90)
+        systolic = rng.uniform(105, 140)
+        diastolic = systolic * rng.uniform(0.55, 0.7)
+        temp = rng.uniform(36.3, 37.0)
+        vitals = []
+        steps = int(length * 60 // args.vitals_interval)
+        step = timedelta(seconds=args.vitals_interval)
+        random_ = rng.random
+        timestamp = start
+        for _ in range(steps):
+            vital_id += 1
+            hr = min(130.0, max(45.0, hr + (random_() - 0.5) * 4))
+            systolic = min(180.0, max(85.0, systolic + (random_() - 0.5) * 6))
+            diastolic = min(110.0, max(45.0, diastolic + (random_() - 0.5) * 4))
+            temp = min(37.8, max(35.8, temp + (random_() - 0.5) * 0.05))
+            s, d = int(systolic), int(diastolic)
+            vitals.append((vital_id, record_id, stamp(timestamp), s, d, (s + 2 * d) // 3, int(hr),
+                           100 if random_() < 0.6 else 99 - int(random_() * 4), 32 + int(random_() * 10),
+                           round(temp, 1)))
+            timestamp += step
+
+        # Doses: induction bolus, then top-ups
+        administrations = []
+        for medication_id in induction:
+            admin_id += 1
+            administrations.append((admin_id, record_id, medication_id, round(rng.uniform(1, 3), 1), 0.0,
+                                    stamp(start)))
+        elapsed = rng.expovariate(1 / 15)
+        while elapsed < length - 10:
+            admin_id += 1
+            administrations.append((admin_id, record_id, rng.choice(medication_ids), round(rng.uniform(0.5, 2), 1),
+                                    0.0, stamp(start + timedelta(minutes=elapsed))))
+            elapsed += rng.expovariate(1 / 15)
+        if rng.random() < 0.3:
+            admin_id += 1
+            administrations.append((admin_id, record_id, induction[0], 0.0, round(rng.uniform(0.5, 2), 1),
+                                    stamp(end)))
+        yield record, vitals, administrations
+
+
+RECORD_COLUMNS = (
+    "id", "patient_id", "location_id", "created_at", "updated_at", "scheduled_at", "asa_class", "asa_modifier_e",
+    "mallampati", "height_cm", "weight_kg", "bmi", "npo_since", "anesthetist_id", "surgeon_id", "iv_route",
+    "iv_gauge", "iv_site", "iv_attempts", "monitors", "anesthesia_start", "anesthesia_end", "surgery_start",
+    "surgery_end", "equipment_ready", "preop_instructions_given", "patient_procedure_verified",
+    "medical_history_reviewed", "allergies_reviewed", "medications_reviewed", "consults_reviewed",
+    "aldrete_activity", "aldrete_respiration", "aldrete_circulation", "aldrete_consciousness", "aldrete_color",
+    "aldrete_total", "discharge_time", "escort_present", "postop_instructions_given", "local_anesthetics",
+)
+VITAL_COLUMNS = ("id", "record_id", "timestamp", "bp_systolic", "bp_diastolic", "map", "heart_rate", "spo2", "etco2",
+                 "temperature")
+ADMIN_COLUMNS = ("id", "record_id", "medication_id", "dose_ml", "waste_ml", "timestamp")
+INVENTORY_COLUMNS = ("id", "medication_id", "location_id", "lot_number", "expiration_date", "supplier",
+                     "invoice_number", "date_received", "quantity")
+
+# Non-unique indexes on these are rebuilt after the load instead of maintained row by row
+BULK_TABLES = [models.AnesthesiaRecord.__table__, models.VitalSign.__table__,
+               models.MedicationAdministration.__table__]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./scale.db"))
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--patients", type=int, help="default: records / 3")
+    parser.add_argument("--locations", type=int, default=25)
+    parser.add_argument("--providers", type=int, default=60)
+    parser.add_argument("--days", type=int, default=365, help="spread records over this many days")
+    parser.add_argument("--vitals-interval", type=float, default=60, help="seconds between vital signs")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    args.patients = args.patients or max(1, args.records // 3)
+
+    engine = create_engine(args.database_url)
+    sqlite = engine.dialect.name == "sqlite"
+    if sqlite:
+        @event.listens_for(engine, "connect")
+        def _bulk_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.execute("PRAGMA cache_size=-262144")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        if connection.execute(text("SELECT COUNT(*) FROM anesthesia_records")).scalar():
+            raise SystemExit("anesthesia_records is not empty; generate into a fresh database")
+        if not connection.execute(text("SELECT COUNT(*) FROM medications")).scalar():
+            from services import crud
+            from sqlalchemy.orm import Session
+            crud.initialize_default_medications(Session(bind=connection))
+        medication_ids = [row[0] for row in connection.execute(text("SELECT id FROM medications ORDER BY id"))]
+
+    rng = random.Random(args.seed)
+    start_day = datetime(2024, 1, 1)
+    started = time.monotonic()
+
+    existing_indexes = {index["name"] for table in BULK_TABLES for index in inspect(engine).get_indexes(table.name)}
+    bulk_indexes = [index for table in BULK_TABLES for index in table.indexes
+                    if not index.unique and index.name in existing_indexes]
+    with engine.begin() as connection:
+        for index in bulk_indexes:
+            index.drop(bind=connection)
+
+    with engine.connect() as connection:
+        loader = Loader(connection, sqlite)
+        locations, providers, patients = reference_rows(rng, args)
+        loader.insert("locations", ("id", "name", "address", "open_dental_clinic_num"), locations)
+        loader.insert("providers", ("id", "name", "role", "license_number"), providers)
+        loader.insert("patients", ("id", "open_dental_id", "first_name", "last_name", "date_of_birth",
+                                   "medical_record_number"), patients)
+        loader.insert("medication_inventory", INVENTORY_COLUMNS,
+                      inventory_rows(rng, args, medication_ids, start_day))
+        connection.commit()
+
+        records, vitals, administrations = [], [], []
+        stamp = loader.value if sqlite else (lambda dt: dt)
+        for record, case_vitals, case_administrations in case_rows(rng, args, medication_ids, start_day, stamp):
+            records.append(record)
+            vitals.extend(case_vitals)
+            administrations.extend(case_administrations)
+            if len(vitals) >= CHUNK * 4:
+                loader.insert("anesthesia_records", RECORD_COLUMNS, records)
+                loader.insert("vital_signs", VITAL_COLUMNS, vitals, convert=False)
+                loader.insert("medication_administrations", ADMIN_COLUMNS, administrations, convert=False)
+                connection.commit()
+                records, vitals, administrations = [], [], []
+                total = sum(loader.counts.values())
+                elapsed = time.monotonic() - started
+                print(f"\r{loader.counts.get('anesthesia_records', 0):>9} records  {total:>11,} rows  "
+                      f"{total / elapsed:>9,.0f} rows/s", end="", flush=True)
+        loader.insert("anesthesia_records", RECORD_COLUMNS, records)
+        loader.insert("vital_signs", VITAL_COLUMNS, vitals, convert=False)
+        loader.insert("medication_administrations", ADMIN_COLUMNS, administrations, convert=False)
+        connection.commit()
+
+    print("\nrebuilding indexes...", flush=True)
+    with engine.begin() as connection:
+        for index in bulk_indexes:
+            index.create(bind=connection)
+        if sqlite:
+            connection.exec_driver_sql("ANALYZE")
+
+    elapsed = time.monotonic() - started
+    total = sum(loader.counts.values())
+    for table, count in loader.counts.items():
+        print(f"{table:<28} {count:>12,}")
+    print(f"{'total':<28} {total:>12,} rows in {elapsed:.0f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Local stand-in for the Open Dental API.
+
+Run next to the backend and point OPEN_DENTAL_URL at it:
+
+    uvicorn tools.mock_open_dental:app --port 8100
+    OPEN_DENTAL_URL=http://localhost:8100 uvicorn api.main:app
+
+MOCK_OD_LATENCY_MS adds a delay to every response and MOCK_OD_FAIL_RATE
+makes that fraction of requests return 503, to exercise the retry paths.
+Patients 1..MOCK_OD_PATIENTS exist; any other PatNum returns 404.
+/appointments serves MOCK_OD_APPOINTMENTS_PER_DAY deterministic bookings
+for any date.
+"""
+import asyncio
+import os
+import random
+from datetime import date, datetime, timedelta
+
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+
+MOCK_OD_LATENCY_MS = float(os.getenv("MOCK_OD_LATENCY_MS", "0"))
+MOCK_OD_FAIL_RATE = float(os.getenv("MOCK_OD_FAIL_RATE", "0"))
+MOCK_OD_PATIENTS = int(os.getenv("MOCK_OD_PATIENTS", "1000"))
+MOCK_OD_APPOINTMENTS_PER_DAY = int(os.getenv("MOCK_OD_APPOINTMENTS_PER_DAY", "24"))
+MOCK_OD_CLINICS = int(os.getenv("MOCK_OD_CLINICS", "2"))
+
+FIRST_NAMES = ["Allen", "Maria", "James", "Priya", "Chen", "Olivia", "Samuel", "Fatima"]
+LAST_NAMES = ["Allowed", "Garcia", "Smith", "Patel", "Wong", "Brown", "Okafor", "Nguyen"]
+
+app = FastAPI(title="Mock Open Dental API")
+
+commlogs = []
+responses_by_key = {}
+stats = {"requests": 0, "failures": 0, "duplicates": 0, "patient_lookups": 0}
+
+
+async def simulate_network():
+    stats["requests"] += 1
+    if MOCK_OD_LATENCY_MS:
+        await asyncio.sleep(MOCK_OD_LATENCY_MS / 1000)
+    if random.random() < MOCK_OD_FAIL_RATE:
+        stats["failures"] += 1
+        raise HTTPException(status_code=503, detail="Simulated outage")
+
+
+def make_patient(pat_num: int) -> dict:
+    # Deterministic so repeated lookups of one PatNum agree
+    rng = random.Random(pat_num)
+    return {
+        "PatNum": pat_num,
+        "FName": rng.choice(FIRST_NAMES),
+        "LName": rng.choice(LAST_NAMES),
+        "Birthdate": f"{rng.randint(1940, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "ChartNumber": f"MRN{pat_num:06d}",
+    }
+
+
+@app.get("/patients/{pat_num}")
+async def get_patient(pat_num: str):
+    await simulate_network()
+    stats["patient_lookups"] += 1
+    if not pat_num.isdigit() or not 1 <= int(pat_num) <= MOCK_OD_PATIENTS:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return make_patient(int(pat_num))
+
+
+def make_schedule(day: date) -> list:
+    # Deterministic per day: 30-minute slots from 07:00 across the clinics
+    rng = random.Random(day.toordinal())
+    start = datetime.combine(day, datetime.min.time()) + timedelta(hours=7)
+    return [
+        {
+            "AptNum": day.toordinal() * 1000 + i,
+            "PatNum": rng.randint(1, MOCK_OD_PATIENTS),
+            "AptDateTime": (start + timedelta(minutes=30 * (i // MOCK_OD_CLINICS))).strftime("%Y-%m-%d %H:%M:%S"),
+            "ClinicNum": i % MOCK_OD_CLINICS + 1,
+            "Op": i % MOCK_OD_CLINICS + 1,
+            "AptStatus": "Scheduled",
+        }
+        for i in range(MOCK_OD_APPOINTMENTS_PER_DAY)
+    ]
+
+
+@app.get("/appointments")
+async def get_appointments(day: date = Query(..., alias="date"), offset: int = Query(0, alias="Offset")):
+    await simulate_network()
+    return make_schedule(day)[offset:offset + 100]
+
+
+@app.post("/commlogs", status_code=201)
+async def create_commlog(commlog: dict, idempotency_key: str = Header(None)):
+    await simulate_network()
+    if idempotency_key and idempotency_key in responses_by_key:
+        stats["duplicates"] += 1
+        return responses_by_key[idempotency_key]
+
+    created = {
+        "CommlogNum": len(commlogs) + 1,
+        "SecDateTEdit": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        **commlog,
+    }
+    commlogs.append(created)
+    if idempotency_key:
+        responses_by_key[idempotency_key] = created
+    return created
+
+
+@app.get("/commlogs")
+async def list_commlogs():
+    return commlogs
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "commlogs": len(commlogs)}
+
+
+@app.post("/reset", status_code=204)
+async def reset():
+    commlogs.clear()
+    responses_by_key.clear()
+    for key in stats:
+        stats[key] = 0
+    return Response(status_code=204)
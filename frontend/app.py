@@ -1,14 +1,39 @@
 import streamlit as st
 import requests
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import date, datetime, timedelta
 import time
 import pandas as pd
 import json
 from typing import Optional
 import os
+import uuid
+
+from debug_panel import render_debug_panel
+from instrumentation import finish_rerun, http, start_rerun, timed
+from layout import inject_css, keep_hidden_widget_state, section_picker
 
 # API configuration
 API_URL = "http://localhost:8000/api"
+# Retries of record, dose and vitals POSTs (api_post(idempotent=True)) and the
+# seconds each attempt may take
+POST_RETRIES = int(os.getenv("POST_RETRIES", "2"))
+POST_TIMEOUT = float(os.getenv("POST_TIMEOUT", "10"))
+COLUMNAR_JSON = "application/vnd.anesthesia.columnar+json"
+# Live vitals poll for new samples this often (0 turns polling off) and keep
+# the newest VITALS_BUFFER_ROWS in the session
+VITALS_REFRESH_SECONDS = float(os.getenv("VITALS_REFRESH_SECONDS", "5"))
+VITALS_BUFFER_ROWS = int(os.getenv("VITALS_BUFFER_ROWS", "720"))
+VITAL_CHANNELS = ("timestamp", "bp_systolic", "bp_diastolic", "map", "heart_rate", "spo2", "etco2", "temperature")
+# Shown to other stations editing the same record
+STATION_NAME = os.getenv("STATION_NAME")
+# Record fields kept in the session as datetimes (timer buttons) or as times
+# of day under another key (time inputs)
+TIMER_FIELDS = ("anesthesia_start", "anesthesia_end", "surgery_start", "surgery_end", "inhalation_start", "inhalation_end")
+TIME_OF_DAY_KEYS = {"npo_since": "npo_since", "discharge_time": "discharge_time_input"}
+# Fields this app does not take over from other stations: the provider
+# selectboxes hold names, not ids
+NOT_ADOPTED = ("anesthetist_id", "surgeon_id", "assistant_id", "circulator_id", "bmi")
 
 # Page config
 st.set_page_config(
@@ -41,32 +66,120 @@ if 'local_anesthetics' not in st.session_state:
 # Helper functions
 def api_get(endpoint):
     try:
-        response = requests.get(f"{API_URL}{endpoint}")
+        response = http.get(f"{API_URL}{endpoint}")
         response.raise_for_status()
         return response.json()
     except:
         return None
 
-def api_post(endpoint, data):
+def api_get_vitals_since(record_id, cursor):
+    # Only samples with an id above cursor; the next cursor comes back in a header
+    try:
+        response = http.get(f"{API_URL}/records/{record_id}/vitals/", params={"since": cursor},
+                            headers={"Accept": COLUMNAR_JSON})
+        response.raise_for_status()
+        return response.json(), int(response.headers.get("X-Vitals-Cursor", cursor))
+    except:
+        return None, cursor
+
+def api_post(endpoint, data, idempotent=False):
+    """idempotent: send an Idempotency-Key and resend on a timeout, lost
+    connection or 5xx; the backend creates the row once however often it arrives"""
+    headers = {"Idempotency-Key": str(uuid.uuid4())} if idempotent else None
+    attempts = 1 + POST_RETRIES if idempotent else 1
     try:
-        response = requests.post(f"{API_URL}{endpoint}", json=data)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = http.post(f"{API_URL}{endpoint}", json=data, headers=headers,
+                                     timeout=POST_TIMEOUT if idempotent else None)
+                if response.status_code < 500 or last:
+                    break
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
         response.raise_for_status()
         return response.json()
     except Exception as e:
         st.error(f"API Error: {str(e)}")
         return None
 
-def api_put(endpoint, data):
+def api_patch_fields(record_id, changes):
     try:
-        response = requests.put(f"{API_URL}{endpoint}", json=data)
+        response = http.patch(f"{API_URL}/records/{record_id}/fields",
+                              json={"changes": changes, "station": STATION_NAME})
         response.raise_for_status()
         return response.json()
     except:
         return None
 
+# Field-level saving. Only the fields changed since the last save are sent,
+# each with the version this session last saw, so two stations editing one
+# record no longer overwrite each other's fields. A field another station
+# changed in the meantime comes back as a conflict; its value is taken over.
+def adopt_fields(values):
+    # Only before the widgets are drawn, i.e. from create_or_load_record()
+    for field, value in values.items():
+        if value is None or field in NOT_ADOPTED:
+            continue
+        if field in TIMER_FIELDS:
+            st.session_state[field] = datetime.fromisoformat(value)
+        elif field in TIME_OF_DAY_KEYS:
+            st.session_state[TIME_OF_DAY_KEYS[field]] = datetime.fromisoformat(value).time()
+        else:
+            st.session_state[field] = value
+
+def sync_record_fields(record):
+    if record and st.session_state.get("fields_record_id") != record["id"]:
+        # First load of this record: start from what other stations saved
+        versions = record.get("field_versions") or {}
+        st.session_state.fields_record_id = record["id"]
+        st.session_state.field_versions = dict(versions)
+        st.session_state.saved_fields = {field: record.get(field) for field in versions}
+        adopt_fields(st.session_state.saved_fields)
+    remote = st.session_state.pop("remote_values", None)
+    if remote:
+        adopt_fields(remote)
+
+def save_fields(values):
+    saved = st.session_state.setdefault("saved_fields", {})
+    versions = st.session_state.setdefault("field_versions", {})
+    changes = {
+        field: {"value": value, "base": versions.get(field, 0)}
+        for field, value in values.items()
+        # Empty defaults of fields nobody has written are not worth a version
+        if (saved[field] != value if field in saved else bool(value))
+    }
+    if not changes:
+        return {"applied": {}, "conflicts": {}, "rejected": {}}
+    result = api_patch_fields(st.session_state.record_id, changes)
+    if result is None:
+        return None
+    for field, version in result["applied"].items():
+        saved[field] = values[field]
+        versions[field] = version
+    for field in result["rejected"]:
+        # Not resent until it changes again
+        saved[field] = values[field]
+    if result["conflicts"]:
+        remote = st.session_state.setdefault("remote_values", {})
+        for field, conflict in result["conflicts"].items():
+            saved[field] = remote[field] = conflict["value"]
+            versions[field] = conflict["version"]
+        st.warning("Changed at another station, their values were kept: " + ", ".join(result["conflicts"]))
+    return result
+
 def load_patient():
     if st.session_state.patient_id:
-        patient = api_get(f"/patients/{st.session_state.patient_id}")
+        # Reruns reuse the patient loaded earlier in this session
+        cached = st.session_state.get('patient')
+        if cached and cached.get("open_dental_id") == str(st.session_state.patient_id):
+            return cached
+        
+        # The backend serves the local copy, refreshed from Open Dental (and
+        # cached) when one is configured
+        patient = api_get(f"/open-dental/patient/{st.session_state.patient_id}")
         if not patient:
             # Create dummy patient for demo
             patient_data = {
@@ -76,24 +189,36 @@ def load_patient():
                 "date_of_birth": "1990-01-01T00:00:00",
                 "medical_record_number": "MRN123456"
             }
-            patient = api_post("/patients/", patient_data)
+            patient = api_get(f"/patients/{st.session_state.patient_id}") or api_post("/patients/", patient_data)
+        if patient:
+            st.session_state.patient = patient
         return patient
     return None
 
+@timed
 def create_or_load_record():
     if not st.session_state.record_id and st.session_state.patient_id:
         patient = load_patient()
         if patient:
+            # Prefer the shell the backend prefetched for today's appointment
+            draft = api_get(f"/records/draft?open_dental_id={patient['open_dental_id']}&location_id={st.session_state.location_id}")
+            if draft:
+                st.session_state.record_id = draft["id"]
+                sync_record_fields(draft)
+                return draft
             record_data = {
                 "patient_id": patient["id"],
                 "location_id": st.session_state.location_id
             }
-            record = api_post("/records/", record_data)
+            record = api_post("/records/", record_data, idempotent=True)
             if record:
                 st.session_state.record_id = record["id"]
+                sync_record_fields(record)
                 return record
     elif st.session_state.record_id:
-        return api_get(f"/records/{st.session_state.record_id}")
+        record = api_get(f"/records/{st.session_state.record_id}")
+        sync_record_fields(record)
+        return record
     return None
 
 def save_record():
@@ -105,7 +230,7 @@ def save_record():
             "mallampati": st.session_state.get("mallampati"),
             "height_cm": st.session_state.get("height_cm"),
             "weight_kg": st.session_state.get("weight_kg"),
-            "npo_since": st.session_state.get("npo_since").isoformat() if st.session_state.get("npo_since") else None,
+            "npo_since": datetime.combine(date.today(), st.session_state.npo_since).isoformat() if st.session_state.get("npo_since") else None,
             "anesthetist_id": st.session_state.get("anesthetist_id"),
             "surgeon_id": st.session_state.get("surgeon_id"),
             "assistant_id": st.session_state.get("assistant_id"),
@@ -132,8 +257,8 @@ def save_record():
             height_m = update_data["height_cm"] / 100
             update_data["bmi"] = update_data["weight_kg"] / (height_m ** 2)
         
-        result = api_put(f"/records/{st.session_state.record_id}", update_data)
-        if result:
+        result = save_fields(update_data)
+        if result is not None:
             st.session_state.last_save = datetime.now()
             return True
     return False
@@ -146,6 +271,8 @@ def auto_save():
 
 # Main app
 def main():
+    start_rerun()
+    inject_css(PREOP_CSS)
     st.title("Anesthesia Record System")
     
     # Load or create record
@@ -168,21 +295,23 @@ def main():
             if save_record():
                 st.success("Record saved!")
     
-    # Tabs
-    tab1, tab2, tab3 = st.tabs(["Anesthetic Record", "Preop Checklist", "Post Anesthesia Score"])
-    
-    with tab1:
-        render_anesthetic_record_tab()
-    
-    with tab2:
-        render_preop_checklist_tab()
-    
-    with tab3:
-        render_post_anesthesia_score_tab()
+    # Sections; only the chosen one is rendered
+    sections = {
+        "Anesthetic Record": render_anesthetic_record_tab,
+        "Preop Checklist": render_preop_checklist_tab,
+        "Post Anesthesia Score": render_post_anesthesia_score_tab,
+    }
+    sections[section_picker(list(sections), key="section")]()
     
     # Auto-save every 30 seconds
     auto_save()
+    
+    keep_hidden_widget_state()
+    finish_rerun()
+    render_debug_panel(API_URL)
 
+@st.fragment
+@timed
 def render_anesthetic_record_tab():
     # Physical Assessment
     st.subheader("Physical Assessment")
@@ -300,6 +429,7 @@ def render_anesthetic_record_tab():
     st.subheader("Notes")
     st.text_area("Additional notes", height=100, key="notes")
 
+@timed
 def render_medications_section():
     st.subheader("Medications")
     
@@ -329,7 +459,7 @@ def render_medications_section():
                         "dose_ml": dose_ml,
                         "waste_ml": waste_ml
                     }
-                    result = api_post(f"/records/{st.session_state.record_id}/medications/", admin_data)
+                    result = api_post(f"/records/{st.session_state.record_id}/medications/", admin_data, idempotent=True)
                     if result:
                         st.session_state.medications_given.append(result)
                         st.rerun()
@@ -375,6 +505,7 @@ def render_medications_section():
                 st.write(f"**Total Waste:** {df['Waste (mL)'].sum():.1f} mL")
                 st.write(f"**Total Drawn:** {df['Total (mL)'].sum():.1f} mL")
 
+@timed
 def render_vital_signs_section():
     st.subheader("Vital Signs")
     
@@ -413,31 +544,53 @@ def render_vital_signs_section():
                         "temperature": temp if temp > 30 else None
                     }
                     
-                    result = api_post(f"/records/{st.session_state.record_id}/vitals/", vital_data)
+                    # The live panel below picks the new sample up in this same run
+                    result = api_post(f"/records/{st.session_state.record_id}/vitals/", vital_data, idempotent=True)
                     if result:
                         st.success("Vital signs added")
-                        st.rerun()
     
     # Display vital signs
     if st.session_state.record_id:
-        record = api_get(f"/records/{st.session_state.record_id}")
-        if record and record.get("vital_signs"):
-            df_data = []
-            for vs in record["vital_signs"]:
-                df_data.append({
-                    "Time": datetime.fromisoformat(vs["timestamp"]).strftime("%H:%M"),
-                    "BP": f"{vs['bp_systolic']}/{vs['bp_diastolic']}" if vs['bp_systolic'] else "",
-                    "MAP": vs['map'] or "",
-                    "HR": vs['heart_rate'] or "",
-                    "SpO2": f"{vs['spo2']}%" if vs['spo2'] else "",
-                    "EtCO2": vs['etco2'] or "",
-                    "Temp": f"{vs['temperature']}°C" if vs['temperature'] else ""
-                })
-            
-            if df_data:
-                df = pd.DataFrame(df_data)
-                st.dataframe(df, hide_index=True)
+        render_live_vitals()
 
+@st.fragment(run_every=VITALS_REFRESH_SECONDS or None)
+@timed
+def render_live_vitals():
+    # Polls on its own timer and redraws only this panel
+    record_id = st.session_state.record_id
+    live = st.session_state.get("live_vitals")
+    if not live or live["record_id"] != record_id:
+        live = {"record_id": record_id, "cursor": 0, "rows": deque(maxlen=VITALS_BUFFER_ROWS)}
+        st.session_state.live_vitals = live
+    
+    vitals, live["cursor"] = api_get_vitals_since(record_id, live["cursor"])
+    if vitals:
+        live["rows"].extend(zip(*(vitals[name] for name in VITAL_CHANNELS)))
+    if not live["rows"]:
+        return
+    
+    # Buffered rows are tuples in VITAL_CHANNELS order; show them by time
+    rows = sorted(live["rows"], key=lambda row: row[0])
+    columns = dict(zip(VITAL_CHANNELS, zip(*rows)))
+    
+    def channel(name, suffix=""):
+        return [f"{v}{suffix}" if v else "" for v in columns[name]]
+    
+    df = pd.DataFrame({
+        "Time": pd.to_datetime(list(columns["timestamp"])).strftime("%H:%M"),
+        "BP": [f"{s}/{d}" if s else "" for s, d in zip(columns["bp_systolic"], columns["bp_diastolic"])],
+        "MAP": channel("map"),
+        "HR": channel("heart_rate"),
+        "SpO2": channel("spo2", "%"),
+        "EtCO2": channel("etco2"),
+        "Temp": channel("temperature", "°C")
+    })
+    st.dataframe(df, hide_index=True)
+    if VITALS_REFRESH_SECONDS:
+        st.caption(f"Live, every {VITALS_REFRESH_SECONDS:g}s · {len(rows)} samples")
+
+@st.fragment
+@timed
 def render_local_anesthetics_section():
     st.subheader("Local Anesthetics")
     
@@ -475,17 +628,18 @@ def render_local_anesthetics_section():
                 if st.button("+", key=f"plus_{anes_type}"):
                     st.session_state.local_anesthetics[anes_type] += 1
 
+# Header box styles of the preop checklist, injected by main()
+PREOP_CSS = """
+<style>
+.blue-header { background-color: #b3d9e6; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
+.yellow-section { background-color: #f9f3c9; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
+.purple-section { background-color: #c9d1e6; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
+</style>
+"""
+
+@st.fragment
+@timed
 def render_preop_checklist_tab():
-    # Header with patient info in blue box style
-    with st.container():
-        st.markdown("""
-        <style>
-        .blue-header { background-color: #b3d9e6; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
-        .yellow-section { background-color: #f9f3c9; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
-        .purple-section { background-color: #c9d1e6; padding: 10px; border-radius: 5px; margin-bottom: 10px; }
-        </style>
-        """, unsafe_allow_html=True)
-    
     # Patient info and timeout verification
     col1, col2, col3 = st.columns([2, 2, 1])
     with col1:
@@ -815,12 +969,14 @@ def render_preop_checklist_tab():
             # For now, store in notes field as JSON
             import json
             update_data = {
-                "notes": json.dumps({"preop_checklist": preop_data}, indent=2)
+                "notes": json.dumps({"preop_checklist": preop_data}, indent=2, default=str)
             }
-            result = api_put(f"/records/{st.session_state.record_id}", update_data)
-            if result:
+            result = save_fields(update_data)
+            if result is not None and "notes" in result["applied"]:
                 st.success("Pre-Operative Checklist saved!")
 
+@st.fragment
+@timed
 def render_post_anesthesia_score_tab():
     st.subheader("Post Anesthesia Score (Aldrete)")
     
@@ -920,8 +1076,8 @@ def render_post_anesthesia_score_tab():
             update_data["discharge_time"] = discharge_datetime.isoformat()
         
         if st.session_state.record_id:
-            result = api_put(f"/records/{st.session_state.record_id}", update_data)
-            if result:
+            result = save_fields(update_data)
+            if result is not None:
                 st.success("Post-anesthesia score saved!")
     
     # Export options
@@ -945,7 +1101,7 @@ def render_post_anesthesia_score_tab():
             if st.session_state.record_id:
                 result = api_post(f"/open-dental/push-record/{st.session_state.record_id}", {})
                 if result:
-                    st.success("Record pushed to Open Dental (stub)")
+                    st.success("Record queued for Open Dental")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
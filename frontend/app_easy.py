@@ -6,9 +6,18 @@ import pandas as pd
 import json
 from typing import Optional
 import os
+import uuid
+
+from debug_panel import render_debug_panel
+from instrumentation import finish_rerun, http, start_rerun, timed
+from layout import inject_css, keep_hidden_widget_state, section_picker
 
 # API configuration
 API_URL = "http://localhost:8000/api"
+# Retries of the record POST (api_post(idempotent=True)) and the
+# seconds each attempt may take
+POST_RETRIES = int(os.getenv("POST_RETRIES", "2"))
+POST_TIMEOUT = float(os.getenv("POST_TIMEOUT", "10"))
 
 # Page config
 st.set_page_config(
@@ -17,8 +26,8 @@ st.set_page_config(
     layout="wide"
 )
 
-# Custom CSS for EASy styling
-st.markdown("""
+# Custom CSS for EASy styling, injected by main()
+EASY_CSS = """
 <style>
     /* Set white background for main containers */
     .main {
@@ -217,7 +226,7 @@ st.markdown("""
         background-color: #4a5568 !important;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # Initialize session state
 if 'record_id' not in st.session_state:
@@ -236,15 +245,29 @@ if 'vital_signs' not in st.session_state:
 # Helper functions
 def api_get(endpoint):
     try:
-        response = requests.get(f"{API_URL}{endpoint}")
+        response = http.get(f"{API_URL}{endpoint}")
         response.raise_for_status()
         return response.json()
     except:
         return None
 
-def api_post(endpoint, data):
+def api_post(endpoint, data, idempotent=False):
+    """idempotent: send an Idempotency-Key and resend on a timeout, lost
+    connection or 5xx; the backend creates the row once however often it arrives"""
+    headers = {"Idempotency-Key": str(uuid.uuid4())} if idempotent else None
+    attempts = 1 + POST_RETRIES if idempotent else 1
     try:
-        response = requests.post(f"{API_URL}{endpoint}", json=data)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = http.post(f"{API_URL}{endpoint}", json=data, headers=headers,
+                                     timeout=POST_TIMEOUT if idempotent else None)
+                if response.status_code < 500 or last:
+                    break
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -252,7 +275,7 @@ def api_post(endpoint, data):
 
 def api_put(endpoint, data):
     try:
-        response = requests.put(f"{API_URL}{endpoint}", json=data)
+        response = http.put(f"{API_URL}{endpoint}", json=data)
         response.raise_for_status()
         return response.json()
     except:
@@ -260,7 +283,14 @@ def api_put(endpoint, data):
 
 def load_patient():
     if st.session_state.patient_id:
-        patient = api_get(f"/patients/{st.session_state.patient_id}")
+        # Reruns reuse the patient loaded earlier in this session
+        cached = st.session_state.get('patient')
+        if cached and cached.get("open_dental_id") == str(st.session_state.patient_id):
+            return cached
+        
+        # The backend serves the local copy, refreshed from Open Dental (and
+        # cached) when one is configured
+        patient = api_get(f"/open-dental/patient/{st.session_state.patient_id}")
         if not patient:
             # Create dummy patient for demo
             patient_data = {
@@ -270,19 +300,27 @@ def load_patient():
                 "date_of_birth": "1980-05-06T00:00:00",
                 "medical_record_number": "11"
             }
-            patient = api_post("/patients/", patient_data)
+            patient = api_get(f"/patients/{st.session_state.patient_id}") or api_post("/patients/", patient_data)
+        if patient:
+            st.session_state.patient = patient
         return patient
     return None
 
+@timed
 def create_or_load_record():
     if not st.session_state.record_id and st.session_state.patient_id:
         patient = load_patient()
         if patient:
+            # Prefer the shell the backend prefetched for today's appointment
+            draft = api_get(f"/records/draft?open_dental_id={patient['open_dental_id']}&location_id={st.session_state.location_id}")
+            if draft:
+                st.session_state.record_id = draft["id"]
+                return draft
             record_data = {
                 "patient_id": patient["id"],
                 "location_id": st.session_state.location_id
             }
-            record = api_post("/records/", record_data)
+            record = api_post("/records/", record_data, idempotent=True)
             if record:
                 st.session_state.record_id = record["id"]
                 return record
@@ -298,30 +336,27 @@ def save_record():
 
 # Main app
 def main():
+    start_rerun()
+    inject_css(EASY_CSS, PREOP_CSS)
     # Create or load record
     record = create_or_load_record()
     patient = load_patient()
     
-    # Tabs - Preop Checklist first
-    tab1, tab2, tab3, tab4 = st.tabs(["Preop Checklist", "Anesthetic Record", "Post Anesthesia Score", "Inventory"])
-    
-    with tab1:
-        render_preop_checklist_tab()
-    
-    with tab2:
-        render_anesthetic_record_tab()
+    # Sections - Preop Checklist first; only the chosen one is rendered
+    sections = {
+        "Preop Checklist": render_preop_checklist_tab,
+        "Anesthetic Record": render_anesthetic_record_tab,
+        "Post Anesthesia Score": render_post_anesthesia_score_tab,
+        "Inventory": render_inventory_tab,
+    }
+    sections[section_picker(list(sections), key="section")]()
     
-    with tab3:
-        render_post_anesthesia_score_tab()
-        
-    with tab4:
-        render_inventory_tab()
+    keep_hidden_widget_state()
+    finish_rerun()
+    render_debug_panel(API_URL)
 
-def render_preop_checklist_tab():
-    patient = load_patient()
-    
-    # Custom CSS for bordered sections with different colors
-    st.markdown("""
+# Bordered sections of the preop checklist, injected by main()
+PREOP_CSS = """
     <style>
     .header-section { 
         background-color: #e6f2ff;  /* Light blue like PDF */
@@ -567,7 +602,12 @@ def render_preop_checklist_tab():
         }
     }
     </style>
-    """, unsafe_allow_html=True)
+"""
+
+@st.fragment
+@timed
+def render_preop_checklist_tab():
+    patient = load_patient()
     
     # Header Section - Light Blue
     st.markdown('<div class="header-section">', unsafe_allow_html=True)
@@ -1338,6 +1378,8 @@ def render_preop_checklist_tab_old():
             save_record()
             st.success("Saved and Closed!")
 
+@st.fragment
+@timed
 def render_anesthetic_record_tab():
     patient = load_patient()
     
@@ -1596,6 +1638,8 @@ def render_anesthetic_record_tab():
     df_inhal = pd.DataFrame(inhal_data)
     st.dataframe(df_inhal, hide_index=True)
 
+@st.fragment
+@timed
 def render_post_anesthesia_score_tab():
     st.subheader("Post Anesthesia Score (Aldrete)")
     
@@ -1611,7 +1655,7 @@ def render_post_anesthesia_score_tab():
     total_score = 0
     for item, options in score_items:
         score = st.radio(item, options=[0, 1, 2], 
-                        format_func=lambda x: options[x], 
+                        format_func=lambda x, options=options: options[x], 
                         key=f"aldrete_{item.lower()}")
         total_score += score
     
@@ -1629,6 +1673,8 @@ def render_post_anesthesia_score_tab():
         save_record()
         st.success("Saved!")
 
+@st.fragment
+@timed
 def render_inventory_tab():
     st.subheader("Medication Inventory")
     
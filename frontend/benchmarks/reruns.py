@@ -0,0 +1,120 @@
+"""Headless rerun benchmark for the Streamlit apps, built on AppTest.
+
+    python -m benchmarks.reruns                        # both apps, backend at localhost:8000
+    python -m benchmarks.reruns --app app_easy.py --iterations 20 --json reruns.json
+
+Each scenario opens a section, then repeats a scripted interaction (a
+button click, a text input, ...) and the rerun it triggers --iterations
+times on one session. AppTest always reruns the whole script, so fragment
+reruns are measured as full reruns of the open section.
+
+Reports p50/p95 rerun latency, plus the API calls, bytes and slowest
+sections (instrumentation.py) of the median rerun. The apps talk to the real
+backend, so start it first; the numbers include its latency.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+FRONTEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(FRONTEND_DIR)
+
+from instrumentation import STATE_KEY
+
+# name -> (section to open first, function(at) performing the interaction);
+# an interaction of None is a plain rerun
+SCENARIOS = {
+    "app.py": {
+        "idle rerun": (None, None),
+        "carpule +": ("Anesthetic Record", lambda at: at.button(key="plus_Articaine 4% 1:100k epi").click()),
+        "notes typed": ("Anesthetic Record", lambda at: at.text_area(key="notes").input(f"note {time.time_ns()}")),
+        "save": (None, lambda at: at.button[0].click()),
+        "preop open": ("Preop Checklist", None),
+    },
+    "app_easy.py": {
+        "idle rerun": (None, None),
+        "preop open": ("Preop Checklist", None),
+        "quick dose": ("Anesthetic Record", lambda at: at.button(key="quick_1.0").click()),
+        "anesthesia open": ("Anesthetic Record", lambda at: at.button(key="anes_open").click()),
+        "medication picked": ("Anesthetic Record",
+                              lambda at: at.selectbox(key="selected_med").select("Fentanyl 50 mcg/mL")),
+    },
+}
+
+
+def run_scenario(at: AppTest, section, interaction, iterations: int) -> dict:
+    if section is not None and at.radio(key="section").value != section:
+        at.radio(key="section").set_value(section).run()
+    samples = []
+    for _ in range(iterations):
+        if interaction is not None:
+            interaction(at)
+        start = time.perf_counter()
+        at.run()
+        elapsed = (time.perf_counter() - start) * 1000
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        samples.append((elapsed, at.session_state[STATE_KEY]["history"][-1]))
+    samples.sort(key=lambda sample: sample[0])
+    times = [elapsed for elapsed, _ in samples]
+    median_rerun = samples[len(samples) // 2][1]
+    return {
+        "p50_ms": round(statistics.median(times), 1),
+        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 1),
+        "api_calls": median_rerun["api_calls"],
+        "api_kb": median_rerun["api_kb"],
+        "sections": median_rerun["sections"],
+    }
+
+
+def run_app(app: str, args) -> dict:
+    at = AppTest.from_file(os.path.join(FRONTEND_DIR, app), default_timeout=args.timeout)
+    if args.patient_id:
+        at.query_params["patient_id"] = args.patient_id
+    start = time.perf_counter()
+    at.run()
+    first_ms = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    results = {"first run": {"p50_ms": round(first_ms, 1), "p95_ms": round(first_ms, 1),
+                             **{k: at.session_state[STATE_KEY]["history"][-1][k]
+                                for k in ("api_calls", "api_kb", "sections")}}}
+    for name, (section, interaction) in SCENARIOS[app].items():
+        results[name] = run_scenario(at, section, interaction, args.iterations)
+    return results
+
+
+def print_app(app: str, results: dict):
+    print(f"\n{app}")
+    print(f"  {'scenario':<20} {'p50 ms':>8} {'p95 ms':>8} {'API':>4} {'API KB':>7}  slowest sections")
+    for name, r in results.items():
+        slowest = sorted(r["sections"].items(), key=lambda item: item[1], reverse=True)[:3]
+        print(f"  {name:<20} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['api_calls']:>4} {r['api_kb']:>7.1f}  "
+              + ", ".join(f"{section} {ms:.0f}" for section, ms in slowest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--patient-id", default="bench-1", help="?patient_id= for the session")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds allowed per rerun")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for app in args.app:
+        results[app] = run_app(app, args)
+        print_app(app, results[app])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Debug sidebar for the Streamlit apps.
+
+Shown when DEBUG_PANEL=1 or the page is opened with ?debug=1. Reports the
+last rerun's section timings and API calls (instrumentation.py), the
+size of each st.session_state entry, the growth of this session since its
+first run, the sizes of the other sessions served by this process, and the
+process RSS. With ADMIN_TOKEN set it also shows the backend's memory status.
+"""
+import os
+import sys
+import time
+
+import requests
+import streamlit as st
+
+from instrumentation import STATE_KEY, last_rerun
+
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "0") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Warn once a session's state has grown this much since its first run
+STATE_GROWTH_ALERT_KB = float(os.getenv("STATE_GROWTH_ALERT_KB", "2048"))
+# Sessions not seen for this long are dropped from the process-wide table
+SESSION_STALE_SECONDS = 3600
+
+# Module state is shared by every session in the process
+_session_sizes = {}
+
+
+def deep_size(obj, seen=None) -> int:
+    """Approximate bytes held by obj and everything it references"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+def _session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else "unknown"
+    except ImportError:
+        return "unknown"
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def state_sizes() -> dict:
+    return {key: deep_size(value) for key, value in st.session_state.items()}
+
+
+def enabled() -> bool:
+    return DEBUG_PANEL or st.query_params.get("debug") == "1"
+
+
+def render_rerun_profile():
+    rerun = last_rerun()
+    if rerun is None:
+        return
+    st.metric("Last rerun", f"{rerun['total_ms']:.0f} ms",
+              f"{rerun['api_calls']} API calls, {rerun['api_kb']} KB, {rerun['api_ms']:.0f} ms", delta_color="off")
+    st.caption("Sections (inclusive ms)")
+    st.table([{"section": name, "ms": ms}
+              for name, ms in sorted(rerun["sections"].items(), key=lambda item: item[1], reverse=True)])
+    if rerun["api"]:
+        st.caption("API calls this rerun")
+        st.table([{"call": f"{call['method']} {call['path']}", "status": call["status"],
+                   "KB": round(call["bytes"] / 1024, 1), "ms": call["ms"]} for call in rerun["api"]])
+    history = st.session_state[STATE_KEY]["history"]
+    st.caption(f"Last {len(history)} reruns")
+    st.table([{"at": r["at"], "scope": r["scope"], "ms": r["total_ms"], "API calls": r["api_calls"],
+               "API KB": r["api_kb"]}
+              for r in reversed(history)])
+
+
+def render_debug_panel(api_url: str):
+    if not enabled():
+        return
+
+    sizes = state_sizes()
+    total = sum(sizes.values())
+    session_id = _session_id()
+    now = time.time()
+    first_total = _session_sizes.get(session_id, {}).get("first", total)
+    _session_sizes[session_id] = {"first": first_total, "total": total, "seen": now}
+    for sid in [sid for sid, entry in _session_sizes.items() if now - entry["seen"] > SESSION_STALE_SECONDS]:
+        del _session_sizes[sid]
+
+    with st.sidebar.expander("🔧 Debug", expanded=False):
+        render_rerun_profile()
+
+        growth_kb = (total - first_total) / 1024
+        st.metric("Session state", f"{total / 1024:.1f} KB", f"{growth_kb:+.1f} KB since first run")
+        if growth_kb > STATE_GROWTH_ALERT_KB:
+            st.warning(f"Session state grew {growth_kb:.0f} KB (alert at {STATE_GROWTH_ALERT_KB:.0f} KB)")
+
+        rows = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:15]
+        st.caption("Largest session_state keys")
+        st.table([
+            {"key": key, "KB": round(size / 1024, 1),
+             "items": len(st.session_state[key]) if isinstance(st.session_state[key], (list, dict)) else ""}
+            for key, size in rows
+        ])
+
+        st.caption(f"Sessions in this process: {len(_session_sizes)}")
+        st.table([
+            {"session": sid[:8], "KB": round(entry["total"] / 1024, 1),
+             "growth KB": round((entry["total"] - entry["first"]) / 1024, 1)}
+            for sid, entry in sorted(_session_sizes.items(), key=lambda item: item[1]["total"], reverse=True)
+        ])
+
+        rss = _rss_mb()
+        if rss is not None:
+            st.write(f"Streamlit RSS: {rss:.0f} MB")
+
+        if ADMIN_TOKEN:
+            try:
+                response = requests.get(f"{api_url}/admin/memory", headers={"X-Admin-Token": ADMIN_TOKEN}, timeout=2)
+                response.raise_for_status()
+                backend = response.json()
+                st.write(f"Backend RSS: {backend['rss_mb']} MB ({backend['growth_mb'] or 0:+} MB since start)")
+                if backend["alert"]:
+                    st.warning("Backend memory growth is over its alert threshold")
+            except Exception as e:
+                st.caption(f"Backend memory status unavailable: {e}")
@@ -0,0 +1,109 @@
+"""Rerun profiling for the Streamlit apps.
+
+main() calls start_rerun() first and finish_rerun() before the debug panel.
+In between:
+
+- functions decorated with @timed add their wall time to the rerun's
+  sections. Times are inclusive, so a section called from a tab counts in both.
+  Called outside main() (an st.fragment rerun), the function is timed as a
+  rerun of its own, recorded with the function name as its scope.
+- requests sent through `http` are counted with their status, bytes and time
+
+The last RERUN_HISTORY reruns are kept in st.session_state for the debug
+panel (debug_panel.py) and the AppTest benchmark (benchmarks/reruns.py).
+"""
+import time
+from collections import deque
+from functools import wraps
+from urllib.parse import urlsplit
+
+import requests
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+RERUN_HISTORY = 20
+STATE_KEY = "_rerun_profile"
+
+
+def _profile() -> dict:
+    if STATE_KEY not in st.session_state:
+        st.session_state[STATE_KEY] = {"current": None, "history": deque(maxlen=RERUN_HISTORY)}
+    return st.session_state[STATE_KEY]
+
+
+def _current():
+    try:
+        return _profile()["current"]
+    except Exception:
+        # Outside a script run (e.g. a background thread) there is no session
+        return None
+
+
+def start_rerun():
+    _profile()["current"] = {"started": time.perf_counter(), "sections": {}, "api": []}
+
+
+def finish_rerun(scope: str = "full") -> dict:
+    profile = _profile()
+    current = profile["current"]
+    if current is None:
+        return {}
+    summary = {
+        "at": time.strftime("%H:%M:%S"),
+        "scope": scope,
+        "total_ms": round((time.perf_counter() - current["started"]) * 1000, 1),
+        "sections": {name: round(ms, 1) for name, ms in current["sections"].items()},
+        "api": current["api"],
+        "api_calls": len(current["api"]),
+        "api_kb": round(sum(call["bytes"] for call in current["api"]) / 1024, 1),
+        "api_ms": round(sum(call["ms"] for call in current["api"]), 1),
+    }
+    profile["history"].append(summary)
+    profile["current"] = None
+    return summary
+
+
+def last_rerun():
+    history = _profile()["history"]
+    return history[-1] if history else None
+
+
+def timed(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        current = _current()
+        fragment_rerun = False
+        if current is None:
+            if get_script_run_ctx() is None:
+                return fn(*args, **kwargs)
+            # main() did not run: a fragment rerun, and this call is all of it
+            start_rerun()
+            current = _current()
+            fragment_rerun = True
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sections = current["sections"]
+            sections[fn.__name__] = sections.get(fn.__name__, 0) + (time.perf_counter() - start) * 1000
+            if fragment_rerun:
+                finish_rerun(scope=fn.__name__)
+    return wrapper
+
+
+def _count_response(response, *args, **kwargs):
+    current = _current()
+    if current is not None:
+        current["api"].append({
+            "method": response.request.method,
+            "path": urlsplit(response.url).path,
+            "status": response.status_code,
+            "bytes": len(response.content),
+            "ms": round(response.elapsed.total_seconds() * 1000, 1),
+        })
+    return response
+
+
+# Shared by the api_* helpers; also reuses connections across reruns
+http = requests.Session()
+http.hooks["response"].append(_count_response)
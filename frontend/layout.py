@@ -0,0 +1,49 @@
+"""Layout helpers shared by the Streamlit apps.
+
+st.tabs runs every tab body on every rerun. section_picker renders only the
+chosen section, and main() calls the section function for it alone; the
+section functions are st.fragment, so their own widgets rerun only their
+section. Heavy sections therefore cost nothing until they are opened.
+
+Streamlit drops the state of widgets that were not drawn in a full rerun.
+keep_hidden_widget_state() keeps the values of the sections not shown, so
+save_record() still sees the whole form.
+"""
+import re
+
+import streamlit as st
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+
+@st.cache_data(show_spinner=False)
+def _minify(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    return re.sub(r"\s+", " ", css).strip()
+
+
+def inject_css(*blocks: str):
+    """Call from main() only. Elements of the full rerun stay in place across
+    fragment reruns, so the styles are not sent again with every click."""
+    st.markdown(_minify("".join(blocks)), unsafe_allow_html=True)
+
+
+def section_picker(labels, key: str) -> str:
+    return st.radio("Section", labels, key=key, horizontal=True, label_visibility="collapsed")
+
+
+def keep_hidden_widget_state():
+    """Call at the end of main(). Re-assigning a key turns it into plain
+    session state, which outlives its widget; keys drawn this run cannot be
+    (and need not be) re-assigned."""
+    ctx = get_script_run_ctx()
+    drawn = ctx.widget_user_keys_this_run if ctx else set()
+    for key in list(st.session_state.keys()):
+        value = st.session_state[key]
+        # None and False read the same as a missing key, and include buttons
+        if key in drawn or value is None or value is False:
+            continue
+        try:
+            st.session_state[key] = value
+        except StreamlitAPIException:
+            pass